@@ -0,0 +1,121 @@
+"""
+日誌寫入的准入控制模組
+依進行中的請求數、推播佇列深度與資料庫延遲判斷是否過載；
+資料庫延遲在沒有新樣本時依 ADMISSION_DB_LATENCY_HALF_LIFE_SECONDS 隨時間衰減
+（合併寫入與過載拒絕時大部分請求不會碰到資料庫，不衰減的話一次延遲尖峰會一直停在過載狀態）；
+過載時優先犧牲低風險日誌（取樣或以 429 + Retry-After 拒絕），緊急日誌永遠接受。
+"""
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict
+import app.constants as constants
+import app.dispatcher as dispatcher
+from app.settings import settings
+
+# 准入狀態
+STATE_NORMAL = "normal"        # 正常：全部接受
+STATE_SHEDDING = "shedding"    # 過載：普通日誌取樣接受，高風險與緊急全部接受
+STATE_CRITICAL = "critical"    # 嚴重過載：普通日誌全部拒絕，高風險取樣接受，緊急全部接受
+
+# 資料庫延遲的指數移動平均權重
+EWMA_ALPHA = 0.2
+
+_lock = threading.Lock()
+_inflight = 0
+_db_latency_ms = 0.0
+_db_latency_at = 0.0
+_sample_counter = 0
+_accepted: Dict[int, int] = {}
+_rejected: Dict[int, int] = {}
+
+
+# 目前的資料庫延遲（最後一次樣本之後依經過時間衰減）
+def db_latency() -> float:
+    if _db_latency_at == 0:
+        return 0.0
+    elapsed = max(0.0, time.monotonic() - _db_latency_at)
+    return _db_latency_ms * 0.5 ** (elapsed / settings.ADMISSION_DB_LATENCY_HALF_LIFE_SECONDS)
+
+
+# 記錄一次資料庫呼叫的延遲
+def record_db_latency(ms: float) -> None:
+    global _db_latency_ms, _db_latency_at
+    with _lock:
+        current = db_latency()
+        _db_latency_ms = ms if _db_latency_at == 0 else EWMA_ALPHA * ms + (1 - EWMA_ALPHA) * current
+        _db_latency_at = time.monotonic()
+
+
+# 目前的負載比例（任一指標達到上限即為 1）
+def load() -> float:
+    return max(
+        _inflight / settings.ADMISSION_MAX_INFLIGHT,
+        dispatcher.queue_depth() / settings.ADMISSION_MAX_QUEUE_DEPTH,
+        db_latency() / settings.ADMISSION_MAX_DB_LATENCY_MS
+    )
+
+
+def state() -> str:
+    current = load()
+    if current >= settings.ADMISSION_CRITICAL_FACTOR:
+        return STATE_CRITICAL
+    if current >= 1:
+        return STATE_SHEDDING
+    return STATE_NORMAL
+
+
+# 取樣：每 ADMISSION_SAMPLE_RATE 筆只接受 1 筆
+def _sampled() -> bool:
+    global _sample_counter
+    _sample_counter += 1
+    return _sample_counter % settings.ADMISSION_SAMPLE_RATE == 0
+
+
+# 判斷是否接受此風險等級的日誌
+def admit(risk_level: int) -> bool:
+    current = state()
+    with _lock:
+        if risk_level >= constants.RISK_LEVEL_EMERGENCY or current == STATE_NORMAL:
+            accepted = True
+        elif risk_level == constants.RISK_LEVEL_HIGH:
+            accepted = current == STATE_SHEDDING or _sampled()
+        else:
+            accepted = current == STATE_SHEDDING and _sampled()
+        counters = _accepted if accepted else _rejected
+        counters[risk_level] = counters.get(risk_level, 0) + 1
+    return accepted
+
+
+# 追蹤進行中的寫入請求（直接寫入與排入分片佇列都計入）
+@contextmanager
+def inflight():
+    global _inflight
+    with _lock:
+        _inflight += 1
+    try:
+        yield
+    finally:
+        with _lock:
+            _inflight -= 1
+
+
+# 目前的准入狀態與計數
+def stats() -> Dict[str, Any]:
+    with _lock:
+        return {
+            "state": state(),
+            "load": round(load(), 3),
+            "inflight": _inflight,
+            "queue_depth": dispatcher.queue_depth(),
+            "db_latency_ms": round(db_latency(), 2),
+            "accepted": dict(_accepted),
+            "rejected": dict(_rejected),
+            "limits": {
+                "max_inflight": settings.ADMISSION_MAX_INFLIGHT,
+                "max_queue_depth": settings.ADMISSION_MAX_QUEUE_DEPTH,
+                "max_db_latency_ms": settings.ADMISSION_MAX_DB_LATENCY_MS,
+                "critical_factor": settings.ADMISSION_CRITICAL_FACTOR,
+                "sample_rate": settings.ADMISSION_SAMPLE_RATE
+            }
+        }
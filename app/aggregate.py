@@ -0,0 +1,237 @@
+"""
+串流彙總引擎
+預先彙總的時間桶（timeseries）只涵蓋固定的維度與保存期間，任意日期範圍與分組的統計仍需要讀取原始資料。
+此模組以 id 分頁（keyset）逐批讀取 TB_LOGS（涵蓋封存分區時一併讀取封存檔），
+每批轉為 numpy 陣列後以向量運算累加到各分組，記憶體用量只與分組數與批次大小有關，與日期範圍無關。
+
+支援的分組維度見 DIMENSIONS，每個分組計算：
+- rows: 資料筆數
+- sum: count 總和（實際發生次數）
+- max: 單筆最大的 count
+"""
+import datetime
+import itertools
+import logging
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence
+import numpy as np
+import app.archive as archive
+import app.database as db
+from app.object import DBFilter
+from app.settings import settings
+
+logger = logging.getLogger(__name__)
+
+# 可分組的維度與型別（數值維度缺值視為 0，文字維度缺值視為 Unknown）
+DIMENSIONS = {
+    "riskLevel": int,
+    "type": int,
+    "location": str,
+    "function": str,
+    "date": str
+}
+METRICS = ("rows", "sum", "max")
+UNKNOWN = "Unknown"
+
+
+# 依 id 分頁讀取符合條件的熱資料，只取需要的欄位（唯讀複本可用時使用複本）
+def scan(filters: List[DBFilter], columns: Sequence[str], page_size: Optional[int] = None) -> Iterator[List[Dict[str, Any]]]:
+    page_size = page_size or settings.AGG_PAGE_SIZE
+    select = ",".join(dict.fromkeys(["id", *columns]))
+    last_id = 0
+    while True:
+        def query(client):
+            query = client.table("TB_LOGS").select(select).gt("id", last_id)
+            return db.makeFilter(query, filters).order("id").limit(page_size).execute()
+        rows = db.read(query).data or []
+        if rows:
+            yield rows
+        if len(rows) < page_size:
+            return
+        last_id = rows[-1]["id"]
+
+
+# 將資料列分成固定大小的批次
+def chunked(rows: Iterable[Dict[str, Any]], size: int) -> Iterator[List[Dict[str, Any]]]:
+    iterator = iter(rows)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+# 日期範圍內的日誌（熱資料 + 封存資料），以批次回傳
+def log_chunks(
+        date_from: Optional[datetime.date],
+        date_to: Optional[datetime.date],
+        filters: List[DBFilter],
+        columns: Sequence[str],
+        page_size: Optional[int] = None
+    ) -> Iterator[List[Dict[str, Any]]]:
+    """
+    日誌依最後發生日期封存，仍在發生的問題即使第一次發生的日期很早也留在熱資料表，
+    因此熱資料表讀取整個日期範圍；落在封存分區日期內的熱資料 id 用來排除封存檔中的重複資料
+    （封存後刪除失敗而殘留在熱資料表的資料列，以熱資料表的內容為準）
+    """
+    page_size = page_size or settings.AGG_PAGE_SIZE
+    date_filters = []
+    if date_from:
+        date_filters.append(DBFilter(name="date", operator=db.Opreator.GREATER_OR_EQUAL, values=[str(date_from)]))
+    if date_to:
+        date_filters.append(DBFilter(name="date", operator=db.Opreator.LESS_OR_EQUAL, values=[str(date_to)]))
+    if not archive.covers("TB_LOGS", date_from):
+        yield from scan(filters + date_filters, columns, page_size)
+        return
+
+    partitions = archive.load_manifest("TB_LOGS")["partitions"]
+    overlap_until = max(partitions)
+    overlap_ids = set()
+    for rows in scan(filters + date_filters, [*columns, "date"], page_size):
+        overlap_ids.update(row["id"] for row in rows if str(row.get("date"))[:10] <= overlap_until)
+        yield rows
+
+    archived = (
+        row for row in archive.read_archived("TB_LOGS", date_from, date_to, filters)
+        if row.get("id") not in overlap_ids
+    )
+    yield from chunked(archived, page_size)
+
+
+class Aggregation:
+    """單一分組方式的累加結果（分組值編碼後以 numpy 陣列保存各項指標）"""
+
+    def __init__(self, group_by: Sequence[str], max_groups: Optional[int] = None):
+        for dimension in group_by:
+            if dimension not in DIMENSIONS:
+                raise ValueError(f"不支援的分組維度: {dimension}")
+        self.group_by = tuple(group_by)
+        self.max_groups = max_groups or settings.AGG_MAX_GROUPS
+        # 每個維度的 值 → 編碼，以及 分組編碼 → 分組 id
+        self._codes: List[Dict[Any, int]] = [{} for _ in self.group_by]
+        self._values: List[List[Any]] = [[] for _ in self.group_by]
+        self._groups: Dict[tuple, int] = {}
+        self._keys: List[tuple] = []
+        self.rows = np.zeros(0, dtype=np.int64)
+        self.sum = np.zeros(0, dtype=np.int64)
+        self.max = np.zeros(0, dtype=np.int64)
+
+    def _encode(self, position: int, values: np.ndarray) -> np.ndarray:
+        """將一批的維度值轉為全域編碼（只對批次內不重複的值查字典）"""
+        unique, inverse = np.unique(values, return_inverse=True)
+        codes = self._codes[position]
+        mapping = np.empty(len(unique), dtype=np.int64)
+        for i, value in enumerate(unique.tolist()):
+            code = codes.get(value)
+            if code is None:
+                code = codes[value] = len(self._values[position])
+                self._values[position].append(value)
+            mapping[i] = code
+        return mapping[inverse.reshape(-1)]
+
+    def _group_ids(self, columns: Dict[str, np.ndarray], size: int) -> np.ndarray:
+        if not self.group_by:
+            if not self._keys:
+                self._groups[()] = 0
+                self._keys.append(())
+            return np.zeros(size, dtype=np.int64)
+        codes = np.stack([self._encode(i, columns[dimension]) for i, dimension in enumerate(self.group_by)], axis=1)
+        unique, inverse = np.unique(codes, axis=0, return_inverse=True)
+        mapping = np.empty(len(unique), dtype=np.int64)
+        for i, key in enumerate(map(tuple, unique.tolist())):
+            group = self._groups.get(key)
+            if group is None:
+                if len(self._keys) >= self.max_groups:
+                    raise ValueError(f"分組數超過上限 {self.max_groups}，請縮小範圍或減少分組維度")
+                group = self._groups[key] = len(self._keys)
+                self._keys.append(key)
+            mapping[i] = group
+        return mapping[inverse.reshape(-1)]
+
+    def add(self, columns: Dict[str, np.ndarray], counts: np.ndarray) -> None:
+        """累加一批資料：columns 為各維度的陣列，counts 為每筆的 count"""
+        groups = self._group_ids(columns, len(counts))
+        size = len(self._keys)
+        if size > len(self.rows):
+            grow = size - len(self.rows)
+            self.rows = np.concatenate([self.rows, np.zeros(grow, dtype=np.int64)])
+            self.sum = np.concatenate([self.sum, np.zeros(grow, dtype=np.int64)])
+            self.max = np.concatenate([self.max, np.zeros(grow, dtype=np.int64)])
+        self.rows += np.bincount(groups, minlength=size)
+        np.add.at(self.sum, groups, counts)
+        np.maximum.at(self.max, groups, counts)
+
+    def result(self, order_by: str = "sum", limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """依指定指標由大到小排序回傳各分組"""
+        if order_by not in METRICS:
+            raise ValueError(f"不支援的排序指標: {order_by}")
+        metric = getattr(self, order_by)
+        order = np.argsort(-metric, kind="stable")
+        if limit is not None:
+            order = order[:limit]
+        result = []
+        for group in order.tolist():
+            item = {
+                dimension: self._values[position][code]
+                for position, (dimension, code) in enumerate(zip(self.group_by, self._keys[group]))
+            }
+            item.update(rows=int(self.rows[group]), sum=int(self.sum[group]), max=int(self.max[group]))
+            result.append(item)
+        return result
+
+    def totals(self) -> Dict[str, int]:
+        return {
+            "rows": int(self.rows.sum()),
+            "sum": int(self.sum.sum()),
+            "max": int(self.max.max()) if len(self.max) else 0
+        }
+
+    @property
+    def group_count(self) -> int:
+        return len(self._keys)
+
+
+# 將一批資料列轉為各維度的陣列
+def to_columns(rows: List[Dict[str, Any]], dimensions: Iterable[str]) -> Dict[str, np.ndarray]:
+    columns = {}
+    for dimension in dimensions:
+        if DIMENSIONS[dimension] is int:
+            columns[dimension] = np.fromiter((row.get(dimension) or 0 for row in rows), dtype=np.int64, count=len(rows))
+        elif dimension == "date":
+            columns[dimension] = np.array([str(row.get(dimension))[:10] if row.get(dimension) else UNKNOWN for row in rows], dtype=str)
+        else:
+            columns[dimension] = np.array([row.get(dimension) or UNKNOWN for row in rows], dtype=str)
+    return columns
+
+
+# 將批次資料同時累加到多個分組方式（只讀一次資料）
+def aggregate(chunks: Iterable[List[Dict[str, Any]]], aggregations: Sequence[Aggregation]) -> Sequence[Aggregation]:
+    dimensions = list(dict.fromkeys(d for aggregation in aggregations for d in aggregation.group_by))
+    for rows in chunks:
+        columns = to_columns(rows, dimensions)
+        counts = np.fromiter((row.get("count") or 1 for row in rows), dtype=np.int64, count=len(rows))
+        for aggregation in aggregations:
+            aggregation.add(columns, counts)
+    return aggregations
+
+
+# 查詢日期範圍內的日誌並依指定維度彙總
+def query(
+        group_by: Sequence[str],
+        date_from: Optional[datetime.date],
+        date_to: Optional[datetime.date],
+        filters: Optional[List[DBFilter]] = None,
+        order_by: str = "sum",
+        limit: Optional[int] = None
+    ) -> Dict[str, Any]:
+    grouped = Aggregation(group_by)
+    total = Aggregation(())
+    if order_by not in METRICS:
+        raise ValueError(f"不支援的排序指標: {order_by}")
+    columns = [*grouped.group_by, "count"]
+    aggregate(log_chunks(date_from, date_to, filters or [], columns), [grouped, total])
+    return {
+        "group_by": list(grouped.group_by),
+        "total": total.totals(),
+        "group_count": grouped.group_count,
+        "groups": grouped.result(order_by, limit)
+    }
@@ -0,0 +1,327 @@
+"""
+冷熱資料分層模組
+將超過保留天數的 TB_LOGS / TB_NOTIFICATION_HISTORY 資料搬出熱資料表，
+以日期分區的 jsonl.gz 檔案保存，並維護一份小型 manifest 索引；
+查詢的日期範圍涵蓋已封存的區間時，可透過 read_archived 透明地讀取封存資料。
+
+- 日誌依最後發生日期（last_seen）判斷是否超過保留天數，持續發生的問題不會因為第一次發生得早而被封存
+- 先封存通知歷史再封存日誌，仍有通知歷史留在熱資料表的日誌先不封存（TB_NOTIFICATION_HISTORY.log_id 外鍵）
+- 刪除失敗後重新執行會再寫一次同一批資料，讀取時同一分區內以 id 去除重複（保留較新的檔案）
+
+目錄結構：
+    {ARCHIVE_DIR}/{table}/manifest.json
+    {ARCHIVE_DIR}/{table}/date=2024-12-07/part-20250307T020000-0001.jsonl.gz
+
+執行方式（建議以排程每日執行一次，同時間只執行一個）：
+    python -m app.archive
+    python -m app.archive --table TB_LOGS --days 30
+"""
+import argparse
+import datetime
+import gzip
+import json
+import logging
+import os
+import re
+from typing import Any, Dict, Iterator, List, Optional
+import app.counter as counter
+import app.database as db
+import app.versions as versions
+from app.object import DBFilter
+from app.settings import settings
+
+logger = logging.getLogger(__name__)
+
+# 可封存的資料表與其分區用的日期欄位（依封存順序：通知歷史參照日誌，需先封存）
+TABLES = {
+    "TB_NOTIFICATION_HISTORY": "sent_at",
+    "TB_LOGS": "date"
+}
+# 判斷是否超過保留天數的日期欄位
+AGE_COLUMNS = {
+    "TB_NOTIFICATION_HISTORY": "sent_at",
+    "TB_LOGS": "last_seen"
+}
+
+
+def _retention_days(table: str) -> int:
+    if table == "TB_LOGS":
+        return settings.ARCHIVE_LOGS_AFTER_DAYS
+    return settings.ARCHIVE_NOTIFICATIONS_AFTER_DAYS
+
+
+def _table_dir(table: str) -> str:
+    return os.path.join(settings.ARCHIVE_DIR, table)
+
+
+def _manifest_path(table: str) -> str:
+    return os.path.join(_table_dir(table), "manifest.json")
+
+
+# manifest 快取：{資料表: (檔案修改時間, manifest)}
+_manifest_cache: Dict[str, tuple] = {}
+
+
+# 讀取 manifest（不存在時回傳空索引，檔案未變更時使用快取）
+def load_manifest(table: str) -> Dict[str, Any]:
+    path = _manifest_path(table)
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return {"table": table, "archived_before": None, "partitions": {}}
+    cached = _manifest_cache.get(table)
+    if cached and cached[0] == mtime:
+        return cached[1]
+    with open(path, "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    _manifest_cache[table] = (mtime, manifest)
+    return manifest
+
+
+# 先寫入暫存檔再取代，避免中途失敗留下損毀的 manifest
+def _save_manifest(table: str, manifest: Dict[str, Any]) -> None:
+    path = _manifest_path(table)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2, sort_keys=True)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+# 已封存區間的上界（此日期之前的資料都在封存檔中）
+def archived_before(table: str) -> Optional[datetime.date]:
+    value = load_manifest(table).get("archived_before")
+    return datetime.date.fromisoformat(value) if value else None
+
+
+# 查詢的開始日期是否涵蓋到已封存的分區
+def covers(table: str, date_from: Optional[datetime.date]) -> bool:
+    if date_from is None:
+        return False
+    partitions = load_manifest(table)["partitions"]
+    return bool(partitions) and date_from.isoformat() <= max(partitions)
+
+
+# 將一批資料依日期分區寫入新的 part 檔，回傳 {分區日期: (檔名, 筆數)}
+def _write_partitions(table: str, rows: List[Dict[str, Any]], batch_no: int, run_id: str) -> Dict[str, tuple]:
+    date_column = TABLES[table]
+    grouped: Dict[str, List[Dict[str, Any]]] = {}
+    for row in rows:
+        grouped.setdefault(str(row.get(date_column))[:10], []).append(row)
+
+    written = {}
+    for partition, partition_rows in grouped.items():
+        partition_dir = os.path.join(_table_dir(table), f"date={partition}")
+        os.makedirs(partition_dir, exist_ok=True)
+        filename = f"part-{run_id}-{batch_no:04d}.jsonl.gz"
+        with gzip.open(os.path.join(partition_dir, filename), "wt", encoding="utf-8") as f:
+            for row in partition_rows:
+                f.write(json.dumps(row, ensure_ascii=False))
+                f.write("\n")
+        written[partition] = (filename, len(partition_rows))
+    return written
+
+
+# 排除仍有通知歷史在熱資料表的日誌（刪除會違反外鍵），查詢失敗時回傳 None
+def _without_hot_history(rows: List[Dict[str, Any]]) -> Optional[List[Dict[str, Any]]]:
+    ids = [str(row["id"]) for row in rows]
+    try:
+        result = db.supabase.table("TB_NOTIFICATION_HISTORY").select("log_id").in_("log_id", ids).execute()
+    except Exception as e:
+        logger.error(f"查詢日誌的通知歷史時發生錯誤: {e}", exc_info=True)
+        return None
+    referenced = {row["log_id"] for row in result.data or []}
+    if referenced:
+        logger.info(f"{len(referenced)} 筆日誌仍有未封存的通知歷史，本次不封存")
+    return [row for row in rows if row["id"] not in referenced]
+
+
+# 封存單一資料表
+def archive_table(table: str, older_than_days: Optional[int] = None) -> int:
+    """
+    分批（依 id 往後）將日期早於 (今天 - older_than_days) 的資料寫入封存檔並從熱資料表刪除。
+    每批依序：寫入 part 檔 → 更新 manifest → 刪除資料列 → 清除日誌的次數快取，
+    刪除失敗時停止（資料仍在熱資料表，讀取時以 id 去除重複）。回傳封存筆數
+    """
+    if table not in TABLES:
+        raise ValueError(f"不支援封存的資料表: {table}")
+    age_column = AGE_COLUMNS[table]
+    days = older_than_days if older_than_days is not None else _retention_days(table)
+    cutoff = datetime.date.today() - datetime.timedelta(days=days)
+    run_id = datetime.datetime.now().strftime("%Y%m%dT%H%M%S")
+    os.makedirs(_table_dir(table), exist_ok=True)
+    manifest = json.loads(json.dumps(load_manifest(table)))
+
+    total = 0
+    batch_no = 0
+    last_id = 0
+    while True:
+        try:
+            result = (
+                db.supabase.table(table).select("*")
+                .lt(age_column, cutoff.isoformat())
+                .gt("id", last_id)
+                .order("id")
+                .limit(settings.ARCHIVE_BATCH_SIZE)
+                .execute()
+            )
+        except Exception as e:
+            logger.error(f"查詢待封存的 {table} 資料時發生錯誤: {e}", exc_info=True)
+            break
+        rows = result.data or []
+        if not rows:
+            break
+        last_id = rows[-1]["id"]
+        full_batch = len(rows) >= settings.ARCHIVE_BATCH_SIZE
+        if table == "TB_LOGS":
+            rows = _without_hot_history(rows)
+            if rows is None:
+                break
+            if not rows:
+                if full_batch:
+                    continue
+                break
+
+        batch_no += 1
+        for partition, (filename, count) in _write_partitions(table, rows, batch_no, run_id).items():
+            entry = manifest["partitions"].setdefault(partition, {"files": [], "rows": 0})
+            if filename not in entry["files"]:
+                entry["files"].append(filename)
+            entry["rows"] += count
+        _save_manifest(table, manifest)
+
+        ids = [str(row["id"]) for row in rows]
+        if db.delete(table, [DBFilter(name="id", operator=db.Opreator.IN.value, values=ids)]) is None:
+            logger.error(f"刪除已封存的 {table} 資料失敗，停止本次封存")
+            return total
+        if table == "TB_LOGS":
+            # 之後再發生時重新新增資料列，不能累加到已刪除的 id
+            for row in rows:
+                if row.get("fingerprint"):
+                    counter.invalidate(row["fingerprint"], row["id"])
+        total += len(rows)
+        if not full_batch:
+            break
+
+    if total:
+        versions.bump(versions.TABLE_SCOPES[table])
+    previous = manifest.get("archived_before")
+    if previous is None or previous < cutoff.isoformat():
+        manifest["archived_before"] = cutoff.isoformat()
+        _save_manifest(table, manifest)
+    logger.info(f"{table} 已封存 {total} 筆（{cutoff} 之前）")
+    return total
+
+
+# 將 LIKE / ILIKE 樣式轉為正規表示式
+def _like_to_regex(pattern: str, ignore_case: bool) -> re.Pattern:
+    regex = "".join(".*" if c == "%" else "." if c == "_" else re.escape(c) for c in pattern)
+    return re.compile(regex, re.IGNORECASE | re.DOTALL if ignore_case else re.DOTALL)
+
+
+def _compare(row_value: Any, value: str) -> tuple:
+    if isinstance(row_value, (int, float)) and not isinstance(row_value, bool):
+        return row_value, float(value)
+    return str(row_value), value
+
+
+# 在記憶體中套用與 makeFilter 相同語意的篩選條件
+def match_filters(row: Dict[str, Any], filters: List[DBFilter]) -> bool:
+    for f in filters:
+        row_value = row.get(f.name)
+        operator = f.operator.value if hasattr(f.operator, "value") else f.operator
+        if operator == "in":
+            if str(row_value) not in f.values:
+                return False
+            continue
+        if row_value is None:
+            return False
+        value = f.values[0]
+        if operator in ("like", "ilike"):
+            if not _like_to_regex(value, operator == "ilike").fullmatch(str(row_value)):
+                return False
+            continue
+        left, right = _compare(row_value, value)
+        if operator == "eq" and not left == right:
+            return False
+        if operator == "neq" and not left != right:
+            return False
+        if operator == "gt" and not left > right:
+            return False
+        if operator == "gte" and not left >= right:
+            return False
+        if operator == "lt" and not left < right:
+            return False
+        if operator == "lte" and not left <= right:
+            return False
+    return True
+
+
+# 讀取日期範圍內的封存資料（由新到舊）
+def read_archived(
+        table: str,
+        date_from: Optional[datetime.date] = None,
+        date_to: Optional[datetime.date] = None,
+        filters: Optional[List[DBFilter]] = None
+    ) -> Iterator[Dict[str, Any]]:
+    """
+    只開啟 manifest 中落在日期範圍內的分區，分區內依日期欄位由新到舊排序。
+    同一筆資料重複封存時（刪除失敗後重新執行）只保留較新的檔案中的內容
+    """
+    date_column = TABLES[table]
+    manifest = load_manifest(table)
+    low = date_from.isoformat() if date_from else ""
+    high = date_to.isoformat() if date_to else "9999-12-31"
+    for partition in sorted(manifest["partitions"], reverse=True):
+        if not (low <= partition <= high):
+            continue
+        partition_dir = os.path.join(_table_dir(table), f"date={partition}")
+        rows = []
+        seen = set()
+        for filename in reversed(manifest["partitions"][partition]["files"]):
+            try:
+                with gzip.open(os.path.join(partition_dir, filename), "rt", encoding="utf-8") as f:
+                    for line in f:
+                        row = json.loads(line)
+                        if row.get("id") in seen:
+                            continue
+                        seen.add(row.get("id"))
+                        if not filters or match_filters(row, filters):
+                            rows.append(row)
+            except FileNotFoundError:
+                logger.warning(f"找不到封存檔: {partition_dir}/{filename}")
+        if table == "TB_LOGS":
+            rows.sort(key=lambda row: (str(row.get("date")), str(row.get("time"))), reverse=True)
+        else:
+            rows.sort(key=lambda row: str(row.get(date_column)), reverse=True)
+        yield from rows
+
+
+# 合併熱資料與封存資料（依 id 去除重複），並依排序鍵由新到舊取出一頁
+def merge_page(hot_rows: List[Dict[str, Any]], archived_rows: Iterator[Dict[str, Any]], sort_key, limit: int, offset: int) -> List[Dict[str, Any]]:
+    seen = {row.get("id") for row in hot_rows}
+    merged = list(hot_rows)
+    needed = offset + limit
+    for row in archived_rows:
+        if row.get("id") in seen:
+            continue
+        merged.append(row)
+        if len(merged) - len(hot_rows) >= needed:
+            break
+    merged.sort(key=sort_key, reverse=True)
+    return merged[offset:offset + limit]
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="封存超過保留天數的日誌與通知歷史")
+    parser.add_argument("--table", choices=list(TABLES), help="只封存指定資料表（預設全部）")
+    parser.add_argument("--days", type=int, help="保留天數（預設依設定檔）")
+    args = parser.parse_args()
+    for table in [args.table] if args.table else list(TABLES):
+        archive_table(table, args.days)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""
+基數估計模組
+寫入日誌時將指紋、位置與相關員工加入每小時 / 每日的 Redis HyperLogLog，
+每個時間桶的記憶體固定（Redis HLL 最多約 12KB，基數小時以稀疏格式儲存更少），
+查詢任意日期範圍時以 PFCOUNT 合併多個時間桶，不需要掃描 TB_LOGS。
+"""
+import datetime
+import logging
+from typing import Any, Dict, List
+import app.database as db
+from app.object import Log
+from app.settings import settings
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = "logs:hll:"
+# 支援的維度
+DIMENSIONS = ("fingerprint", "location", "employee")
+GRANULARITY_HOUR = "hour"
+GRANULARITY_DAY = "day"
+
+
+def _key(dimension: str, granularity: str, moment: datetime.datetime) -> str:
+    if granularity == GRANULARITY_HOUR:
+        return f"{KEY_PREFIX}{dimension}:h:{moment.strftime('%Y%m%d%H')}"
+    return f"{KEY_PREFIX}{dimension}:d:{moment.strftime('%Y%m%d')}"
+
+
+# 將一筆日誌加入目前小時與當日 HyperLogLog 的指令排入 pipeline，由呼叫端執行
+def queue(pipe, log: Log) -> None:
+    now = datetime.datetime.now()
+    members = {
+        "fingerprint": [log.fingerprint()],
+        "location": [log.location],
+        "employee": log.employees
+    }
+    for dimension, values in members.items():
+        if not values:
+            continue
+        for granularity, ttl in (
+            (GRANULARITY_HOUR, settings.HLL_HOURLY_RETENTION_DAYS * 86400),
+            (GRANULARITY_DAY, settings.HLL_DAILY_RETENTION_DAYS * 86400)
+        ):
+            key = _key(dimension, granularity, now)
+            pipe.pfadd(key, *values)
+            pipe.expire(key, ttl)
+
+
+# 列出日期範圍內的時間桶
+def buckets(date_from: datetime.date, date_to: datetime.date, granularity: str) -> List[datetime.datetime]:
+    start = datetime.datetime.combine(date_from, datetime.time())
+    end = datetime.datetime.combine(date_to, datetime.time()) + datetime.timedelta(days=1)
+    step = datetime.timedelta(hours=1) if granularity == GRANULARITY_HOUR else datetime.timedelta(days=1)
+    moments = []
+    while start < end:
+        moments.append(start)
+        start += step
+    return moments
+
+
+# 查詢日期範圍內的不重複數量（每個時間桶各自的數量與整段範圍合併後的數量）
+def count(dimension: str, date_from: datetime.date, date_to: datetime.date, granularity: str) -> Dict[str, Any]:
+    moments = buckets(date_from, date_to, granularity)
+    keys = [_key(dimension, granularity, moment) for moment in moments]
+    pipe = db.r.pipeline(transaction=False)
+    for key in keys:
+        pipe.pfcount(key)
+    # 整段範圍的不重複數量一律以每日 HLL 合併（時間桶較少，結果相同）
+    pipe.pfcount(*[_key(dimension, GRANULARITY_DAY, moment) for moment in buckets(date_from, date_to, GRANULARITY_DAY)])
+    replies = pipe.execute()
+    fmt = "%Y-%m-%dT%H:00" if granularity == GRANULARITY_HOUR else "%Y-%m-%d"
+    return {
+        "total": replies[-1],
+        "buckets": [{"bucket": moment.strftime(fmt), "count": value} for moment, value in zip(moments, replies[:-1])]
+    }
@@ -37,3 +37,10 @@ class Status(str, Enum):
 	SUCCESS = "Success"      # 成功
 	FAILED = "Failed"        # 失敗
 	RETRYING = "Retrying"    # 重試中
+
+
+# 推播優先通道（各自擁有獨立佇列與保留的 worker）
+class Lane(str, Enum):
+	EMERGENCY = "emergency"  # 緊急
+	HIGH = "high"            # 高風險
+	LOW = "low"              # 普通
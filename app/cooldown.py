@@ -0,0 +1,145 @@
+"""
+通知冷卻模組
+日誌次數超過門檻後每次累加都會再通知一次，重複上萬次的問題會對每個收件者的每個渠道發送上萬則通知。
+此模組依 (日誌指紋, 渠道, 收件者) 設定冷卻時間：發送後 COOLDOWN_BASE_SECONDS 秒內不再發送，
+冷卻結束後再次發送時冷卻時間加倍（最長 COOLDOWN_MAX_SECONDS 秒），
+問題停止發生超過 COOLDOWN_RESET_SECONDS 秒後回到基本冷卻時間。
+
+冷卻期間未發送的次數會累計，附在下一則實際發送的通知中。
+每個指紋另有一個閘門，存活時間為各收件者中最早結束冷卻的時間；閘門關閉期間不排入推播通道
+（不佔用佇列、不查詢聯絡方式），只累計次數，下一則排入的通知發送時再加到各收件者的未發送次數。
+狀態以 Redis 的 TTL key 保存（多台機器共用），Redis 無法使用時不限制發送。
+"""
+import hashlib
+import logging
+import threading
+from typing import Any, Dict, Optional, Tuple
+import app.database as db
+from app.settings import settings
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = "notify:cooldown:"
+
+# KEYS[1]: 冷卻中的標記（TTL 為冷卻時間）, KEYS[2]: 冷卻階段與未發送次數, KEYS[3]: 指紋的閘門
+# ARGV: 基本冷卻秒數, 最長冷卻秒數, 重設秒數, 閘門關閉期間未排入的次數
+# 冷卻中回傳 {0, 累計未發送次數}，可發送時回傳 {1, 上次發送後未發送的次數, 本次冷卻秒數}
+# 閘門的存活時間縮短為此收件者結束冷卻的時間（取各收件者中最早者）
+_ACQUIRE_SCRIPT = """
+local function close_gate(ms)
+    local ttl = redis.call('PTTL', KEYS[3])
+    if ttl < 0 or ttl > ms then
+        redis.call('SET', KEYS[3], 1, 'PX', ms)
+    end
+end
+local skipped = tonumber(ARGV[4])
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    local suppressed = redis.call('HINCRBY', KEYS[2], 'suppressed', 1 + skipped)
+    local ttl = redis.call('PTTL', KEYS[1])
+    redis.call('EXPIRE', KEYS[2], math.ceil(ttl / 1000) + tonumber(ARGV[3]))
+    close_gate(math.max(ttl, 1))
+    return {0, suppressed}
+end
+local level = tonumber(redis.call('HGET', KEYS[2], 'level') or '0')
+local suppressed = tonumber(redis.call('HGET', KEYS[2], 'suppressed') or '0') + skipped
+local window = math.min(math.floor(tonumber(ARGV[1]) * 2 ^ level), tonumber(ARGV[2]))
+redis.call('SET', KEYS[1], 1, 'EX', window)
+if window < tonumber(ARGV[2]) then
+    level = level + 1
+end
+redis.call('HSET', KEYS[2], 'level', level, 'suppressed', 0)
+redis.call('EXPIRE', KEYS[2], window + tonumber(ARGV[3]))
+close_gate(window * 1000)
+return {1, suppressed, window}
+"""
+
+# KEYS[1]: 指紋的閘門, KEYS[2]: 閘門關閉期間未排入的次數
+# ARGV: 重設秒數
+# 閘門關閉時回傳 {0, 累計未排入次數}，開啟時回傳 {1, 上次排入後未排入的次數} 並歸零
+_GATE_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    local skipped = redis.call('INCR', KEYS[2])
+    redis.call('EXPIRE', KEYS[2], redis.call('TTL', KEYS[1]) + tonumber(ARGV[1]))
+    return {0, skipped}
+end
+local skipped = tonumber(redis.call('GET', KEYS[2]) or '0')
+redis.call('DEL', KEYS[2])
+return {1, skipped}
+"""
+_scripts: Dict[str, Any] = {}
+
+_lock = threading.Lock()
+_counters = {"sent": 0, "suppressed": 0, "gated": 0}
+
+
+# 第一次使用時才註冊腳本（message 模組載入時 database 模組尚未建立 Redis 連線）
+def _script(source: str):
+    if source not in _scripts:
+        _scripts[source] = db.r.register_script(source)
+    return _scripts[source]
+
+
+def _gate_keys(fingerprint: str) -> Tuple[str, str]:
+    base = f"{KEY_PREFIX}{fingerprint}:gate"
+    return base, f"{base}:skipped"
+
+
+def _keys(fingerprint: str, channel: str, recipient: str) -> Tuple[str, str]:
+    # 收件者可能是 Webhook URL，只保存雜湊值
+    digest = hashlib.sha1(recipient.encode("utf-8")).hexdigest()[:16]
+    base = f"{KEY_PREFIX}{fingerprint}:{channel}:{digest}"
+    return base, f"{base}:state"
+
+
+# 排入推播通道前檢查指紋的閘門，回傳 (是否排入, 上次排入後未排入的次數)
+def gate(fingerprint: Optional[str]) -> Tuple[bool, int]:
+    """閘門關閉時所有收件者都還在冷卻中，不必排入推播通道；沒有指紋或未啟用冷卻時一律排入"""
+    if not settings.COOLDOWN_ENABLED or not fingerprint:
+        return True, 0
+    try:
+        result = _script(_GATE_SCRIPT)(keys=list(_gate_keys(fingerprint)), args=[settings.COOLDOWN_RESET_SECONDS])
+    except Exception as e:
+        logger.error(f"檢查通知冷卻閘門時發生錯誤，不限制排入: {e}", exc_info=True)
+        return True, 0
+    if not int(result[0]):
+        with _lock:
+            _counters["gated"] += 1
+        return False, 0
+    return True, int(result[1])
+
+
+# 判斷此收件者的此渠道是否可以發送，回傳 (是否發送, 冷卻期間未發送的次數)
+def acquire(fingerprint: Optional[str], channel: str, recipient: str, skipped: int = 0) -> Tuple[bool, int]:
+    """沒有指紋（例如升級通知）或未啟用冷卻時一律發送；skipped 為閘門關閉期間未排入的次數"""
+    if not settings.COOLDOWN_ENABLED or not fingerprint:
+        return True, 0
+    try:
+        result = _script(_ACQUIRE_SCRIPT)(
+            keys=[*_keys(fingerprint, channel, recipient), _gate_keys(fingerprint)[0]],
+            args=[settings.COOLDOWN_BASE_SECONDS, settings.COOLDOWN_MAX_SECONDS, settings.COOLDOWN_RESET_SECONDS, skipped]
+        )
+    except Exception as e:
+        logger.error(f"檢查通知冷卻時發生錯誤，不限制發送: {e}", exc_info=True)
+        return True, 0
+    allowed = bool(int(result[0]))
+    with _lock:
+        _counters["sent" if allowed else "suppressed"] += 1
+    return allowed, int(result[1]) if allowed else 0
+
+
+# 在通知內容附上冷卻期間未發送的次數
+def annotate(body: str, suppressed: int) -> str:
+    if suppressed <= 0:
+        return body
+    return f"{body}\n（冷卻期間另有 {suppressed} 次相同通知未發送）"
+
+
+def stats() -> Dict[str, Any]:
+    with _lock:
+        counters = dict(_counters)
+    return {
+        "enabled": settings.COOLDOWN_ENABLED,
+        "base_seconds": settings.COOLDOWN_BASE_SECONDS,
+        "max_seconds": settings.COOLDOWN_MAX_SECONDS,
+        **counters
+    }
@@ -0,0 +1,220 @@
+"""
+次數合併寫入模組
+相同指紋的重複Log先在 Redis 累加（總次數即時可見，可立即判斷是否超過閾值），
+再由背景執行緒每隔 COUNTER_FLUSH_INTERVAL_MS 將累積的次數一次寫回資料庫，
+讓資料庫寫入量取決於不同問題的數量，而不是事件的原始頻率。
+"""
+import json
+import logging
+import threading
+from typing import Dict, List, Optional, Tuple
+import app.database as db
+from app.object import Log
+from app.settings import settings
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = "logs:counter:"
+DIRTY_KEY = "logs:counter:dirty"
+
+# 快取命中時累加總次數與待寫回次數，並標記為待寫回
+_HIT_SCRIPT = db.r.register_script("""
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return false
+end
+local total = redis.call('HINCRBY', KEYS[1], 'total', ARGV[1])
+redis.call('HINCRBY', KEYS[1], 'pending', ARGV[1])
+redis.call('SADD', KEYS[2], ARGV[2])
+redis.call('EXPIRE', KEYS[1], ARGV[3])
+return {total, redis.call('HGET', KEYS[1], 'id'), redis.call('HGET', KEYS[1], 'riskLevel'), redis.call('HGET', KEYS[1], 'employees')}
+""")
+
+# 以資料庫回傳的次數建立快取，已存在時保留尚未寫回的次數
+_SEED_SCRIPT = db.r.register_script("""
+local pending = tonumber(redis.call('HGET', KEYS[1], 'pending') or '0')
+local total = tonumber(redis.call('HGET', KEYS[1], 'total') or '0')
+local seeded = tonumber(ARGV[4]) + pending
+if seeded > total then
+    total = seeded
+end
+redis.call('HSET', KEYS[1], 'id', ARGV[1], 'riskLevel', ARGV[2], 'employees', ARGV[3], 'total', total, 'pending', pending)
+redis.call('EXPIRE', KEYS[1], ARGV[5])
+return total
+""")
+
+# 取出並歸零待寫回次數（多個 worker 同時 flush 也只會有一個取得）
+_DRAIN_SCRIPT = db.r.register_script("""
+redis.call('SREM', KEYS[2], ARGV[1])
+local pending = tonumber(redis.call('HGET', KEYS[1], 'pending') or '0')
+if pending > 0 then
+    redis.call('HSET', KEYS[1], 'pending', 0)
+end
+return {pending, redis.call('HGET', KEYS[1], 'id')}
+""")
+
+# 寫回失敗時把次數放回去，等下一輪再寫
+_RESTORE_SCRIPT = db.r.register_script("""
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return 0
+end
+redis.call('HINCRBY', KEYS[1], 'pending', ARGV[1])
+redis.call('SADD', KEYS[2], ARGV[2])
+return 1
+""")
+
+# 資料列已不存在時清除快取（快取已換成新的 id 時保留）
+_FORGET_SCRIPT = db.r.register_script("""
+if redis.call('HGET', KEYS[1], 'id') ~= ARGV[1] then
+    return 0
+end
+redis.call('DEL', KEYS[1])
+redis.call('SREM', KEYS[2], ARGV[2])
+return 1
+""")
+
+_lock = threading.Lock()
+# 寫回失敗且快取已過期（無法放回 Redis）的次數，{log_id: 次數}，下一輪一併寫回
+_orphans: Dict[int, int] = {}
+
+
+# 累加Log次數，回傳 (最新Log, 是否為新增)
+def add(log: Log, increment: int = 1) -> Optional[Tuple[Log, bool]]:
+    """
+    快取命中時只寫 Redis；未命中（第一次出現或快取過期）才走資料庫的原子化 ingest_log，
+    並以回傳的次數建立快取。Redis 無法使用時直接退回資料庫寫入。
+    """
+    if not settings.COUNTER_COALESCE_ENABLED:
+        return db.ingest_log(log, increment)
+
+    fingerprint = log.fingerprint()
+    key = KEY_PREFIX + fingerprint
+    try:
+        hit = _HIT_SCRIPT(keys=[key, DIRTY_KEY], args=[increment, fingerprint, settings.COUNTER_CACHE_TTL])
+        if hit:
+            total, log_id, risk_level, employees = hit
+            stored = log.model_copy(update={
+                "id": int(log_id),
+                "count": int(total),
+                "riskLevel": int(risk_level),
+                "employees": json.loads(employees)
+            })
+            return stored, False
+    except Exception as e:
+        logger.error(f"Redis 累加次數時發生錯誤，改為直接寫入資料庫: {e}", exc_info=True)
+        return db.ingest_log(log, increment)
+
+    ingested = db.ingest_log(log, increment)
+    if ingested is None:
+        return None
+    stored, created = ingested
+    try:
+        total = _SEED_SCRIPT(
+            keys=[key],
+            args=[stored.id, stored.riskLevel, json.dumps(stored.employees), stored.count, settings.COUNTER_CACHE_TTL]
+        )
+        stored.count = int(total)
+    except Exception as e:
+        logger.error(f"建立次數快取時發生錯誤: {e}", exc_info=True)
+    return stored, created
+
+
+# 清除指定日誌的次數快取（資料列被封存或刪除時呼叫），回傳是否有清除
+def invalidate(fingerprint: str, log_id: int) -> bool:
+    try:
+        return bool(_FORGET_SCRIPT(keys=[KEY_PREFIX + fingerprint, DIRTY_KEY], args=[log_id, fingerprint]))
+    except Exception as e:
+        logger.error(f"清除次數快取時發生錯誤: {e}", exc_info=True)
+        return False
+
+
+# 寫回失敗時把次數放回 Redis；快取已過期時改為保留在程序內，下一輪再寫
+def _restore(fingerprint: Optional[str], log_id: int, pending: int) -> None:
+    if fingerprint is not None:
+        try:
+            if _RESTORE_SCRIPT(keys=[KEY_PREFIX + fingerprint, DIRTY_KEY], args=[pending, fingerprint]):
+                return
+            logger.warning(f"次數快取已過期，{pending} 次改為下一輪直接寫回 (log_id={log_id})")
+        except Exception as e:
+            logger.error(f"還原待寫回次數時發生錯誤，{pending} 次改為下一輪直接寫回 (log_id={log_id}): {e}", exc_info=True)
+    with _lock:
+        _orphans[log_id] = _orphans.get(log_id, 0) + pending
+
+
+# 將累積的次數寫回資料庫
+def flush() -> int:
+    """每個 id 只產生一筆累加，所有 id 合併成一次 add_log_counts 呼叫。回傳寫回的 id 數"""
+    try:
+        fingerprints = db.r.smembers(DIRTY_KEY)
+    except Exception as e:
+        logger.error(f"讀取待寫回次數時發生錯誤: {e}", exc_info=True)
+        return 0
+
+    # (指紋, 日誌 ID, 次數)；上一輪無法放回 Redis 的次數沒有指紋
+    drained: List[Tuple[Optional[str], int, int]] = []
+    for fingerprint in fingerprints:
+        try:
+            pending, log_id = _DRAIN_SCRIPT(keys=[KEY_PREFIX + fingerprint, DIRTY_KEY], args=[fingerprint])
+            if int(pending) > 0 and log_id is not None:
+                drained.append((fingerprint, int(log_id), int(pending)))
+        except Exception as e:
+            logger.error(f"取出待寫回次數時發生錯誤: {e}", exc_info=True)
+    with _lock:
+        drained += [(None, log_id, pending) for log_id, pending in _orphans.items()]
+        _orphans.clear()
+
+    if not drained:
+        return 0
+
+    # 同一個 id 在一次 UPDATE 中只會累加一次，先合併
+    totals: Dict[int, int] = {}
+    for _, log_id, pending in drained:
+        totals[log_id] = totals.get(log_id, 0) + pending
+    missing = db.add_log_counts(list(totals), list(totals.values()))
+    if missing is None:
+        for fingerprint, log_id, pending in drained:
+            _restore(fingerprint, log_id, pending)
+        return 0
+    if missing:
+        # 資料列已被封存或刪除：清除快取，之後的事件重新走 ingest_log 建立新的資料列
+        missing = set(missing)
+        logger.warning(f"日誌已不存在，捨棄 {sum(totals[i] for i in missing)} 次累加並清除次數快取: {sorted(missing)}")
+        for fingerprint, log_id, _ in drained:
+            if fingerprint is not None and log_id in missing:
+                invalidate(fingerprint, log_id)
+    return len(totals)
+
+
+class CounterFlusher(threading.Thread):
+    """背景定期寫回次數的執行緒"""
+
+    def __init__(self, interval_ms: int):
+        super().__init__(name="counter-flusher", daemon=True)
+        self.interval = interval_ms / 1000
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            flush()
+        # 結束前把剩下的次數寫回
+        flush()
+
+    def stop(self):
+        self._stop_event.set()
+        self.join(timeout=5)
+
+
+_flusher: Optional[CounterFlusher] = None
+
+
+def start():
+    global _flusher
+    if settings.COUNTER_COALESCE_ENABLED and _flusher is None:
+        _flusher = CounterFlusher(settings.COUNTER_FLUSH_INTERVAL_MS)
+        _flusher.start()
+
+
+def stop():
+    global _flusher
+    if _flusher is not None:
+        _flusher.stop()
+        _flusher = None
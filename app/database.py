@@ -1,10 +1,18 @@
-import app.message as msg
+import app.dispatcher as dispatcher
+import app.escalation as escalation
+import app.admission as admission
+import app.cooldown as cooldown
+import app.rules as rules
+import app.versions as versions
 import redis
 from supabase import create_client, Client
 from app.settings import settings
-from app.object import DBFilter, Log, Message
-from typing import Optional, List, Any
+from app.object import AlertRule, DBFilter, Log, Message
+from typing import Optional, List, Any, Callable, Dict, Tuple, TypeVar
 import logging
+import re
+import threading
+import time
 from enum import Enum
 
 logger = logging.getLogger(__name__)
@@ -37,6 +45,91 @@ r = redis.Redis(
 # 使用環境變數建立 Supabase 連線
 supabase: Client = create_client(settings.SUPABASE_URL, settings.SUPABASE_KEY)
 
+# 唯讀複本（查詢 API 使用，未設定時所有查詢都走主資料庫）
+replica: Optional[Client] = (
+    create_client(settings.SUPABASE_REPLICA_URL, settings.SUPABASE_REPLICA_KEY or settings.SUPABASE_KEY)
+    if settings.SUPABASE_REPLICA_URL else None
+)
+
+T = TypeVar("T")
+_replica_lock = threading.Lock()
+_lag_lock = threading.Lock()
+_replica_state: Dict[str, Any] = {
+    "lag": None,            # 最近一次量測的複寫延遲（秒）
+    "checked_at": 0.0,      # 最近一次量測的時間（monotonic）
+    "down_until": 0.0,      # 查詢失敗後暫停使用複本直到此時間（monotonic）
+    "replica_reads": 0,
+    "primary_reads": 0,
+    "fallbacks": 0
+}
+
+
+# 量測複本的複寫延遲（秒），由資料庫函數 replication_lag 回傳
+def replica_lag() -> float:
+    return float(replica.rpc("replication_lag", {}).execute().data or 0)
+
+
+def _mark_replica_down(reason: str) -> None:
+    with _replica_lock:
+        _replica_state["down_until"] = time.monotonic() + settings.REPLICA_RETRY_SECONDS
+        _replica_state["fallbacks"] += 1
+    logger.warning(f"唯讀複本無法使用，{settings.REPLICA_RETRY_SECONDS} 秒內改用主資料庫: {reason}")
+
+
+# 決定唯讀查詢使用的連線：複本可用且延遲在容許範圍內時使用複本，否則使用主資料庫
+def reader(max_staleness: Optional[float] = None) -> Client:
+    if replica is None:
+        return supabase
+    now = time.monotonic()
+    if now < _replica_state["down_until"]:
+        return supabase
+    if now - _replica_state["checked_at"] > settings.REPLICA_LAG_CHECK_SECONDS and _lag_lock.acquire(blocking=False):
+        # 同一時間只由一個請求量測延遲，其他請求沿用上一次的結果
+        error = None
+        try:
+            _replica_state["checked_at"] = now
+            _replica_state["lag"] = replica_lag()
+        except Exception as e:
+            _replica_state["lag"] = None
+            error = str(e)
+        finally:
+            _lag_lock.release()
+        if error is not None:
+            _mark_replica_down(error)
+            return supabase
+    lag = _replica_state["lag"]
+    budget = settings.REPLICA_MAX_STALENESS_SECONDS if max_staleness is None else max_staleness
+    return replica if lag is not None and lag <= budget else supabase
+
+
+# 執行唯讀查詢（優先使用複本，複本查詢失敗時改用主資料庫重試一次）
+def read(query: Callable[[Client], T], max_staleness: Optional[float] = None) -> T:
+    client = reader(max_staleness)
+    if client is supabase:
+        _replica_state["primary_reads"] += 1
+        return query(supabase)
+    try:
+        result = query(client)
+        _replica_state["replica_reads"] += 1
+        return result
+    except Exception as e:
+        _mark_replica_down(str(e))
+        _replica_state["primary_reads"] += 1
+        return query(supabase)
+
+
+def replica_stats() -> Dict[str, Any]:
+    now = time.monotonic()
+    return {
+        "configured": replica is not None,
+        "available": replica is not None and now >= _replica_state["down_until"],
+        "lag_seconds": _replica_state["lag"],
+        "max_staleness_seconds": settings.REPLICA_MAX_STALENESS_SECONDS,
+        "replica_reads": _replica_state["replica_reads"],
+        "primary_reads": _replica_state["primary_reads"],
+        "fallbacks": _replica_state["fallbacks"]
+    }
+
 
 # 建立Filter用來查詢特定資料
 def makeFilter(query, filters: list[DBFilter]):
@@ -109,11 +202,12 @@ def call_by_sql(table_name: str, sql: dict) -> Optional[Any]:
 
 
 # 用物件查詢資料庫
-def call_by_filters(table_name: str, filters: List[DBFilter]) -> Optional[Any]:
+def call_by_filters(table_name: str, filters: List[DBFilter], read_only: bool = False) -> Optional[Any]:
+    """read_only 為 True 時可使用唯讀複本（查詢 API 使用；寫入流程中的查詢需要最新資料，維持使用主資料庫）"""
     try:
-        query = supabase.table(table_name).select("*")
-        result = makeFilter(query, filters).execute()
-        return result
+        def query(client: Client):
+            return makeFilter(client.table(table_name).select("*"), filters).execute()
+        return read(query) if read_only else query(supabase)
     except Exception as e:
         logger.error(f"查詢 {table_name} 時發生錯誤: {e}", exc_info=True)
         return None
@@ -128,126 +222,193 @@ def get_logs_with_pagination(filters: List[DBFilter], limit: int = 50, offset: i
     - offset: 偏移量
     """
     try:
-        query = supabase.table("TB_LOGS").select("*")
-        query = makeFilter(query, filters)
-        # 按日期和時間降序排列（最新的在前）
-        query = query.order("date", desc=True).order("time", desc=True)
-        # 分頁
-        query = query.range(offset, offset + limit - 1)
-        result = query.execute()
-        return result
+        def query(client: Client):
+            query = client.table("TB_LOGS").select("*")
+            query = makeFilter(query, filters)
+            # 按日期和時間降序排列（最新的在前）
+            query = query.order("date", desc=True).order("time", desc=True)
+            # 分頁
+            query = query.range(offset, offset + limit - 1)
+            return query.execute()
+        return read(query)
     except Exception as e:
         logger.error(f"查詢日誌分頁時發生錯誤: {e}", exc_info=True)
         return None
 
 
-# 檢查Log是否超過一定次數(普通等級5次 高風險等級3次 緊急等級1次)
-def need_send(log: Log) -> bool:
+# 依 ID 批次查詢日誌（一次 IN 查詢）
+def get_logs_by_ids(ids: List[int]) -> Optional[List[dict]]:
+    result = call_by_filters("TB_LOGS", [DBFilter(name="id", operator=Opreator.IN.value, values=[str(i) for i in ids])], read_only=True)
+    return result.data if result is not None else None
+
+
+# 依日誌 ID 批次查詢通知歷史（一次 IN 查詢），回傳 {log_id: [通知歷史（新到舊）]}
+def get_notifications_by_log_ids(log_ids: List[int]) -> Optional[dict]:
+    result = call_by_filters(
+        "TB_NOTIFICATION_HISTORY",
+        [DBFilter(name="log_id", operator=Opreator.IN.value, values=[str(i) for i in log_ids])],
+        read_only=True
+    )
+    if result is None:
+        return None
+    grouped = {}
+    for row in sorted(result.data or [], key=lambda row: str(row.get("sent_at")), reverse=True):
+        grouped.setdefault(row.get("log_id"), []).append(row)
+    return grouped
+
+
+# 將搜尋字串轉為前綴比對的 tsquery（例如 "conn time" → "conn:* & time:*"）
+def to_tsquery(q: str) -> str:
+    tokens = re.findall(r"\w+", q.lower())
+    return " & ".join(f"{token}:*" for token in tokens)
+
+
+# 全文搜尋日誌（location、function、log 內容），依相關度排序
+def search_logs(
+        q: str,
+        riskLevel: Optional[int] = None,
+        location: Optional[str] = None,
+        function: Optional[str] = None,
+        date_from: Optional[str] = None,
+        date_to: Optional[str] = None,
+        limit: int = 50,
+        offset: int = 0
+    ) -> Optional[Any]:
+    """
+    呼叫資料庫函數 search_logs，以 search_vector 的 GIN 索引比對，
+    location / function 的部分比對使用 trigram 索引
+    """
     try:
-        # 根據風險等級判斷閾值
-        threshold_map = {
-            1: 5,  # 普通等級：5次
-            2: 3,  # 高風險：3次
-            3: 1   # 緊急：1次
+        params = {
+            "p_query": to_tsquery(q),
+            "p_risk_level": riskLevel,
+            "p_location": f"%{location}%" if location else None,
+            "p_function": f"%{function}%" if function else None,
+            "p_date_from": date_from,
+            "p_date_to": date_to,
+            "p_limit": limit,
+            "p_offset": offset
         }
-        threshold = threshold_map.get(log.riskLevel, 5)
-        
-        request = (
-            supabase.table("TB_LOGS").select("*")
-            .filter("location", Opreator.EQUAL.value, log.location)
-            .filter("function", Opreator.EQUAL.value, log.function)
-            .filter("log", Opreator.EQUAL.value, log.log)
-            .filter("riskLevel", Opreator.EQUAL.value, log.riskLevel)
-            .filter("count", Opreator.GREATER_OR_EQUAL.value, threshold)
-            .execute()
-        )
-        return True if request.data and len(request.data) > 0 else False
+        return read(lambda client: client.rpc("search_logs", params).execute())
     except Exception as e:
-        logger.error(f"檢查是否需要發送通知時發生錯誤: {e}", exc_info=True)
-        return False
+        logger.error(f"搜尋日誌時發生錯誤: {e}", exc_info=True)
+        return None
 
 
-# 新增Log資料
-def insert_log(log: Log) -> Optional[Any]:
+# 檢查Log是否超過一定次數(普通等級5次 高風險等級3次 緊急等級1次)
+def need_send(log: Log) -> bool:
+    """
+    log.count 必須是資料庫累加後的最新次數（由 ingest_log 原子化回傳），
+    因此不需要再回查資料庫；門檻由通知規則決定（預設普通 5 次、高風險 3 次、緊急 1 次）
+    """
+    rule = rules.current().match(log.location, log.function, log.riskLevel)
+    return log.count >= rule.threshold
+
+
+# 原子化新增或累加Log次數
+def ingest_log(log: Log, increment: int = 1) -> Optional[Tuple[Log, bool]]:
+    """
+    呼叫資料庫函數 ingest_log，以 fingerprint 為唯一鍵執行
+    INSERT ... ON CONFLICT DO UPDATE SET count = count + increment，
+    多個 worker / 多台機器同時寫入相同Log也不會重複新增或遺失次數。
+    回傳 (資料庫中的最新Log, 是否為新增)，失敗時回傳 None
+    """
     try:
-        # 手動轉換日期和時間為字串
-        log_data = log.model_dump(exclude={'id'})  # 排除 id 欄位，讓資料庫自動生成
-        log_data['date'] = log.date.isoformat()
-        log_data['time'] = log.time.isoformat()
-        result = supabase.table("TB_LOGS").insert(log_data).execute()
-        # 如果是緊急等級直接通知相關人員
-        if log.riskLevel == 3:
-            try:
-                message = Message(
-                    title="系統緊急通知",
-                    body=f"位置:{log.location}\n功能:{log.function}\n紀錄:{log.log}",
-                    employees=log.employees
-                )
-                # 查詢剛剛新增的Log ID
-                msg.send_message(message, result.data[0].get('id'))
-            except Exception as e:
-                logger.error(f"發送緊急通知時發生錯誤: {e}", exc_info=True)
-        return result
+        params = {
+            "p_risk_level": log.riskLevel,
+            "p_type": log.type,
+            "p_location": log.location,
+            "p_function": log.function,
+            "p_log": log.log,
+            "p_employees": log.employees,
+            "p_date": log.date.isoformat(),
+            "p_time": log.time.isoformat(),
+            "p_increment": increment
+        }
+        started = time.monotonic()
+        result = supabase.rpc("ingest_log", params).execute()
+        admission.record_db_latency((time.monotonic() - started) * 1000)
+        if not result.data:
+            logger.error("ingest_log 未回傳任何資料")
+            return None
+        row = result.data[0]
+        # 以資料庫回傳的 id、次數與既有設定（風險等級、相關員工）為準
+        stored = log.model_copy(update={
+            "id": row.get("id"),
+            "count": row.get("count", increment),
+            "riskLevel": row.get("riskLevel", log.riskLevel),
+            "employees": row.get("employees") or log.employees
+        })
+        versions.bump(versions.LOGS)
+        return stored, bool(row.get("inserted"))
     except Exception as e:
-        logger.error(f"新增日誌時發生錯誤: {e}", exc_info=True)
+        logger.error(f"原子化寫入日誌時發生錯誤: {e}", exc_info=True)
         return None
 
 
-# 更新Log資料
-def update_log(log: Log) -> Optional[Any]:
-    if log.id != None:
-        try:
-            # 手動轉換日期和時間為字串
-            log_data = log.model_dump()
-            log_data['date'] = log.date.isoformat()
-            log_data['time'] = log.time.isoformat()
-            result = update("TB_LOGS", log_data, [DBFilter(name="id", operator=Opreator.EQUAL, values=[str(log.id)])])
-            # 如果超過一定次數通知相關人員(普通等級5次 高風險等級3次 緊急等級1次)
-            if need_send(log):
-                try:
-                    message = Message(
-                        title="系統通知",
-                        body=f"位置:{log.location}\n功能:{log.function}\n紀錄:{log.log}\n次數:{log.count}",
-                        employees=log.employees
-                    )
-                    msg.send_message(message, log.id)
-                except Exception as e:
-                    logger.error(f"發送通知時發生錯誤: {e}", exc_info=True)
-            return result
-        except Exception as e:
-            logger.error(f"更新日誌時發生錯誤: {e}", exc_info=True)
-            return None
-    else:
-        logger.warning("無法更新日誌: 缺少日誌 ID")
+# 批次累加Log次數（每個 id 一筆累加，一次資料庫呼叫）
+def add_log_counts(ids: List[int], increments: List[int]) -> Optional[List[int]]:
+    """回傳資料庫中已不存在（已封存或刪除）而沒有累加到的 id，失敗時回傳 None"""
+    try:
+        started = time.monotonic()
+        result = supabase.rpc("add_log_counts", {"p_ids": ids, "p_increments": increments}).execute()
+        admission.record_db_latency((time.monotonic() - started) * 1000)
+        versions.bump(versions.LOGS)
+        return [row["missing_id"] for row in result.data or []]
+    except Exception as e:
+        logger.error(f"批次累加日誌次數時發生錯誤: {e}", exc_info=True)
         return None
 
 
-# 判斷是否為重複問題的Log
-def check_log(log: Log) -> Optional[Log]:
+# 依寫入結果通知相關人員（依風險等級排入對應的推播通道）
+def notify_log(log: Log, created: bool, increment: int = 1) -> None:
     try:
-        # 查詢資料庫中是否有相同log
-        filters = [
-            DBFilter(name="location", operator=Opreator.EQUAL, values=[log.location]),
-            DBFilter(name="function", operator=Opreator.EQUAL, values=[log.function]),
-            DBFilter(name="log", operator=Opreator.EQUAL, values=[log.log])
-        ]
-        response = call_by_filters("TB_LOGS", filters)
-        if response and response.data and len(response.data) > 0:
-            # 將字典轉換為 Log 物件
-            data = response.data[0]
-            return Log(
-                id=data.get('id'),
-                riskLevel=data.get('riskLevel'),
-                type=data.get('type'),
-                location=data.get('location'),
-                function=data.get('function'),
-                log=data.get('log'),
-                employees=data.get('employees', []),
-                date=data.get('date'),
-                time=data.get('time'),
-                count=data.get('count', 1)
-            )
-        return None
+        message = build_notification(log, created, increment)
+        if message is None:
+            return
+        # 所有收件者都在冷卻中時不排入推播通道（只累計次數，不佔用佇列也不查詢聯絡方式）
+        allowed, suppressed = cooldown.gate(message.fingerprint)
+        if not allowed:
+            return
+        message.suppressed = suppressed
+        dispatcher.dispatch(message, log.id, log.riskLevel)
+        # 緊急通知在確認前依設定的時間升級
+        escalation.schedule(log.id, message, log.riskLevel)
     except Exception as e:
-        logger.error(f"檢查重複日誌時發生錯誤: {e}", exc_info=True)
+        logger.error(f"發送通知時發生錯誤: {e}", exc_info=True)
+
+
+# 依通知規則判斷此次寫入是否需要通知，需要時回傳通知內容（不發送，供 notify_log 與模擬器共用）
+def build_notification(
+        log: Log,
+        created: bool,
+        increment: int = 1,
+        index: Optional["rules.RuleIndex"] = None,
+        window_count: Optional[Callable[[AlertRule, str, int], int]] = None
+    ) -> Optional[Message]:
+    rule = rules.evaluate(log, created, increment, index, window_count)
+    if rule is None:
         return None
+    if created and rule.immediate:
+        # 如果是緊急規則直接通知相關人員
+        return Message(
+            title="系統緊急通知",
+            body=f"位置:{log.location}\n功能:{log.function}\n紀錄:{log.log}",
+            employees=log.employees,
+            channels=rule.channels,
+            fingerprint=log.fingerprint(),
+            risk_level=log.riskLevel,
+            received_at=log.received_at,
+            triggered_at=time.time()
+        )
+    # 如果達到規則的通知門檻通知相關人員
+    return Message(
+        title="系統通知",
+        body=f"位置:{log.location}\n功能:{log.function}\n紀錄:{log.log}\n次數:{log.count}",
+        employees=log.employees,
+        channels=rule.channels,
+        fingerprint=log.fingerprint(),
+        risk_level=log.riskLevel,
+        received_at=log.received_at,
+        triggered_at=time.time()
+    )
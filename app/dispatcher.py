@@ -0,0 +1,207 @@
+"""
+推播優先通道模組
+依風險等級將通知分派到緊急 / 高風險 / 普通三個通道，每個通道有獨立的佇列與保留的 worker，
+大量普通通知排隊時也不會佔用緊急通知的執行緒，並記錄每個通道的排隊與發送延遲。
+"""
+import logging
+import queue
+import threading
+import time
+from collections import deque
+from typing import Any, Dict, List, Optional
+import app.message as msg
+import app.notification as notification
+from app.object import Message
+from app.settings import settings
+import app.constants as constants
+
+logger = logging.getLogger(__name__)
+
+# 每個通道保留的延遲樣本數（用於計算百分位數）
+LATENCY_SAMPLES = 1000
+
+
+# 依風險等級決定通道
+def lane_for(risk_level: int) -> constants.Lane:
+    if risk_level >= constants.RISK_LEVEL_EMERGENCY:
+        return constants.Lane.EMERGENCY
+    if risk_level == constants.RISK_LEVEL_HIGH:
+        return constants.Lane.HIGH
+    return constants.Lane.LOW
+
+
+# 計算百分位數（樣本已排序）
+def percentile(samples: List[float], p: float) -> Optional[float]:
+    if not samples:
+        return None
+    index = min(len(samples) - 1, max(0, int(round(p / 100 * len(samples))) - 1))
+    return round(samples[index], 2)
+
+
+class DispatchLane:
+    """單一優先通道：獨立佇列 + 固定數量的 worker 執行緒"""
+
+    def __init__(self, lane: constants.Lane, workers: int, queue_size: int, slo_ms: Optional[int] = None):
+        self.lane = lane
+        self.workers = workers
+        self.slo_ms = slo_ms
+        self.queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        self._threads: List[threading.Thread] = []
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self.enqueued = 0
+        self.completed = 0
+        self.failed = 0
+        self.dropped = 0
+        self.slo_met = 0
+        # 排入佇列到開始發送 / 排入佇列到發送完成（毫秒）
+        self.wait_ms: deque = deque(maxlen=LATENCY_SAMPLES)
+        self.latency_ms: deque = deque(maxlen=LATENCY_SAMPLES)
+
+    def start(self):
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f"dispatch-{self.lane.value}-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout: float = 5):
+        """
+        排入結束標記，worker 發送完佇列中的通知後結束；
+        佇列已滿（或 timeout 秒內沒有發送完）時不再等待，worker 處理完目前的通知就結束
+        """
+        for _ in self._threads:
+            try:
+                self.queue.put_nowait(None)
+            except queue.Full:
+                self._stop_event.set()
+                break
+        deadline = time.monotonic() + timeout
+        for thread in self._threads:
+            thread.join(timeout=max(0.0, deadline - time.monotonic()))
+        self._stop_event.set()
+        remaining = sum(1 for item in list(self.queue.queue) if item is not None)
+        if remaining:
+            logger.warning(f"{self.lane.value} 通道停止時仍有 {remaining} 則通知未發送")
+        self._threads = []
+
+    def put(self, message: Message, log_id: Optional[int]) -> bool:
+        try:
+            self.queue.put_nowait((message, log_id, time.monotonic()))
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+            return False
+        with self._lock:
+            self.enqueued += 1
+        return True
+
+    def _work(self):
+        while not self._stop_event.is_set():
+            try:
+                item = self.queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            if item is None:
+                break
+            message, log_id, enqueued_at = item
+            started_at = time.monotonic()
+            ok = True
+            try:
+                msg.send_message(message, log_id)
+            except Exception as e:
+                ok = False
+                logger.error(f"{self.lane.value} 通道發送通知時發生錯誤: {e}", exc_info=True)
+            self._record(enqueued_at, started_at, time.monotonic(), ok)
+
+    def _record(self, enqueued_at: float, started_at: float, finished_at: float, ok: bool):
+        latency = (finished_at - enqueued_at) * 1000
+        with self._lock:
+            self.completed += 1
+            if not ok:
+                self.failed += 1
+            if self.slo_ms is not None and latency <= self.slo_ms:
+                self.slo_met += 1
+            self.wait_ms.append((started_at - enqueued_at) * 1000)
+            self.latency_ms.append(latency)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            wait = sorted(self.wait_ms)
+            latency = sorted(self.latency_ms)
+            result = {
+                "workers": self.workers,
+                "queue_depth": self.queue.qsize(),
+                "enqueued": self.enqueued,
+                "completed": self.completed,
+                "failed": self.failed,
+                "dropped": self.dropped,
+                "wait_ms": {"p50": percentile(wait, 50), "p95": percentile(wait, 95), "p99": percentile(wait, 99)},
+                "latency_ms": {"p50": percentile(latency, 50), "p95": percentile(latency, 95), "p99": percentile(latency, 99)}
+            }
+            if self.slo_ms is not None:
+                result["slo_ms"] = self.slo_ms
+                result["slo_met_rate"] = round(self.slo_met / self.completed * 100, 2) if self.completed else None
+            return result
+
+
+_lanes: Dict[constants.Lane, DispatchLane] = {}
+
+
+def start():
+    if _lanes:
+        return
+    _lanes[constants.Lane.EMERGENCY] = DispatchLane(
+        constants.Lane.EMERGENCY, settings.DISPATCH_WORKERS_EMERGENCY, settings.DISPATCH_QUEUE_SIZE,
+        slo_ms=settings.DISPATCH_EMERGENCY_SLO_MS
+    )
+    _lanes[constants.Lane.HIGH] = DispatchLane(constants.Lane.HIGH, settings.DISPATCH_WORKERS_HIGH, settings.DISPATCH_QUEUE_SIZE)
+    _lanes[constants.Lane.LOW] = DispatchLane(constants.Lane.LOW, settings.DISPATCH_WORKERS_LOW, settings.DISPATCH_QUEUE_SIZE)
+    for lane in _lanes.values():
+        lane.start()
+
+
+def stop():
+    for lane in _lanes.values():
+        lane.stop()
+    _lanes.clear()
+
+
+# 將通知排入對應風險等級的通道
+def dispatch(message: Message, log_id: Optional[int], risk_level: int) -> None:
+    """
+    通道尚未啟動（例如在 API 以外的程式中呼叫）時直接同步發送。
+    緊急通道佇列滿時改為同步發送，確保緊急通知不會被丟棄；
+    其他通道佇列滿時丟棄並記錄失敗的通知歷史。
+    """
+    message.enqueued_at = time.time()
+    lane = _lanes.get(lane_for(risk_level))
+    if lane is None:
+        msg.send_message(message, log_id)
+        return
+    if lane.put(message, log_id):
+        return
+    if lane.lane == constants.Lane.EMERGENCY:
+        logger.warning("緊急通道佇列已滿，改為同步發送")
+        msg.send_message(message, log_id)
+        return
+    error_msg = f"{lane.lane.value} 通道佇列已滿，通知已丟棄"
+    logger.warning(error_msg)
+    notification._save_notification_history(
+        notification.NotificationHistory(
+            log_id=log_id,
+            recipient=", ".join(message.employees) if message.employees else "Unknown",
+            message=error_msg,
+            status=constants.STATUS_FAILED,
+            error_message=error_msg
+        )
+    )
+
+
+# 各通道的佇列深度與延遲統計
+def stats() -> Dict[str, Any]:
+    return {lane.value: dispatch_lane.stats() for lane, dispatch_lane in _lanes.items()}
+
+
+# 目前所有通道排隊中的通知總數
+def queue_depth() -> int:
+    return sum(dispatch_lane.queue.qsize() for dispatch_lane in _lanes.values())
@@ -0,0 +1,231 @@
+"""
+通知升級模組
+緊急通知（風險等級 >= ESCALATION_MIN_RISK_LEVEL）發出後若沒有人確認，
+依 ESCALATION_STEPS_MINUTES 在第一次通知後的第 N 分鐘再次通知，並逐步加入 ESCALATION_STEP_EMPLOYEES 的人員。
+呼叫 POST /notifications/{log_id}/ack 確認後取消之後的升級。
+確認只針對當時待升級的通知：同一個指紋之後再次發出緊急通知時重新排定升級，並清除上一次的確認紀錄。
+
+待升級的通知放在 Redis sorted set（成員為日誌 ID、分數為下次升級的時間），
+新增與取消都是 O(log N)，數十萬筆待升級通知也只佔一個 key；通知內容與目前的升級階段另外存放。
+排程執行緒定期取出到期的成員，把分數改為 now + ESCALATION_LEASE_SECONDS 搶占（多台機器同時執行時只有一台會處理同一筆），
+送入推播通道後才排定下一個階段（或在最後一個階段後移除）；
+處理中途中斷時租約到期後會重新處理，升級通知不會遺失（最多重複發送一次）。
+"""
+import json
+import logging
+import threading
+import time
+from typing import Any, Dict, List, Optional
+import app.database as db
+import app.dispatcher as dispatcher
+from app.object import Message
+from app.settings import settings
+
+logger = logging.getLogger(__name__)
+
+DUE_KEY = "escalation:due"
+ALERT_PREFIX = "escalation:alert:"
+ACK_PREFIX = "escalation:ack:"
+
+# 把已到期（分數 <= ARGV[1]）的成員分數改為租約到期時間，回傳搶占到的成員
+_CLAIM_SCRIPT = """
+local claimed = {}
+for i = 3, #ARGV do
+    local score = redis.call('ZSCORE', KEYS[1], ARGV[i])
+    if score and tonumber(score) <= tonumber(ARGV[1]) then
+        redis.call('ZADD', KEYS[1], 'XX', ARGV[2], ARGV[i])
+        table.insert(claimed, ARGV[i])
+    end
+end
+return claimed
+"""
+_claim_script = None
+
+_lock = threading.Lock()
+_counters = {"scheduled": 0, "escalated": 0, "acknowledged": 0}
+
+
+# 第一次使用時才註冊腳本
+def _script():
+    global _claim_script
+    if _claim_script is None:
+        _claim_script = db.r.register_script(_CLAIM_SCRIPT)
+    return _claim_script
+
+
+def _count(name: str, value: int = 1) -> None:
+    with _lock:
+        _counters[name] += value
+
+
+# 各升級階段距離第一次通知的分鐘數
+def steps() -> List[int]:
+    return [int(step) for step in settings.ESCALATION_STEPS_MINUTES.split(",") if step.strip()]
+
+
+# 各升級階段加入的人員（以 ; 分隔階段、以 , 分隔人員，之後的階段沿用之前加入的人員）
+def step_employees(step: int) -> List[str]:
+    groups = settings.ESCALATION_STEP_EMPLOYEES.split(";")
+    employees = []
+    for group in groups[:step + 1]:
+        for employee in group.split(","):
+            if employee.strip() and employee.strip() not in employees:
+                employees.append(employee.strip())
+    return employees
+
+
+# 緊急通知發出後排定升級（已在排程中時不重新排定）
+def schedule(log_id: Optional[int], message: Message, risk_level: int) -> bool:
+    """日誌 ID 是同一個指紋重複使用的資料列，上一次的確認不影響新發出的通知"""
+    if not settings.ESCALATION_ENABLED or log_id is None or risk_level < settings.ESCALATION_MIN_RISK_LEVEL:
+        return False
+    delays = steps()
+    if not delays:
+        return False
+    try:
+        now = time.time()
+        alert = {"message": message.model_dump(), "risk_level": risk_level, "step": 0, "notified_at": now}
+        pipe = db.r.pipeline()
+        # 通知內容保留到最後一個階段之後一天，避免排程中斷時殘留
+        pipe.set(f"{ALERT_PREFIX}{log_id}", json.dumps(alert, ensure_ascii=False), ex=max(delays) * 60 + 86400, nx=True)
+        pipe.zadd(DUE_KEY, {str(log_id): now + delays[0] * 60}, nx=True)
+        created, _ = pipe.execute()
+        if created:
+            # 確認紀錄屬於上一次的通知
+            db.r.delete(f"{ACK_PREFIX}{log_id}")
+            _count("scheduled")
+        return bool(created)
+    except Exception as e:
+        logger.error(f"排定通知升級時發生錯誤: {e}", exc_info=True)
+        return False
+
+
+# 確認通知，取消之後的升級（沒有待升級的通知時不記錄確認）
+def acknowledge(log_id: int, by: Optional[str] = None) -> Dict[str, Any]:
+    acked_at = time.time()
+    pipe = db.r.pipeline()
+    pipe.zrem(DUE_KEY, str(log_id))
+    pipe.get(f"{ALERT_PREFIX}{log_id}")
+    pipe.delete(f"{ALERT_PREFIX}{log_id}")
+    removed, alert, _ = pipe.execute()
+    acknowledged = bool(removed or alert)
+    if acknowledged:
+        db.r.set(f"{ACK_PREFIX}{log_id}", json.dumps({"by": by, "at": acked_at}), ex=settings.ESCALATION_ACK_TTL)
+        _count("acknowledged")
+    return {
+        "log_id": log_id,
+        "acknowledged": acknowledged,
+        "acknowledged_by": by,
+        "acknowledged_at": acked_at,
+        "cancelled": bool(removed),
+        "step": json.loads(alert)["step"] if alert else None
+    }
+
+
+# 查詢確認狀態
+def acknowledgement(log_id: int) -> Optional[Dict[str, Any]]:
+    value = db.r.get(f"{ACK_PREFIX}{log_id}")
+    return json.loads(value) if value else None
+
+
+# 建立升級通知的內容
+def escalated_message(alert: Dict[str, Any]) -> Message:
+    message = Message.model_validate(alert["message"])
+    step = alert["step"]
+    employees = list(message.employees)
+    for employee in step_employees(step):
+        if employee not in employees:
+            employees.append(employee)
+    return message.model_copy(update={
+        "title": f"{message.title}（第 {step + 1} 次升級，尚未確認）",
+        "employees": employees,
+        # 升級通知不受冷卻時間限制
+        "fingerprint": None,
+        "received_at": alert["notified_at"],
+        "triggered_at": time.time()
+    })
+
+
+# 處理到期的升級，回傳發送的升級通知數
+def fire_due(now: Optional[float] = None) -> int:
+    now = now or time.time()
+    delays = steps()
+    fired = 0
+    while True:
+        due = db.r.zrangebyscore(DUE_KEY, "-inf", now, start=0, num=settings.ESCALATION_BATCH_SIZE)
+        if not due:
+            return fired
+        claimed = _script()(keys=[DUE_KEY], args=[now, now + settings.ESCALATION_LEASE_SECONDS, *due])
+        for member in claimed:
+            try:
+                raw = db.r.get(f"{ALERT_PREFIX}{member}")
+                if raw is None:
+                    db.r.zrem(DUE_KEY, member)
+                    continue
+                alert = json.loads(raw)
+                dispatcher.dispatch(escalated_message(alert), int(member), alert["risk_level"])
+                # 送出後才排定下一個階段；發送失敗時保留租約，到期後重新處理
+                # 以 XX 更新，處理期間已確認（成員已移除）時不會重新排入
+                next_step = alert["step"] + 1
+                pipe = db.r.pipeline()
+                if next_step < len(delays):
+                    pipe.set(f"{ALERT_PREFIX}{member}", json.dumps({**alert, "step": next_step}, ensure_ascii=False), keepttl=True, xx=True)
+                    pipe.zadd(DUE_KEY, {member: alert["notified_at"] + delays[next_step] * 60}, xx=True)
+                else:
+                    pipe.zrem(DUE_KEY, member)
+                    pipe.delete(f"{ALERT_PREFIX}{member}")
+                pipe.execute()
+                fired += 1
+                _count("escalated")
+            except Exception as e:
+                logger.error(f"發送升級通知時發生錯誤 (log_id={member}): {e}", exc_info=True)
+        if len(due) < settings.ESCALATION_BATCH_SIZE:
+            return fired
+
+
+def stats() -> Dict[str, Any]:
+    with _lock:
+        counters = dict(_counters)
+    try:
+        counters["pending"] = db.r.zcard(DUE_KEY)
+        counters["overdue"] = db.r.zcount(DUE_KEY, "-inf", time.time())
+    except Exception as e:
+        logger.error(f"查詢升級排程時發生錯誤: {e}", exc_info=True)
+    return {"enabled": settings.ESCALATION_ENABLED, "steps_minutes": steps(), **counters}
+
+
+class EscalationScheduler(threading.Thread):
+    """背景定期處理到期升級的執行緒"""
+
+    def __init__(self, interval: int):
+        super().__init__(name="escalation-scheduler", daemon=True)
+        self.interval = interval
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            try:
+                fire_due()
+            except Exception as e:
+                logger.error(f"處理通知升級時發生錯誤: {e}", exc_info=True)
+
+    def stop(self):
+        self._stop_event.set()
+        self.join(timeout=5)
+
+
+_scheduler: Optional[EscalationScheduler] = None
+
+
+def start():
+    global _scheduler
+    if settings.ESCALATION_ENABLED and _scheduler is None:
+        _scheduler = EscalationScheduler(settings.ESCALATION_POLL_SECONDS)
+        _scheduler.start()
+
+
+def stop():
+    global _scheduler
+    if _scheduler is not None:
+        _scheduler.stop()
+        _scheduler = None
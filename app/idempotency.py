@@ -0,0 +1,54 @@
+"""
+日誌寫入的冪等鍵模組
+用戶端重試 /logs 時帶上相同的 Idempotency-Key，伺服器在 IDEMPOTENCY_TTL 秒內
+直接回傳第一次的結果，不會重複累加次數或觸發通知，也不會存取 Supabase。
+"""
+import json
+import logging
+from typing import Any, Dict, Optional
+import app.database as db
+from app.settings import settings
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = "logs:idem:"
+# 第一次請求處理中的佔位值
+PENDING = "__pending__"
+
+
+class InProgress(Exception):
+    """相同冪等鍵的第一次請求仍在處理中"""
+
+
+# 開始處理：第一次出現回傳 None，重複的請求回傳第一次的結果
+def begin(key: str) -> Optional[Dict[str, Any]]:
+    """Redis 無法使用時不做冪等處理（回傳 None 照常寫入）"""
+    try:
+        if db.r.set(KEY_PREFIX + key, PENDING, nx=True, ex=settings.IDEMPOTENCY_TTL):
+            return None
+        stored = db.r.get(KEY_PREFIX + key)
+    except Exception as e:
+        logger.error(f"檢查冪等鍵時發生錯誤: {e}", exc_info=True)
+        return None
+    if stored is None:
+        # 剛好過期，視為第一次
+        return begin(key)
+    if stored == PENDING:
+        raise InProgress(key)
+    return json.loads(stored)
+
+
+# 處理成功：保存結果供重試時回傳
+def complete(key: str, response: Dict[str, Any]) -> None:
+    try:
+        db.r.set(KEY_PREFIX + key, json.dumps(response, ensure_ascii=False), ex=settings.IDEMPOTENCY_TTL)
+    except Exception as e:
+        logger.error(f"保存冪等鍵結果時發生錯誤: {e}", exc_info=True)
+
+
+# 處理失敗：移除佔位，讓重試可以重新處理
+def release(key: str) -> None:
+    try:
+        db.r.delete(KEY_PREFIX + key)
+    except Exception as e:
+        logger.error(f"移除冪等鍵時發生錯誤: {e}", exc_info=True)
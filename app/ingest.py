@@ -0,0 +1,42 @@
+"""
+日誌寫入流程
+HTTP /logs 與其他寫入入口共用：累加次數 → 通知相關人員 → 更新即時統計
+"""
+import logging
+from typing import Optional, Tuple
+import app.cardinality as cardinality
+import app.counter as counter
+import app.database as db
+import app.timeseries as timeseries
+import app.topk as topk
+from app.object import Log
+
+logger = logging.getLogger(__name__)
+
+
+# 寫入一筆日誌（increment 為此次累加的次數），回傳 (最新Log, 是否為新增)
+def process(log: Log, increment: int = 1) -> Optional[Tuple[Log, bool]]:
+    ingested = counter.add(log, increment)
+    if ingested is None:
+        return None
+    handle(*ingested, increment)
+    return ingested
+
+
+# 次數累加後的共用處理：通知相關人員並更新即時統計
+def handle(stored: Log, created: bool, increment: int = 1) -> None:
+    db.notify_log(stored, created, increment)
+    record_stats(stored, increment)
+
+
+# Top-K、基數與時間序列的更新排入同一個 pipeline，每筆日誌只有一次 Redis 往返
+def record_stats(stored: Log, increment: int = 1) -> None:
+    try:
+        pipe = db.r.pipeline(transaction=False)
+        topk.queue(pipe, stored, increment)
+        cardinality.queue(pipe, stored)
+        timeseries.queue(pipe, stored, increment)
+        pipe.execute()
+    except Exception as e:
+        topk.handle_error(e)
+        logger.error(f"更新即時統計時發生錯誤: {e}", exc_info=True)
@@ -1,8 +1,33 @@
 import datetime
-from fastapi import FastAPI, Query, HTTPException, Path
+import zlib
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Query, HTTPException, Path, Header, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.exceptions import RequestValidationError
+from pydantic import ValidationError
 from typing import List, Dict, Any, Optional
 import app.database as db
-from app.object import Log, NotificationHistory
+import app.counter as counter
+import app.ingest as ingest
+import app.topk as topk
+import app.cardinality as cardinality
+import app.timeseries as timeseries
+import app.dispatcher as dispatcher
+import app.webhooks as webhooks
+import app.escalation as escalation
+import app.cooldown as cooldown
+import app.admission as admission
+import app.idempotency as idempotency
+import app.sharding as sharding
+import app.syslog_listener as syslog_listener
+import app.archive as archive
+import app.aggregate as aggregate
+import app.notification as notification
+import app.rules as rules
+import app.versions as versions
+from app.settings import settings
+from app.object import Log, LogBatchRequest, LogLookupRequest, LogListResponse, LogStatisticsResponse, NotificationListResponse, NotificationStatisticsResponse
+from app.responses import FastJSONResponse
 import logging
 import app.constants as constants
 
@@ -10,13 +35,62 @@ import app.constants as constants
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """啟動與關閉背景工作"""
+    counter.start()
+    dispatcher.start()
+    escalation.start()
+    if settings.SYSLOG_ENABLED:
+        syslog_listener.start()
+    yield
+    syslog_listener.stop()
+    counter.stop()
+    escalation.stop()
+    dispatcher.stop()
+    webhooks.shutdown()
+
+
 app = FastAPI(
     title="Push System API",
     description="系統日誌記錄與通知推播系統",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 
+# 支援 ETag / If-None-Match 的查詢 API 與其資料版本範圍
+CONDITIONAL_ENDPOINTS = {
+    "/logs/list": [versions.LOGS],
+    "/logs/statistics": [versions.LOGS],
+    "/logs/aggregate": [versions.LOGS],
+    "/notifications/history": [versions.NOTIFICATIONS],
+    "/notifications/statistics": [versions.NOTIFICATIONS],
+    "/notifications/latency": [versions.NOTIFICATIONS]
+}
+
+
+@app.middleware("http")
+async def conditional_get(request: Request, call_next):
+    """資料版本未變更時直接回傳 304，不查詢資料庫也不序列化回應"""
+    scopes = CONDITIONAL_ENDPOINTS.get(request.url.path)
+    if request.method != "GET" or scopes is None:
+        return await call_next(request)
+    if request.url.path == "/logs/list" and request.query_params.get("include_notifications", "").lower() in ("1", "true", "yes", "on"):
+        scopes = scopes + [versions.NOTIFICATIONS]
+    # 查詢前先取得版本號：查詢期間有新的寫入時 ETag 會比資料舊，下一次輪詢會重新查詢
+    tag = await run_in_threadpool(versions.etag, request.url.path, request.query_params.multi_items(), scopes)
+    if tag is None:
+        return await call_next(request)
+    if versions.matches(request.headers.get("if-none-match"), tag):
+        return Response(status_code=304, headers=versions.headers(tag))
+    response = await call_next(request)
+    if response.status_code == 200:
+        response.headers.update(versions.headers(tag))
+    return response
+
+
 @app.get("/", response_model=Dict[str, str])
 def root() -> Dict[str, str]:
     """API 根路徑"""
@@ -33,8 +107,15 @@ def health_check() -> Dict[str, str]:
     return {"status": "healthy", "service": "push_system"}
 
 
+@app.get("/health/replica", response_model=Dict[str, Any])
+def replica_health() -> Dict[str, Any]:
+    """唯讀複本狀態"""
+    return db.replica_stats()
+
+
 @app.get("/logs", response_model=Dict[str, Any])
 def logs(
+        response: Response,
         riskLevel: int = Query(0, ge=0, le=3, description="風險等級: 0=無, 1=普通, 2=高風險, 3=緊急"),
         type: int = Query(0, ge=0, description="日誌類型"),
         location: str = Query("", description="發生位置"),
@@ -42,7 +123,9 @@ def logs(
         log: str = Query("", description="日誌內容"),
         employees: List[str] = Query([], description="相關員工列表"),
         date: datetime.date = Query(default_factory=lambda: datetime.datetime.now().date()),
-        time: datetime.time = Query(default_factory=lambda: datetime.datetime.now().time())
+        time: datetime.time = Query(default_factory=lambda: datetime.datetime.now().time()),
+        idempotency_key: Optional[str] = Query(None, max_length=255, description="冪等鍵（也可使用 Idempotency-Key header）"),
+        idempotency_header: Optional[str] = Header(None, alias="Idempotency-Key", max_length=255)
     ) -> Dict[str, Any]:
     """接收並記錄系統日誌，自動判斷是否需要通知相關人員"""
     try:
@@ -53,6 +136,21 @@ def logs(
                 detail="location, function, log 為必填欄位"
             )
         
+        # 重試的請求（相同冪等鍵）直接回傳第一次的結果，不再寫入資料庫
+        key = idempotency_header or idempotency_key
+        if key:
+            try:
+                replay = idempotency.begin(key)
+            except idempotency.InProgress:
+                raise HTTPException(
+                    status_code=409,
+                    detail="相同 Idempotency-Key 的請求處理中，請稍後重試",
+                    headers={"Retry-After": "1"}
+                )
+            if replay is not None:
+                response.headers["Idempotent-Replayed"] = "true"
+                return replay
+        
         # 接收log資料
         item = Log(
             riskLevel=riskLevel,
@@ -64,23 +162,16 @@ def logs(
             date=date,
             time=time
         )
-
-        # 判斷是否為重複問題的Log 是就增加次數 否則新增一筆
-        existing_log = db.check_log(item)
-        if existing_log is not None:
-            # check_log 已返回 Log 物件，直接增加 count 並更新
-            existing_log.count += 1
-            result = db.update_log(existing_log)
-            if result is None:
-                raise HTTPException(status_code=500, detail="更新日誌失敗")
-            logger.info(f"日誌已更新: {location}/{function} - 次數: {existing_log.count}")
-            return {"status": "updated", "message": "日誌次數已更新", "count": existing_log.count}
-        else:
-            result = db.insert_log(item)
-            if result is None:
-                raise HTTPException(status_code=500, detail="新增日誌失敗")
-            logger.info(f"新增日誌: {location}/{function}")
-            return {"status": "created", "message": "日誌已建立"}
+        
+        try:
+            result = _record_log(item)
+        except Exception:
+            if key:
+                idempotency.release(key)
+            raise
+        if key:
+            idempotency.complete(key, result)
+        return result
     
     except HTTPException:
         raise
@@ -89,45 +180,357 @@ def logs(
         raise HTTPException(status_code=500, detail=f"處理日誌失敗: {str(e)}")
 
 
-@app.get("/logs/list", response_model=Dict[str, Any])
-def get_logs_list(
+# 准入判斷後寫入日誌（increment 為此次累加的次數），回傳 /logs 的回應內容
+def _record_log(item: Log, increment: int = 1) -> Dict[str, Any]:
+    # 過載時依風險等級取樣或拒絕（緊急日誌永遠接受）
+    if not admission.admit(item.riskLevel):
+        raise HTTPException(
+            status_code=429,
+            detail="系統忙碌中，請稍後重試",
+            headers={"Retry-After": str(settings.ADMISSION_RETRY_AFTER)}
+        )
+    
+    with admission.inflight():
+        # 啟用分片時排入負責此指紋的分片佇列，由分片 worker 累加次數與通知（沒有存活的分片時直接寫入）
+        if settings.SHARDING_ENABLED:
+            shard = sharding.submit(item, increment)
+            if shard is not None:
+                return {"status": "queued", "message": "日誌已排入處理佇列", "shard": shard}
+            logger.warning("沒有存活的分片 worker 或無法排入分片佇列，改為直接寫入")
+        
+        # 以指紋原子化判斷是否為重複問題的Log 是就增加次數 否則新增一筆（次數由 counter 合併寫回）
+        ingested = ingest.process(item, increment)
+    if ingested is None:
+        raise HTTPException(status_code=500, detail="寫入日誌失敗")
+    stored, created = ingested
+    if created:
+        logger.info(f"新增日誌: {item.location}/{item.function}")
+        return {"status": "created", "message": "日誌已建立"}
+    logger.info(f"日誌已更新: {item.location}/{item.function} - 次數: {stored.count}")
+    return {"status": "updated", "message": "日誌次數已更新", "count": stored.count}
+
+
+# 解壓縮 gzip 請求內容（限制解壓後的大小，避免壓縮炸彈）
+def _gunzip(body: bytes) -> bytes:
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    try:
+        data = decompressor.decompress(body, settings.LOG_BATCH_MAX_BYTES + 1)
+    except zlib.error:
+        raise HTTPException(status_code=400, detail="gzip 內容格式錯誤")
+    if len(data) > settings.LOG_BATCH_MAX_BYTES:
+        raise HTTPException(status_code=413, detail="批次內容過大")
+    return data
+
+
+@app.post("/logs/batch", response_model=Dict[str, Any])
+async def logs_batch(
+        request: Request,
+        response: Response,
+        idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key", max_length=255)
+    ) -> Dict[str, Any]:
+    """批次接收客戶端預先彙總的日誌（支援 Content-Encoding: gzip），每筆的 count 為此次累加的次數"""
+    body = await request.body()
+    if len(body) > settings.LOG_BATCH_MAX_BYTES:
+        raise HTTPException(status_code=413, detail="批次內容過大")
+    if request.headers.get("content-encoding", "").lower() == "gzip":
+        body = _gunzip(body)
+    try:
+        batch = LogBatchRequest.model_validate_json(body)
+    except ValidationError as e:
+        raise RequestValidationError(e.errors())
+    return await run_in_threadpool(_record_batch, batch, idempotency_key, response)
+
+
+def _record_batch(batch: LogBatchRequest, key: Optional[str], response: Response) -> Dict[str, Any]:
+    """逐筆准入並寫入，回傳每筆的結果（rejected / failed 的項目可由客戶端重送）"""
+    try:
+        # 重試的批次（相同冪等鍵）直接回傳第一次的結果，不會重複計數
+        if key:
+            try:
+                replay = idempotency.begin(key)
+            except idempotency.InProgress:
+                raise HTTPException(
+                    status_code=409,
+                    detail="相同 Idempotency-Key 的請求處理中，請稍後重試",
+                    headers={"Retry-After": "1"}
+                )
+            if replay is not None:
+                response.headers["Idempotent-Replayed"] = "true"
+                return replay
+        
+        now = datetime.datetime.now()
+        results = []
+        for entry in batch.logs:
+            try:
+                item = Log(
+                    riskLevel=entry.riskLevel,
+                    type=entry.type,
+                    location=entry.location,
+                    function=entry.function,
+                    log=entry.log,
+                    employees=entry.employees,
+                    date=entry.date or now.date(),
+                    time=entry.time or now.time()
+                )
+                results.append(_record_log(item, entry.count)["status"])
+            except HTTPException as e:
+                results.append("rejected" if e.status_code == 429 else "failed")
+            except Exception as e:
+                # 前面的項目已經計數，不能釋放冪等鍵讓重試整批重寫：此筆記為失敗，由客戶端只重送失敗的項目
+                logger.error(f"寫入批次中的日誌時發生錯誤: {str(e)}", exc_info=True)
+                results.append("failed")
+        
+        result = {
+            "status": "success",
+            "results": results,
+            "accepted": sum(1 for status in results if status not in ("rejected", "failed")),
+            "rejected": results.count("rejected"),
+            "failed": results.count("failed")
+        }
+        if key:
+            idempotency.complete(key, result)
+        if result["rejected"]:
+            response.headers["Retry-After"] = str(settings.ADMISSION_RETRY_AFTER)
+        return result
+    
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"處理批次日誌時發生錯誤: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"處理批次日誌失敗: {str(e)}")
+
+
+@app.get("/logs/admission", response_model=Dict[str, Any])
+def get_admission_state() -> Dict[str, Any]:
+    """查詢日誌寫入的准入狀態（過載判斷指標與接受 / 拒絕次數）"""
+    return {
+        "status": "success",
+        **admission.stats()
+    }
+
+
+@app.get("/logs/top", response_model=Dict[str, Any])
+def get_logs_top(
+        dimension: str = Query("location", pattern="^(location|function)$", description="統計維度: location 或 function"),
+        hours: int = Query(24, ge=1, le=168, description="最近幾小時"),
+        k: int = Query(10, ge=1, le=100, description="回傳筆數")
+    ) -> Dict[str, Any]:
+    """查詢最近一段時間內發生次數最多的位置或功能模組（近似值，count - error 為保證的最少次數）"""
+    try:
+        return {
+            "status": "success",
+            "dimension": dimension,
+            "hours": hours,
+            "data": topk.top(dimension, hours, k)
+        }
+    except Exception as e:
+        logger.error(f"查詢 Top-K 統計時發生錯誤: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"查詢失敗: {str(e)}")
+
+
+@app.get("/logs/cardinality", response_model=Dict[str, Any])
+def get_logs_cardinality(
+        dimension: str = Query("fingerprint", pattern="^(fingerprint|location|employee)$", description="統計維度: fingerprint、location 或 employee"),
+        date_from: datetime.date = Query(None, description="開始日期（預設今天）"),
+        date_to: datetime.date = Query(None, description="結束日期（預設今天）"),
+        granularity: str = Query("day", pattern="^(hour|day)$", description="時間桶: hour 或 day")
+    ) -> Dict[str, Any]:
+    """查詢日期範圍內不重複的問題、位置或相關員工數量（HyperLogLog 近似值，誤差約 0.81%）"""
+    try:
+        if not date_to:
+            date_to = datetime.date.today()
+        if not date_from:
+            date_from = date_to
+        if date_from > date_to:
+            raise HTTPException(status_code=400, detail="date_from 不可晚於 date_to")
+        # 未來的時間桶一定是空的，結束日期最晚到今天
+        today = datetime.date.today()
+        date_to = max(date_from, min(date_to, today))
+        # 每小時的時間桶只保留 HLL_HOURLY_RETENTION_DAYS 天，每日的時間桶只保留 HLL_DAILY_RETENTION_DAYS 天
+        if granularity == cardinality.GRANULARITY_HOUR:
+            oldest = today - datetime.timedelta(days=settings.HLL_HOURLY_RETENTION_DAYS)
+        else:
+            oldest = today - datetime.timedelta(days=settings.HLL_DAILY_RETENTION_DAYS)
+        if date_from < oldest:
+            raise HTTPException(status_code=400, detail=f"granularity={granularity} 只能查詢 {oldest} 之後的資料")
+        
+        return {
+            "status": "success",
+            "dimension": dimension,
+            "period": {"from": str(date_from), "to": str(date_to)},
+            "granularity": granularity,
+            **cardinality.count(dimension, date_from, date_to, granularity)
+        }
+    
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"查詢基數統計時發生錯誤: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"查詢失敗: {str(e)}")
+
+
+@app.get("/logs/timeseries", response_model=Dict[str, Any], response_class=FastJSONResponse)
+def get_logs_timeseries(
+        date_from: datetime.datetime = Query(None, description="開始時間（預設 24 小時前）"),
+        date_to: datetime.datetime = Query(None, description="結束時間（預設現在）"),
+        bucket: str = Query("auto", pattern="^(auto|minute|hour|day)$", description="時間桶: auto、minute、hour 或 day")
+    ) -> Dict[str, Any]:
+    """查詢每個時間桶依風險等級統計的日誌數量（由預先彙總的時間桶向下取樣）"""
+    try:
+        if not date_to:
+            date_to = datetime.datetime.now()
+        if not date_from:
+            date_from = date_to - datetime.timedelta(hours=24)
+        if date_from > date_to:
+            raise HTTPException(status_code=400, detail="date_from 不可晚於 date_to")
+        # 未來的時間桶一定是空的，結束時間最晚到現在
+        now = datetime.datetime.now()
+        date_to = max(date_from, min(date_to, now))
+        if bucket == "auto":
+            bucket = timeseries.auto_bucket(date_from, date_to)
+        
+        # 分鐘時間桶只保存 TS_MINUTE_RETENTION_HOURS 小時，小時時間桶只保存 TS_HOUR_RETENTION_DAYS 天
+        source = timeseries.source_for(bucket)
+        if source == timeseries.BUCKET_MINUTE:
+            oldest = now - datetime.timedelta(hours=settings.TS_MINUTE_RETENTION_HOURS)
+        else:
+            oldest = now - datetime.timedelta(days=settings.TS_HOUR_RETENTION_DAYS)
+        if date_from < oldest:
+            raise HTTPException(status_code=400, detail=f"bucket={bucket} 只能查詢 {oldest.isoformat(timespec='minutes')} 之後的資料")
+        if timeseries.source_buckets(source, date_from, date_to) > settings.TS_MAX_QUERY_BUCKETS:
+            raise HTTPException(status_code=400, detail=f"查詢範圍超過 {settings.TS_MAX_QUERY_BUCKETS} 個時間桶，請縮小範圍")
+        
+        return FastJSONResponse({
+            "status": "success",
+            "period": {"from": date_from.isoformat(), "to": date_to.isoformat()},
+            **timeseries.query(date_from, date_to, bucket)
+        })
+    
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"查詢時間序列時發生錯誤: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"查詢失敗: {str(e)}")
+
+
+@app.get("/logs/aggregate", response_model=Dict[str, Any], response_class=FastJSONResponse)
+def get_logs_aggregate(
+        group_by: str = Query("location", description=f"分組維度，以逗號分隔（可用: {', '.join(aggregate.DIMENSIONS)}）"),
         riskLevel: int = Query(None, ge=0, le=3, description="篩選風險等級"),
         location: str = Query(None, description="篩選位置"),
         function: str = Query(None, description="篩選功能模組"),
-        date_from: datetime.date = Query(None, description="開始日期"),
-        date_to: datetime.date = Query(None, description="結束日期"),
-        limit: int = Query(10, ge=1, le=100, description="每頁筆數"),
-        offset: int = Query(0, ge=0, description="偏移量")
+        date_from: datetime.date = Query(None, description="開始日期（預設 7 天前）"),
+        date_to: datetime.date = Query(None, description="結束日期（預設今天）"),
+        order_by: str = Query("sum", pattern="^(rows|sum|max)$", description="排序指標: rows、sum 或 max"),
+        limit: int = Query(50, ge=1, le=1000, description="回傳的分組數")
     ) -> Dict[str, Any]:
-    """查詢日誌列表，支援分頁和篩選"""
+    """依任意維度組合彙總原始日誌的筆數、count 總和與最大值（分批讀取，不受日期範圍大小影響記憶體）"""
     try:
-        filters = []
+        if not date_from:
+            date_from = datetime.date.today() - datetime.timedelta(days=7)
+        if not date_to:
+            date_to = datetime.date.today()
+        if date_from > date_to:
+            raise HTTPException(status_code=400, detail="date_from 不可晚於 date_to")
+        dimensions = [name.strip() for name in group_by.split(",") if name.strip()]
         
-        # 根據參數建立篩選條件
+        filters = []
         if riskLevel is not None:
             filters.append(db.DBFilter(name="riskLevel", operator=db.Opreator.EQUAL, values=[str(riskLevel)]))
         if location:
             filters.append(db.DBFilter(name="location", operator=db.Opreator.ILIKE, values=[f"%{location}%"]))
         if function:
             filters.append(db.DBFilter(name="function", operator=db.Opreator.ILIKE, values=[f"%{function}%"]))
-        if date_from:
-            filters.append(db.DBFilter(name="date", operator=db.Opreator.GREATER_OR_EQUAL, values=[str(date_from)]))
-        if date_to:
-            filters.append(db.DBFilter(name="date", operator=db.Opreator.LESS_OR_EQUAL, values=[str(date_to)]))
         
-        # 查詢資料
-        result = db.get_logs_with_pagination(filters, limit, offset)
+        try:
+            result = aggregate.query(dimensions, date_from, date_to, filters, order_by, limit)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        return FastJSONResponse({
+            "status": "success",
+            "period": {"from": str(date_from), "to": str(date_to)},
+            **result
+        })
+    
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"彙總日誌時發生錯誤: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"彙總失敗: {str(e)}")
+
+
+@app.get("/logs/list", response_model=LogListResponse, response_class=FastJSONResponse)
+def get_logs_list(
+        q: Optional[str] = Query(None, description="全文搜尋（位置、功能模組、日誌內容，支援前綴比對）"),
+        riskLevel: int = Query(None, ge=0, le=3, description="篩選風險等級"),
+        location: str = Query(None, description="篩選位置"),
+        function: str = Query(None, description="篩選功能模組"),
+        date_from: datetime.date = Query(None, description="開始日期"),
+        date_to: datetime.date = Query(None, description="結束日期"),
+        limit: int = Query(10, ge=1, le=100, description="每頁筆數"),
+        offset: int = Query(0, ge=0, description="偏移量"),
+        include_notifications: bool = Query(False, description="一併回傳每筆日誌的通知歷史")
+    ) -> Dict[str, Any]:
+    """查詢日誌列表，支援分頁和篩選；指定 q 時依搜尋相關度排序"""
+    try:
+        if q and db.to_tsquery(q):
+            # 全文搜尋走資料庫的搜尋索引（只涵蓋熱資料）
+            result = db.search_logs(
+                q,
+                riskLevel=riskLevel,
+                location=location,
+                function=function,
+                date_from=str(date_from) if date_from else None,
+                date_to=str(date_to) if date_to else None,
+                limit=limit,
+                offset=offset
+            )
+            if result is None:
+                raise HTTPException(status_code=500, detail="搜尋日誌失敗")
+            data = result.data if result.data else []
+        else:
+            filters = []
+            
+            # 根據參數建立篩選條件
+            if riskLevel is not None:
+                filters.append(db.DBFilter(name="riskLevel", operator=db.Opreator.EQUAL, values=[str(riskLevel)]))
+            if location:
+                filters.append(db.DBFilter(name="location", operator=db.Opreator.ILIKE, values=[f"%{location}%"]))
+            if function:
+                filters.append(db.DBFilter(name="function", operator=db.Opreator.ILIKE, values=[f"%{function}%"]))
+            if date_from:
+                filters.append(db.DBFilter(name="date", operator=db.Opreator.GREATER_OR_EQUAL, values=[str(date_from)]))
+            if date_to:
+                filters.append(db.DBFilter(name="date", operator=db.Opreator.LESS_OR_EQUAL, values=[str(date_to)]))
+            
+            # 日期範圍涵蓋已封存的分區時，合併熱資料與封存資料後再分頁
+            if archive.covers("TB_LOGS", date_from):
+                result = db.get_logs_with_pagination(filters, offset + limit, 0)
+                if result is None:
+                    raise HTTPException(status_code=500, detail="查詢日誌失敗")
+                data = archive.merge_page(
+                    result.data or [],
+                    archive.read_archived("TB_LOGS", date_from, date_to, filters),
+                    lambda row: (str(row.get("date")), str(row.get("time"))),
+                    limit,
+                    offset
+                )
+            else:
+                result = db.get_logs_with_pagination(filters, limit, offset)
+                if result is None:
+                    raise HTTPException(status_code=500, detail="查詢日誌失敗")
+                data = result.data if result.data else []
         
-        if result is None:
-            raise HTTPException(status_code=500, detail="查詢日誌失敗")
+        if include_notifications:
+            _embed_notifications(data)
         
-        return {
+        return FastJSONResponse({
             "status": "success",
-            "data": result.data if result.data else [],
-            "count": len(result.data) if result.data else 0,
+            "data": data,
+            "count": len(data),
             "limit": limit,
             "offset": offset
-        }
+        })
     
     except HTTPException:
         raise
@@ -136,31 +539,47 @@ def get_logs_list(
         raise HTTPException(status_code=500, detail=f"查詢失敗: {str(e)}")
 
 
-@app.get("/logs/{log_id}", response_model=Dict[str, Any])
-def get_log_by_id(log_id: int) -> Dict[str, Any]:
-    """根據 ID 查詢單筆日誌詳情"""
+# 以一次 IN 查詢取得整頁日誌的通知歷史，附加到每筆日誌的 notifications 欄位
+def _embed_notifications(rows: List[Dict[str, Any]]) -> None:
+    ids = [row["id"] for row in rows if row.get("id") is not None]
+    histories = db.get_notifications_by_log_ids(ids) if ids else {}
+    if histories is None:
+        raise HTTPException(status_code=500, detail="查詢通知歷史失敗")
+    for row in rows:
+        row["notifications"] = histories.get(row.get("id"), [])
+
+
+@app.post("/logs/lookup", response_model=Dict[str, Any], response_class=FastJSONResponse)
+def lookup_logs(request: LogLookupRequest) -> Dict[str, Any]:
+    """一次查詢多筆日誌（依傳入的 ID 順序回傳，找不到的 ID 列於 missing）"""
     try:
-        filters = [db.DBFilter(name="id", operator=db.Opreator.EQUAL, values=[str(log_id)])]
-        result = db.call_by_filters("TB_LOGS", filters)
+        ids = list(dict.fromkeys(request.ids))
+        rows = db.get_logs_by_ids(ids) if ids else []
+        if rows is None:
+            raise HTTPException(status_code=500, detail="查詢日誌失敗")
         
-        if result is None or not result.data or len(result.data) == 0:
-            raise HTTPException(status_code=404, detail=f"找不到 ID 為 {log_id} 的日誌")
+        by_id = {row["id"]: row for row in rows}
+        data = [by_id[log_id] for log_id in ids if log_id in by_id]
+        if request.include_notifications:
+            _embed_notifications(data)
         
-        return {
+        return FastJSONResponse({
             "status": "success",
-            "data": result.data[0]
-        }
+            "data": data,
+            "count": len(data),
+            "missing": [log_id for log_id in ids if log_id not in by_id]
+        })
     
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"查詢日誌詳情時發生錯誤: {str(e)}", exc_info=True)
+        logger.error(f"批次查詢日誌時發生錯誤: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"查詢失敗: {str(e)}")
 
 
 # 查詢最近 7 天（預設）
 # 指定日期範圍
-@app.get("/logs/statistics", response_model=Dict[str, Any])
+@app.get("/logs/statistics", response_model=LogStatisticsResponse, response_class=FastJSONResponse)
 def get_logs_statistics(
         date_from: datetime.date = Query(None, description="開始日期"),
         date_to: datetime.date = Query(None, description="結束日期")
@@ -173,63 +592,60 @@ def get_logs_statistics(
         if not date_to:
             date_to = datetime.date.today()
         
-        filters = [
-            db.DBFilter(name="date", operator=db.Opreator.GREATER_OR_EQUAL, values=[str(date_from)]),
-            db.DBFilter(name="date", operator=db.Opreator.LESS_OR_EQUAL, values=[str(date_to)])
-        ]
-        
-        result = db.call_by_filters("TB_LOGS", filters)
+        # 分批讀取（涵蓋已封存的分區時一併讀取封存資料），一次讀取同時彙總三種分組
+        by_risk_level, by_location, by_function = aggregate.aggregate(
+            aggregate.log_chunks(date_from, date_to, [], ["riskLevel", "location", "function", "count"]),
+            [aggregate.Aggregation(["riskLevel"]), aggregate.Aggregation(["location"]), aggregate.Aggregation(["function"])]
+        )
         
-        if result is None or not result.data:
-            return {
-                "status": "success",
-                "period": {"from": str(date_from), "to": str(date_to)},
-                "total_logs": 0,
-                "by_risk_level": {},
-                "by_location": {},
-                "by_function": {}
-            }
+        return FastJSONResponse({
+            "status": "success",
+            "period": {"from": str(date_from), "to": str(date_to)},
+            "total_logs": by_risk_level.totals()["rows"],
+            "by_risk_level": {item["riskLevel"]: item["rows"] for item in by_risk_level.result("rows")},
+            "by_location": {item["location"]: item["rows"] for item in by_location.result("rows", 10)},
+            "by_function": {item["function"]: item["rows"] for item in by_function.result("rows", 10)}
+        })
+    
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"查詢統計資訊時發生錯誤: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"查詢統計失敗: {str(e)}")
+
+
+@app.get("/logs/{log_id}", response_model=Dict[str, Any])
+def get_log_by_id(
+        log_id: int,
+        include_notifications: bool = Query(False, description="一併回傳此日誌的通知歷史")
+    ) -> Dict[str, Any]:
+    """根據 ID 查詢單筆日誌詳情"""
+    try:
+        filters = [db.DBFilter(name="id", operator=db.Opreator.EQUAL, values=[str(log_id)])]
+        result = db.call_by_filters("TB_LOGS", filters, read_only=True)
         
-        logs = result.data
+        if result is None or not result.data or len(result.data) == 0:
+            raise HTTPException(status_code=404, detail=f"找不到 ID 為 {log_id} 的日誌")
         
-        # 統計資料
-        by_risk_level = {}
-        by_location = {}
-        by_function = {}
-        
-        for log_item in logs:
-            risk = log_item.get('riskLevel', 0)
-            location = log_item.get('location', 'Unknown')
-            function = log_item.get('function', 'Unknown')
-            
-            # 按風險等級統計
-            by_risk_level[risk] = by_risk_level.get(risk, 0) + 1
-            
-            # 按位置統計
-            by_location[location] = by_location.get(location, 0) + 1
-            
-            # 按功能統計
-            by_function[function] = by_function.get(function, 0) + 1
+        data = result.data[0]
+        if include_notifications:
+            _embed_notifications([data])
         
         return {
             "status": "success",
-            "period": {"from": str(date_from), "to": str(date_to)},
-            "total_logs": len(logs),
-            "by_risk_level": by_risk_level,
-            "by_location": dict(sorted(by_location.items(), key=lambda x: x[1], reverse=True)[:10]),
-            "by_function": dict(sorted(by_function.items(), key=lambda x: x[1], reverse=True)[:10])
+            "data": data
         }
     
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"查詢統計資訊時發生錯誤: {str(e)}", exc_info=True)
-        raise HTTPException(status_code=500, detail=f"查詢統計失敗: {str(e)}")
+        logger.error(f"查詢日誌詳情時發生錯誤: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"查詢失敗: {str(e)}")
 
 
 # ==================== 通知歷史 API ====================
 
-@app.get("/notifications/history", response_model=Dict[str, Any])
+@app.get("/notifications/history", response_model=NotificationListResponse, response_class=FastJSONResponse)
 def get_notification_history(
         log_id: Optional[int] = Query(None, description="篩選特定日誌的通知"),
         channel: Optional[str] = Query(None, description="篩選通知渠道"),
@@ -250,37 +666,134 @@ def get_notification_history(
         if status:
             filters.append(db.DBFilter(name="status", operator=db.Opreator.EQUAL, values=[status]))
         if date_from:
-            filters.append(db.DBFilter(name="send_at", operator=db.Opreator.GREATER_OR_EQUAL, values=[str(date_from)]))
+            filters.append(db.DBFilter(name="sent_at", operator=db.Opreator.GREATER_OR_EQUAL, values=[str(date_from)]))
         if date_to:
-            filters.append(db.DBFilter(name="send_at", operator=db.Opreator.LESS_OR_EQUAL, values=[str(date_to)]))
+            filters.append(db.DBFilter(name="sent_at", operator=db.Opreator.LESS_OR_EQUAL, values=[str(date_to)]))
         
-        # 查詢通知歷史
-        query = db.supabase.table("TB_NOTIFICATION_HISTORY").select("*")
-        for f in filters:
-            query = query.filter(f.name, f.operator, f.values[0] if len(f.values) == 1 else f.values)
+        # 查詢通知歷史（唯讀複本可用時使用複本）
+        def query_page(start: int, end: int):
+            def query(client):
+                query = client.table("TB_NOTIFICATION_HISTORY").select("*")
+                for f in filters:
+                    query = query.filter(f.name, f.operator, f.values[0] if len(f.values) == 1 else f.values)
+                return query.order("sent_at", desc=True).range(start, end).execute()
+            return db.read(query)
         
-        query = query.order("send_at", desc=True).range(offset, offset + limit - 1)
-        result = query.execute()
+        # 日期範圍涵蓋已封存的分區時，合併熱資料與封存資料後再分頁
+        if archive.covers("TB_NOTIFICATION_HISTORY", date_from):
+            result = query_page(0, offset + limit - 1)
+            data = archive.merge_page(
+                result.data or [],
+                archive.read_archived("TB_NOTIFICATION_HISTORY", date_from, date_to, filters),
+                lambda row: str(row.get("sent_at")),
+                limit,
+                offset
+            )
+        else:
+            result = query_page(offset, offset + limit - 1)
+            data = result.data if result.data else []
         
-        return {
+        return FastJSONResponse({
             "status": "success",
-            "data": result.data if result.data else [],
-            "count": len(result.data) if result.data else 0,
+            "data": data,
+            "count": len(data),
             "limit": limit,
             "offset": offset
-        }
+        })
     
     except Exception as e:
         logger.error(f"查詢通知歷史時發生錯誤: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"查詢失敗: {str(e)}")
 
 
+@app.get("/notifications/dispatch", response_model=Dict[str, Any])
+def get_dispatch_statistics() -> Dict[str, Any]:
+    """查詢各推播優先通道的佇列深度與延遲（p50/p95/p99）、Webhook 連線池狀態與冷卻略過的通知數"""
+    return {
+        "status": "success",
+        "lanes": dispatcher.stats(),
+        "webhooks": webhooks.stats(),
+        "cooldown": cooldown.stats()
+    }
+
+
+@app.get("/notifications/latency", response_model=Dict[str, Any], response_class=FastJSONResponse)
+def get_notification_latency(
+        date_from: datetime.date = Query(None, description="開始日期"),
+        date_to: datetime.date = Query(None, description="結束日期"),
+        channel: Optional[constants.Channel] = Query(None, description="通知渠道"),
+        risk_level: Optional[int] = Query(None, ge=0, le=3, description="風險等級")
+    ) -> Dict[str, Any]:
+    """查詢通知端到端延遲（收到日誌 → 達到門檻 → 排入通道 → 第一次嘗試 → 送達）依渠道與風險等級的 p50/p95/p99 與緊急通知 SLO 達成率"""
+    try:
+        # 預設查詢最近 7 天
+        if not date_from:
+            date_from = datetime.date.today() - datetime.timedelta(days=7)
+        if not date_to:
+            date_to = datetime.date.today()
+        
+        filters = [
+            db.DBFilter(name="sent_at", operator=db.Opreator.GREATER_OR_EQUAL, values=[str(date_from)]),
+            db.DBFilter(name="sent_at", operator=db.Opreator.LESS_OR_EQUAL, values=[f"{date_to}T23:59:59.999999"])
+        ]
+        if channel:
+            filters.append(db.DBFilter(name="channel", operator=db.Opreator.EQUAL, values=[channel.value]))
+        if risk_level is not None:
+            filters.append(db.DBFilter(name="risk_level", operator=db.Opreator.EQUAL, values=[str(risk_level)]))
+        
+        result = db.call_by_filters("TB_NOTIFICATION_HISTORY", filters, read_only=True)
+        if result is None:
+            raise HTTPException(status_code=500, detail="查詢通知歷史失敗")
+        rows = result.data or []
+        # 日期範圍涵蓋已封存的分區時一併統計封存資料
+        if archive.covers("TB_NOTIFICATION_HISTORY", date_from):
+            hot_ids = {row.get("id") for row in rows}
+            rows = rows + [
+                row for row in archive.read_archived("TB_NOTIFICATION_HISTORY", date_from, date_to, filters[2:])
+                if row.get("id") not in hot_ids
+            ]
+        
+        return FastJSONResponse({
+            "status": "success",
+            "period": {"from": str(date_from), "to": str(date_to)},
+            **notification.latency_report(rows, settings.DISPATCH_EMERGENCY_SLO_MS)
+        })
+    
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"查詢通知延遲時發生錯誤: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"查詢失敗: {str(e)}")
+
+
+@app.post("/notifications/{log_id}/ack", response_model=Dict[str, Any])
+def acknowledge_notification(
+        log_id: int = Path(..., description="觸發通知的日誌 ID"),
+        by: Optional[str] = Query(None, description="確認人員（員工編號）")
+    ) -> Dict[str, Any]:
+    """確認已收到通知，取消之後的升級通知"""
+    try:
+        return {"status": "success", **escalation.acknowledge(log_id, by)}
+    except Exception as e:
+        logger.error(f"確認通知時發生錯誤: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"確認失敗: {str(e)}")
+
+
+@app.get("/notifications/escalations", response_model=Dict[str, Any])
+def get_escalation_statistics() -> Dict[str, Any]:
+    """查詢待升級的通知數量（含已逾時未處理的數量）與排定、升級、確認次數"""
+    return {
+        "status": "success",
+        **escalation.stats()
+    }
+
+
 @app.get("/notifications/history/{notification_id}", response_model=Dict[str, Any])
 def get_notification_by_id(notification_id: int = Path(..., description="通知歷史 ID")) -> Dict[str, Any]:
     """查詢單筆通知歷史詳情"""
     try:
         filters = [db.DBFilter(name="id", operator=db.Opreator.EQUAL, values=[str(notification_id)])]
-        result = db.call_by_filters("TB_NOTIFICATION_HISTORY", filters)
+        result = db.call_by_filters("TB_NOTIFICATION_HISTORY", filters, read_only=True)
         
         if result is None or not result.data or len(result.data) == 0:
             raise HTTPException(status_code=404, detail=f"找不到 ID 為 {notification_id} 的通知記錄")
@@ -297,7 +810,7 @@ def get_notification_by_id(notification_id: int = Path(..., description="通知
         raise HTTPException(status_code=500, detail=f"查詢失敗: {str(e)}")
 
 
-@app.get("/notifications/statistics", response_model=Dict[str, Any])
+@app.get("/notifications/statistics", response_model=NotificationStatisticsResponse, response_class=FastJSONResponse)
 def get_notification_statistics(
         date_from: datetime.date = Query(None, description="開始日期"),
         date_to: datetime.date = Query(None, description="結束日期")
@@ -311,29 +824,33 @@ def get_notification_statistics(
             date_to = datetime.date.today()
         
         filters = [
-            db.DBFilter(name="send_at", operator=db.Opreator.GREATER_OR_EQUAL, values=[str(date_from)]),
-            db.DBFilter(name="send_at", operator=db.Opreator.LESS_OR_EQUAL, values=[str(date_to)])
+            db.DBFilter(name="sent_at", operator=db.Opreator.GREATER_OR_EQUAL, values=[str(date_from)]),
+            db.DBFilter(name="sent_at", operator=db.Opreator.LESS_OR_EQUAL, values=[str(date_to)])
         ]
         
-        result = db.call_by_filters("TB_NOTIFICATION_HISTORY", filters)
+        result = db.call_by_filters("TB_NOTIFICATION_HISTORY", filters, read_only=True)
+        notifications = result.data if result is not None and result.data else []
+        # 日期範圍涵蓋已封存的分區時一併統計封存資料
+        if archive.covers("TB_NOTIFICATION_HISTORY", date_from):
+            hot_ids = {row.get("id") for row in notifications}
+            notifications = notifications + [
+                row for row in archive.read_archived("TB_NOTIFICATION_HISTORY", date_from, date_to) if row.get("id") not in hot_ids
+            ]
         
-        if result is None or not result.data:
-            return {
+        if not notifications:
+            return FastJSONResponse({
                 "status": "success",
                 "period": {"from": str(date_from), "to": str(date_to)},
                 "total_notifications": 0,
                 "by_channel": {},
                 "by_status": {},
                 "success_rate": 0.0
-            }
-        
-        notifications = result.data
+            })
         
         # 統計資料
         by_channel = {}
         by_status = {}
         success_count = 0
-        notif = NotificationHistory()
         
         for notif in notifications:
             channel = notif.get('channel', 0)
@@ -348,7 +865,7 @@ def get_notification_statistics(
         total = len(notifications)
         success_rate = (success_count / total * 100) if total > 0 else 0.0
         
-        return {
+        return FastJSONResponse({
             "status": "success",
             "period": {"from": str(date_from), "to": str(date_to)},
             "total_notifications": total,
@@ -357,10 +874,29 @@ def get_notification_statistics(
             "success_rate": round(success_rate, 2),
             "success_count": success_count,
             "failed_count": total - success_count
-        }
+        })
     
     except HTTPException:
         raise
     except Exception as e:
         logger.error(f"查詢通知統計時發生錯誤: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"查詢統計失敗: {str(e)}")
+
+
+@app.get("/rules", response_model=Dict[str, Any])
+def get_rules() -> Dict[str, Any]:
+    """查詢目前生效的通知規則"""
+    return {
+        "status": "success",
+        **rules.stats()
+    }
+
+
+@app.post("/rules/reload", response_model=Dict[str, Any])
+def reload_rules() -> Dict[str, Any]:
+    """立即重新載入通知規則（載入失敗時沿用原本的規則）"""
+    index = rules.reload(force=True)
+    return {
+        "status": "success",
+        "count": len(index.rules)
+    }
@@ -2,9 +2,12 @@ from app.object import DBFilter, Message
 from app.notification import NotificationHistory
 import app.notification as notification
 import app.database as db
+import app.dispatcher as dispatcher
+import app.webhooks as webhooks
+import app.cooldown as cooldown
 from app.settings import settings
 import app.constants as constants
-from typing import List, Optional
+from typing import Dict, List, Optional, Tuple
 import smtplib
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
@@ -17,16 +20,89 @@ import time
 logger = logging.getLogger(__name__)
 
 
-# 發送通知
+# 依員工聯絡方式設定決定發送渠道
+def route_contacts(contacts: List[dict], channels: Optional[List[str]] = None) -> Dict[constants.Channel, List[str]]:
+    """
+    回傳 {渠道: 收件者}，Email 為信箱、SMS 為電話，
+    Line / Teams / Slack / Discord 為群組通知（收件者為要求此渠道的員工編號，只發送一次，
+    Teams / Slack / Discord 實際發送的 URL 由 route_webhooks 決定）；
+    channels 不為空時只保留規則指定的渠道
+    """
+    routes: Dict[constants.Channel, List[str]] = {}
+    for contact in contacts:
+        contact_way = contact.get('contactWay', 0)
+        if contact_way & constants.PUBLISHER_EMAIL and contact.get('email'):  # Email
+            routes.setdefault(constants.Channel.EMAIL, []).append(contact['email'])
+        if contact_way & constants.PUBLISHER_LINE:  # Line
+            routes.setdefault(constants.Channel.LINE, []).append(str(contact.get('no')))
+        if contact_way & constants.PUBLISHER_TEAMS:  # Teams
+            routes.setdefault(constants.Channel.TEAMS, []).append(str(contact.get('no')))
+        if contact_way & constants.PUBLISHER_SLACK:  # Slack
+            routes.setdefault(constants.Channel.SLACK, []).append(str(contact.get('no')))
+        if contact_way & constants.PUBLISHER_DISCORD:  # Discord
+            routes.setdefault(constants.Channel.DISCORD, []).append(str(contact.get('no')))
+        if contact_way & constants.PUBLISHER_SMS and contact.get('phone'):  # SMS
+            routes.setdefault(constants.Channel.SMS, []).append(contact['phone'])
+    if channels:
+        routes = {channel: targets for channel, targets in routes.items() if channel.value in channels}
+    return routes
+
+
+# Webhook 渠道對應的聯絡資訊欄位、全域 URL 設定與名稱
+WEBHOOK_CHANNELS = {
+    constants.PUBLISHER_TEAMS: (constants.Channel.TEAMS, "teams", "TEAMS_URL"),
+    constants.PUBLISHER_SLACK: (constants.Channel.SLACK, "slack", "SLACK_URL"),
+    constants.PUBLISHER_DISCORD: (constants.Channel.DISCORD, "discord", "DISCORD_URL")
+}
+# 由 route_webhooks 決定發送目的地的渠道
+WEBHOOK_ROUTED = {channel for channel, _, _ in WEBHOOK_CHANNELS.values()}
+
+
+# 依員工聯絡方式決定每個 Webhook 渠道要發送的 URL
+def route_webhooks(contacts: List[dict], channels: Optional[List[str]] = None) -> Dict[constants.Channel, Dict[str, List[str]]]:
+    """
+    回傳 {渠道: {URL: 員工編號}}，員工有設定自己的 URL 時使用該 URL，否則使用全域 URL
+    （全域 URL 的員工編號為空，通知歷史的收件者維持渠道名稱）；相同 URL 的員工合併為一個目的地，
+    需要此渠道但沒有任何 URL 可用時 URL 為空字串
+    """
+    routes: Dict[constants.Channel, Dict[str, List[str]]] = {}
+    for publisher, (channel, field, setting) in WEBHOOK_CHANNELS.items():
+        if channels and channel.value not in channels:
+            continue
+        for contact in contacts:
+            if not contact.get('contactWay', 0) & publisher:
+                continue
+            own_url = contact.get(field)
+            targets = routes.setdefault(channel, {})
+            if own_url:
+                targets.setdefault(own_url, []).append(str(contact.get('no')))
+            else:
+                targets.setdefault(getattr(settings, setting), [])
+    return routes
+
+
+# 依冷卻時間篩選收件者，回傳 {通知內容: 收件者}
+def apply_cooldown(message: Message, channel: constants.Channel, recipients: List[str]) -> Dict[str, List[str]]:
+    """冷卻中的收件者不發送，其餘在通知內容附上冷卻期間未發送的次數（次數不同時內容不同）"""
+    grouped: Dict[str, List[str]] = {}
+    for recipient in recipients:
+        allowed, suppressed = cooldown.acquire(message.fingerprint, channel.value, recipient, message.suppressed)
+        if allowed:
+            grouped.setdefault(cooldown.annotate(message.body, suppressed), []).append(recipient)
+    return grouped
+
+
+# 發送通知（記錄各階段時間，儲存通知歷史時一併寫入以計算端到端延遲）
 def send_message(message: Message, log_id: Optional[int] = None):
-    """發送訊息給指定員工，支援多種通訊方式。"""
-    emails = []
-    line = False
-    team = False
-    slack = False
-    discord = False
-    phones = []
+    token = notification.begin_delivery(message)
+    try:
+        _send_message(message, log_id)
+    finally:
+        notification.end_delivery(token)
+
 
+def _send_message(message: Message, log_id: Optional[int] = None):
+    """發送訊息給指定員工，支援多種通訊方式。"""
     # 用員工列表取得聯絡方式設定
     try:
         employees_contact = db.call_by_filters("TB_EMPLOYEE_CONTACT", [DBFilter(name="no", operator=db.Opreator.IN.value, values=message.employees)])
@@ -46,43 +122,36 @@ def send_message(message: Message, log_id: Optional[int] = None):
             )
             return
 
-        for contact in employees_contact.data:
-            if contact.get('contactWay', 0) & constants.PUBLISHER_EMAIL:  # Email
-                if contact.get('email'):
-                    emails.append(contact['email'])
-            if contact.get('contactWay', 0) & constants.PUBLISHER_LINE:  # Line
-                line = True
-            if contact.get('contactWay', 0) & constants.PUBLISHER_TEAMS:  # Teams
-                team = True
-            if contact.get('contactWay', 0) & constants.PUBLISHER_SLACK:  # Slack
-                slack = True
-            if contact.get('contactWay', 0) & constants.PUBLISHER_DISCORD:  # Discord
-                discord = True
-            if contact.get('contactWay', 0) & constants.PUBLISHER_SMS:  # SMS
-                if contact.get('phone'):
-                    phones.append(contact['phone'])
+        routes = route_contacts(employees_contact.data, message.channels)
+        emails = routes.get(constants.Channel.EMAIL, [])
+        phones = routes.get(constants.Channel.SMS, [])
 
-        # 如果有 Email 通知需求就發送 Email
+        # 如果有 Email 通知需求就發送 Email（冷卻中的收件者略過）
         if len(emails) > 0:
-            for email in emails:
-                success = send_email(to=[email], subject=message.title, body=message.body, html=True, log_id=log_id)
-                if not success:
-                    logger.warning(f"Email 發送失敗: {email}")
+            for body, recipients in apply_cooldown(message, constants.Channel.EMAIL, emails).items():
+                for email in recipients:
+                    notification.begin_attempt(constants.Channel.EMAIL)
+                    success = send_email(to=[email], subject=message.title, body=body, html=True, log_id=log_id)
+                    if not success:
+                        logger.warning(f"Email 發送失敗: {email}")
         # 如果有 Line 通知需求就發送 Line
-        if line:
-            send_line(message.body, log_id=log_id)
-        # 如果有 Teams 通知需求就發送 Teams
-        if team:
-            webhook(constants.PUBLISHER_TEAMS, message.body, log_id=log_id)
-        # 如果有 Slack 通知需求就發送 Slack
-        if slack:
-            webhook(constants.PUBLISHER_SLACK, message.body, log_id=log_id)
-        # 如果有 Discord 通知需求就發送 Discord
-        if discord:
-            webhook(constants.PUBLISHER_DISCORD, message.body, log_id=log_id)
+        if constants.Channel.LINE in routes:
+            for body in apply_cooldown(message, constants.Channel.LINE, ["Line Notify"]):
+                notification.begin_attempt(constants.Channel.LINE)
+                send_line(body, log_id=log_id)
+        # 如果有 Teams / Slack / Discord 通知需求，所有渠道的 Webhook 一起並行發送（冷卻時間依 URL 計算）
+        webhook_groups: Dict[str, Dict[constants.Channel, Dict[str, List[str]]]] = {}
+        for channel, targets in route_webhooks(employees_contact.data, message.channels).items():
+            for body, urls in apply_cooldown(message, channel, list(targets)).items():
+                webhook_groups.setdefault(body, {})[channel] = {url: targets[url] for url in urls}
+        for body, webhook_routes in webhook_groups.items():
+            notification.begin_attempt(*webhook_routes)
+            send_webhooks(webhook_routes, body, log_id=log_id, lane=dispatcher.lane_for(message.risk_level or 0))
         # 如果有 SMS 通知需求就發送簡訊
         if len(phones) > 0:
-            sms(phones, message.body, log_id=log_id)
+            for body, recipients in apply_cooldown(message, constants.Channel.SMS, phones).items():
+                notification.begin_attempt(constants.Channel.SMS)
+                sms(recipients, body, log_id=log_id)
     
     except Exception as e:
         error_msg = f"發送訊息時發生錯誤: {e}"
@@ -234,85 +303,82 @@ def send_line(message: str, max_retries: int = 3, log_id: Optional[int] = None)
     return False
 
 
-# 用Webhook發送Teams or slack or discords通知 目前只能推送到指定Url
-def webhook(type: int, message: str, log_id: Optional[int] = None, max_retries: int = 3) -> bool:
+# 用Webhook發送Teams or slack or discords通知（未指定 targets 時推送到全域 URL）
+def webhook(type: int, message: str, log_id: Optional[int] = None, max_retries: int = 3, targets: Optional[Dict[str, List[str]]] = None) -> bool:
     """發送 Teams/Slack/Discord 訊息的 function 並記錄通知歷史"""
-    headers = {"Content-Type": "application/json"}
-    payload = {"text": message}
-    
-    # 判斷通知渠道和 URL
-    if type == constants.PUBLISHER_TEAMS:
-        typeNam = "Teams"
-        url = settings.TEAMS_URL
-        channel = constants.Channel.TEAMS
-    elif type == constants.PUBLISHER_SLACK:
-        typeNam = "Slack"
-        url = settings.SLACK_URL
-        channel = constants.Channel.SLACK
-    elif type == constants.PUBLISHER_DISCORD:
-        typeNam = "Discord"
-        url = settings.DISCORD_URL
-        channel = constants.Channel.DISCORD
-    else:
+    if type not in WEBHOOK_CHANNELS:
         error_msg = f"不支援的 Webhook 類型: {type}"
         logger.warning(error_msg)
         return False
-    
-    if not url:
-        error_msg = f"{typeNam} URL 未設定，跳過發送"
-        logger.warning(error_msg)
-        notification._save_notification_history(
-            NotificationHistory(
-                log_id=log_id,
-                message=error_msg,
-                recipient=typeNam,
-                status=constants.STATUS_FAILED,
-                error_message=error_msg
-            )
-        )
-        return False
-    
-    error_msg = None
-    for attempt in range(max_retries):
-        try:
-            r = requests.post(url, json=payload, headers=headers, timeout=10)
-            
-            if r.status_code in [200, 204]:
-                logger.info(f"{typeNam} 訊息已發送！")
+    channel, _, setting = WEBHOOK_CHANNELS[type]
+    if targets is None:
+        targets = {getattr(settings, setting): []}
+    results = send_webhooks({channel: targets}, message, log_id=log_id, max_retries=max_retries)
+    return all(results.values())
+
+
+# 並行發送多個渠道的 Webhook，並依渠道 / URL 記錄通知歷史
+def send_webhooks(
+        routes: Dict[constants.Channel, Dict[str, List[str]]],
+        message: str,
+        log_id: Optional[int] = None,
+        max_retries: int = 3,
+        lane: constants.Lane = constants.Lane.LOW
+    ) -> Dict[Tuple[constants.Channel, str], bool]:
+    """
+    routes 為 {渠道: {URL: 員工編號}}，回傳 {(渠道, URL): 是否成功}；lane 為通知所屬的推播通道（使用該通道的執行緒池）。
+    收件者為渠道名稱，員工自訂的 URL 另外附上員工編號（不記錄 URL 本身，避免洩漏 Webhook 金鑰）
+    """
+    payload = {"text": message}
+    results: Dict[Tuple[constants.Channel, str], bool] = {}
+    pending: List[Tuple[constants.Channel, str, str]] = []
+    for channel, targets in routes.items():
+        typeNam = channel.value
+        for url, employees in targets.items():
+            recipient = f"{typeNam}: {', '.join(employees)}" if employees else typeNam
+            if not url:
+                error_msg = f"{typeNam} URL 未設定，跳過發送"
+                logger.warning(error_msg)
                 notification._save_notification_history(
                     NotificationHistory(
                         log_id=log_id,
-                        message=f"{typeNam} 訊息已發送！",
-                        recipient=typeNam,
-                        status=constants.STATUS_SUCCESS,
-                        retry_count=attempt
+                        message=error_msg,
+                        recipient=recipient,
+                        status=constants.STATUS_FAILED,
+                        error_message=error_msg,
+                        channel=typeNam
                     )
                 )
-                return True
-            else:
-                error_msg = f"狀態碼: {r.status_code}, 回應: {r.text}"
-                logger.error(f"{typeNam} 訊息發送失敗: {error_msg}")
-                if attempt < max_retries - 1:
-                    time.sleep(2 ** attempt)
-        
-        except requests.exceptions.RequestException as e:
-            error_msg = str(e)
-            logger.error(f"{typeNam} 請求失敗 (嘗試 {attempt + 1}/{max_retries}): {e}")
-            if attempt < max_retries - 1:
-                time.sleep(2 ** attempt)
-    
-    # 所有重試都失敗
-    notification._save_notification_history(
-        NotificationHistory(
-            log_id=log_id,
-            message=f"{typeNam} 發送失敗 (嘗試 {max_retries} 次)",
-            recipient=typeNam,
-            status=constants.STATUS_FAILED,
-        error_message=error_msg,
-        retry_count=max_retries
-        )
-    )
-    return False
+                results[(channel, url)] = False
+                continue
+            pending.append((channel, url, recipient))
+
+    outcomes = webhooks.deliver([(url, payload) for _, url, _ in pending], max_retries, lane)
+    for (channel, url, recipient), (success, error_msg, attempts) in zip(pending, outcomes):
+        typeNam = channel.value
+        if success:
+            logger.info(f"{typeNam} 訊息已發送！")
+            history = NotificationHistory(
+                log_id=log_id,
+                message=f"{typeNam} 訊息已發送！",
+                recipient=recipient,
+                status=constants.STATUS_SUCCESS,
+                retry_count=attempts,
+                channel=typeNam
+            )
+        else:
+            history = NotificationHistory(
+                log_id=log_id,
+                message=f"{typeNam} 發送失敗 (嘗試 {max_retries} 次)",
+                recipient=recipient,
+                status=constants.STATUS_FAILED,
+                error_message=error_msg,
+                retry_count=attempts,
+                channel=typeNam
+            )
+        notification._save_notification_history(history)
+        results[(channel, url)] = success
+    return results
 
 
 # 使用SMS Gateway發送簡訊通知（免費但有限制）
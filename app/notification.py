@@ -3,11 +3,15 @@
 負責記錄和管理所有通知的發送歷史
 """
 from pydantic import BaseModel
-from typing import Optional
+from typing import Any, Dict, Iterable, List, Optional
+import contextvars
 import logging
+import time
 from datetime import datetime
 import app.database as db
-from app.object import DBFilter
+import app.dispatcher as dispatcher
+import app.versions as versions
+from app.object import DBFilter, Message
 from app.constants import Channel, Status
 
 
@@ -24,6 +28,62 @@ class NotificationHistory(BaseModel):
     error_message: Optional[str] = None  # 錯誤訊息
     retry_count: int = 0  # 重試次數
     sent_at: Optional[str] = None  # 發送時間（ISO 格式字串）
+    channel: Optional[str] = None  # 通知渠道
+    risk_level: Optional[int] = None  # 觸發通知的日誌風險等級
+    # 端到端延遲的各階段時間（ISO 格式字串）：收到日誌 → 達到通知門檻 → 排入推播通道 → 第一次嘗試發送 → 送達
+    received_at: Optional[str] = None
+    triggered_at: Optional[str] = None
+    enqueued_at: Optional[str] = None
+    first_attempt_at: Optional[str] = None
+    delivered_at: Optional[str] = None
+
+
+# 目前執行緒正在發送的通知（各階段時間與渠道），儲存通知歷史時自動帶入
+_delivery: contextvars.ContextVar = contextvars.ContextVar("delivery", default=None)
+
+
+def _iso(timestamp: Optional[float]) -> Optional[str]:
+    return datetime.fromtimestamp(timestamp).isoformat() if timestamp else None
+
+
+# 開始發送一則通知，回傳結束時用的 token
+def begin_delivery(message: Message) -> contextvars.Token:
+    return _delivery.set({
+        "risk_level": message.risk_level,
+        "received_at": _iso(message.received_at),
+        "triggered_at": _iso(message.triggered_at),
+        "enqueued_at": _iso(message.enqueued_at),
+        # 各渠道第一次嘗試發送的時間
+        "attempts": {}
+    })
+
+
+# 記錄即將以哪些渠道進行發送嘗試（多個渠道並行發送時一起記錄，通知歷史依本身的渠道取得嘗試時間）
+def begin_attempt(*channels: Channel) -> None:
+    delivery = _delivery.get()
+    if delivery is not None:
+        now = _iso(time.time())
+        for channel in channels:
+            delivery["attempts"][channel.value] = now
+        # 沒有指定渠道的通知歷史只在單一渠道發送時補上渠道
+        delivery["channel"] = channels[0].value if len(channels) == 1 else None
+
+
+def end_delivery(token: contextvars.Token) -> None:
+    _delivery.reset(token)
+
+
+# 以目前發送中的通知補上渠道與各階段時間，成功時的送達時間即儲存時間
+def _apply_delivery(notic_history: NotificationHistory) -> None:
+    delivery: Optional[Dict[str, Any]] = _delivery.get()
+    if delivery is not None:
+        for name, value in delivery.items():
+            if name != "attempts" and getattr(notic_history, name) is None:
+                setattr(notic_history, name, value)
+        if notic_history.first_attempt_at is None:
+            notic_history.first_attempt_at = delivery["attempts"].get(notic_history.channel)
+    if notic_history.status == 1 and notic_history.delivered_at is None:  # STATUS_SUCCESS
+        notic_history.delivered_at = notic_history.sent_at
 
 
 # 保存通知歷史記錄的輔助函數
@@ -39,6 +99,7 @@ def _save_notification_history(notic_history: NotificationHistory) -> bool:
     
     try:
         notic_history.sent_at = datetime.now().isoformat()
+        _apply_delivery(notic_history)
         
         # 檢查是否已存在相同的記錄（log_id + recipient 都相同）
         existing = db.supabase.table("TB_NOTIFICATION_HISTORY").select("*").eq(
@@ -55,7 +116,10 @@ def _save_notification_history(notic_history: NotificationHistory) -> bool:
             update_data = {
                 'message': notic_history.message,
                 'status': notic_history.status,
-                'sent_at': notic_history.sent_at
+                'sent_at': notic_history.sent_at,
+                **notic_history.model_dump(include={
+                    'channel', 'risk_level', 'received_at', 'triggered_at', 'enqueued_at', 'first_attempt_at', 'delivered_at'
+                })
             }
             
             # 如果新狀態是失敗，更新 error_message 和 retry_count
@@ -75,6 +139,7 @@ def _save_notification_history(notic_history: NotificationHistory) -> bool:
             )
             
             if result:
+                versions.bump(versions.NOTIFICATIONS)
                 logger.info(f"通知歷史記錄已更新: ID={existing_record['id']}, status={notic_history.status}, retry_count={update_data['retry_count']}")
                 return True
             else:
@@ -84,6 +149,7 @@ def _save_notification_history(notic_history: NotificationHistory) -> bool:
             # 不存在重複記錄（log_id + recipient 組合是新的），新增
             history_data = notic_history.model_dump(exclude={'id'})
             db.supabase.table("TB_NOTIFICATION_HISTORY").insert(history_data).execute()
+            versions.bump(versions.NOTIFICATIONS)
             logger.info(f"通知歷史記錄已保存: {notic_history.message} - {notic_history.status} - 收件者: {notic_history.recipient}")
             return True
             
@@ -91,3 +157,67 @@ def _save_notification_history(notic_history: NotificationHistory) -> bool:
         logger.error(f"保存通知歷史記錄失敗: {e}", exc_info=True)
         # 保存歷史失敗不應該影響主流程，只記錄錯誤
         return False
+
+
+# 端到端延遲的各階段（開始欄位, 結束欄位）
+LATENCY_STAGES = {
+    "trigger_ms": ("received_at", "triggered_at"),      # 收到日誌 → 達到通知門檻
+    "queue_ms": ("enqueued_at", "first_attempt_at"),    # 排入推播通道 → 第一次嘗試發送
+    "delivery_ms": ("first_attempt_at", "delivered_at"),  # 第一次嘗試 → 送達（含重試）
+    "end_to_end_ms": ("received_at", "delivered_at")    # 收到日誌 → 送達
+}
+
+
+def _elapsed_ms(row: Dict[str, Any], start: str, end: str) -> Optional[float]:
+    if not row.get(start) or not row.get(end):
+        return None
+    return (datetime.fromisoformat(str(row[end])) - datetime.fromisoformat(str(row[start]))).total_seconds() * 1000
+
+
+def _percentiles(samples: List[float]) -> Dict[str, Optional[float]]:
+    samples = sorted(samples)
+    return {
+        "count": len(samples),
+        "p50": dispatcher.percentile(samples, 50),
+        "p95": dispatcher.percentile(samples, 95),
+        "p99": dispatcher.percentile(samples, 99)
+    }
+
+
+# 依渠道與風險等級計算各階段延遲的百分位數，以及緊急通知的 SLO 達成率
+def latency_report(rows: Iterable[Dict[str, Any]], slo_ms: int) -> Dict[str, Any]:
+    groups: Dict[str, Dict[Any, Dict[str, List[float]]]] = {"by_channel": {}, "by_risk_level": {}}
+    slo_total = 0
+    slo_met = 0
+    for row in rows:
+        delivered = row.get("status") in (1, Status.SUCCESS.value) and row.get("delivered_at")
+        risk_level = row.get("risk_level")
+        if risk_level == 3:
+            # 緊急通知未送達也算未達成 SLO
+            slo_total += 1
+            end_to_end = _elapsed_ms(row, "received_at", "delivered_at") if delivered else None
+            if end_to_end is not None and end_to_end <= slo_ms:
+                slo_met += 1
+        if not delivered:
+            continue
+        for group, key in (("by_channel", row.get("channel") or "Unknown"), ("by_risk_level", risk_level)):
+            stages = groups[group].setdefault(key, {stage: [] for stage in LATENCY_STAGES})
+            for stage, (start, end) in LATENCY_STAGES.items():
+                elapsed = _elapsed_ms(row, start, end)
+                if elapsed is not None:
+                    stages[stage].append(elapsed)
+    return {
+        **{
+            group: {
+                str(key): {stage: _percentiles(samples) for stage, samples in stages.items()}
+                for key, stages in values.items()
+            }
+            for group, values in groups.items()
+        },
+        "emergency_slo": {
+            "slo_ms": slo_ms,
+            "total": slo_total,
+            "met": slo_met,
+            "met_rate": round(slo_met / slo_total * 100, 2) if slo_total else None
+        }
+    }
@@ -1,6 +1,12 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 import datetime
-from typing import List, Optional
+import hashlib
+from typing import Any, Dict, List, Optional
+
+
+# 計算重複判斷用的指紋（與資料庫 TB_LOGS.fingerprint 產生欄位的算法一致）
+def make_fingerprint(location: str, function: str, log: str) -> str:
+    return hashlib.md5(f"{location}\x1f{function}\x1f{log}".encode("utf-8")).hexdigest()
 
 
 class Log(BaseModel):
@@ -14,6 +20,8 @@ class Log(BaseModel):
     date: datetime.date
     time: datetime.time
     count: int = 1
+    # 系統收到此日誌的時間（epoch 秒，只用於計算通知延遲，不寫入 TB_LOGS）
+    received_at: float = Field(default_factory=lambda: datetime.datetime.now().timestamp(), exclude=True)
     
     class Config:
         """Pydantic 模型配置"""
@@ -22,6 +30,31 @@ class Log(BaseModel):
             datetime.time: lambda v: v.isoformat()   # 將時間轉為 "14:30:00" 格式
         }
 
+    def fingerprint(self) -> str:
+        """相同 location + function + log 視為同一個問題"""
+        return make_fingerprint(self.location, self.function, self.log)
+
+
+class LogLookupRequest(BaseModel):
+    ids: List[int] = Field(..., max_length=500)
+    include_notifications: bool = False
+
+
+class LogBatchItem(BaseModel):
+    riskLevel: int = Field(0, ge=0, le=3)
+    type: int = Field(0, ge=0)
+    location: str = Field(..., min_length=1)
+    function: str = Field(..., min_length=1)
+    log: str = Field(..., min_length=1)
+    employees: List[str] = []
+    date: Optional[datetime.date] = None
+    time: Optional[datetime.time] = None
+    count: int = Field(1, ge=1)  # 客戶端預先彙總的次數
+
+
+class LogBatchRequest(BaseModel):
+    logs: List[LogBatchItem] = Field(..., min_length=1, max_length=1000)
+
 
 class DBFilter(BaseModel):
     name: str
@@ -33,6 +66,28 @@ class Message(BaseModel):
     title: str
     body: str
     employees: List[str]
+    channels: List[str] = []  # 限定發送的渠道（空值為依員工聯絡方式全部發送）
+    fingerprint: Optional[str] = None  # 觸發通知的日誌指紋（用於計算通知冷卻，空值不限制）
+    risk_level: Optional[int] = None
+    suppressed: int = 0  # 冷卻閘門關閉期間未排入推播通道的次數（發送時加到各收件者的未發送次數）
+    # 各階段時間（epoch 秒）：收到日誌 → 達到通知門檻 → 排入推播通道
+    received_at: Optional[float] = None
+    triggered_at: Optional[float] = None
+    enqueued_at: Optional[float] = None
+
+
+class AlertRule(BaseModel):
+    """通知規則：location / function 支援完全比對、前綴比對（結尾 *）與 *（全部）"""
+    name: str = Field(..., min_length=1)
+    location: str = "*"
+    function: str = "*"
+    risk_levels: List[int] = []  # 適用的風險等級（空值為全部）
+    threshold: int = Field(1, ge=1)  # 達到此次數開始通知
+    window_seconds: int = Field(0, ge=0)  # 計算次數的時間窗（0 為累計次數）
+    immediate: bool = False  # 第一次發生就立即發送緊急通知
+    channels: List[str] = []  # 限定發送的渠道（空值為全部）
+    priority: int = 0  # 多條規則符合時優先採用較大者
+    enabled: bool = True
 
 
 class EmployeeContact(BaseModel):
@@ -57,3 +112,67 @@ class NotificationHistory(BaseModel):
     error_message: str
     retry_count: int
     sent_at: datetime.datetime
+
+
+# ==================== API 回應模型 ====================
+# 以下模型只用於 OpenAPI 文件，列表與統計 endpoint 會直接以 FastJSONResponse 回傳，不再逐筆驗證
+
+class LogRecord(BaseModel):
+    id: int
+    riskLevel: int
+    type: int
+    location: str
+    function: str
+    log: str
+    employees: Optional[List[str]] = None
+    date: str
+    time: str
+    count: int
+
+
+class LogListResponse(BaseModel):
+    status: str
+    data: List[LogRecord]
+    count: int
+    limit: int
+    offset: int
+
+
+class LogStatisticsResponse(BaseModel):
+    status: str
+    period: Dict[str, str]
+    total_logs: int
+    by_risk_level: Dict[int, int]
+    by_location: Dict[str, int]
+    by_function: Dict[str, int]
+
+
+class NotificationRecord(BaseModel):
+    id: int
+    log_id: Optional[int] = None
+    channel: Optional[str] = None
+    recipient: str
+    message: str
+    status: Any
+    error_message: Optional[str] = None
+    retry_count: int = 0
+    sent_at: Optional[str] = None
+
+
+class NotificationListResponse(BaseModel):
+    status: str
+    data: List[NotificationRecord]
+    count: int
+    limit: int
+    offset: int
+
+
+class NotificationStatisticsResponse(BaseModel):
+    status: str
+    period: Dict[str, str]
+    total_notifications: int
+    by_channel: Dict[str, int]
+    by_status: Dict[str, int]
+    success_rate: float
+    success_count: int = 0
+    failed_count: int = 0
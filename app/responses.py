@@ -0,0 +1,16 @@
+"""
+高效能回應模組
+列表、統計類的大型回應直接以 orjson 序列化成 bytes，
+略過 FastAPI 對 response_model 的重複驗證與 jsonable_encoder 轉換。
+Supabase 回傳的資料列本身就是 JSON 原生型別，不需要再驗證一次。
+"""
+from typing import Any
+import orjson
+from fastapi.responses import JSONResponse
+
+
+class FastJSONResponse(JSONResponse):
+    """使用 orjson 序列化的 JSONResponse（支援非字串鍵，例如以風險等級為鍵的統計）"""
+
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
@@ -0,0 +1,214 @@
+"""
+通知規則引擎
+取代寫死在 need_send 的次數門檻與緊急通知判斷：規則依 location / function 樣式與風險等級比對，
+各自設定通知門檻、計算次數的時間窗與發送渠道，可存放在 JSON 檔或 TB_ALERT_RULES 資料表並自動重新載入。
+
+規則載入時編譯為索引：location 先以完全比對的 hash 與前綴 trie 找出候選，
+每個候選再以同樣結構的 function 索引比對，每筆日誌的比對成本與規則數量無關，只與字串長度有關。
+沒有任何規則符合時使用內建的預設規則（普通 5 次、高風險 3 次、緊急立即通知）。
+"""
+import json
+import logging
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import app.database as db
+from app.object import AlertRule, Log
+from app.settings import settings
+
+logger = logging.getLogger(__name__)
+
+WILDCARD = "*"
+WINDOW_PREFIX = "logs:rules:window:"
+
+# 內建預設規則（與原本寫死的門檻相同）
+DEFAULT_RULES = [
+    AlertRule(name="default-low", risk_levels=[1], threshold=5, priority=-1),
+    AlertRule(name="default-high", risk_levels=[2], threshold=3, priority=-1),
+    AlertRule(name="default-emergency", risk_levels=[3], threshold=1, immediate=True, priority=-1),
+]
+# 沒有風險等級的日誌沿用普通等級的門檻
+FALLBACK_RULE = AlertRule(name="default", threshold=5, priority=-1)
+
+
+class PatternIndex:
+    """樣式索引：完全比對用 hash、前綴比對用 trie、* 另外保存"""
+
+    def __init__(self):
+        self.exact: Dict[str, Any] = {}
+        self.trie: Dict[str, Any] = {}
+        self.wildcard: Any = None
+
+    # 取得樣式對應的值，不存在時以 factory 建立
+    def setdefault(self, pattern: str, factory: Callable[[], Any]) -> Any:
+        if pattern == WILDCARD:
+            if self.wildcard is None:
+                self.wildcard = factory()
+            return self.wildcard
+        if pattern.endswith(WILDCARD):
+            node = self.trie
+            for char in pattern[:-1]:
+                node = node.setdefault(char, {})
+            if None not in node:
+                # 以 None 作為鍵存放此前綴的值（不會與字元衝突）
+                node[None] = factory()
+            return node[None]
+        if pattern not in self.exact:
+            self.exact[pattern] = factory()
+        return self.exact[pattern]
+
+    # 回傳符合的 (值, 明確程度)，明確程度：完全比對最高，其次前綴越長越高，* 最低
+    def lookup(self, value: str) -> List[Tuple[Any, int]]:
+        matches = []
+        if value in self.exact:
+            matches.append((self.exact[value], len(value) + 2))
+        node = self.trie
+        if None in node:
+            matches.append((node[None], 1))
+        for depth, char in enumerate(value, 1):
+            node = node.get(char)
+            if node is None:
+                break
+            if None in node:
+                matches.append((node[None], depth + 1))
+        if self.wildcard is not None:
+            matches.append((self.wildcard, 0))
+        return matches
+
+
+class RuleIndex:
+    """編譯後的規則索引（建立後不再修改，可在多執行緒間共用）"""
+
+    def __init__(self, rules: List[AlertRule]):
+        self.rules = [rule for rule in rules if rule.enabled]
+        self._locations = PatternIndex()
+        for rule in self.rules:
+            functions = self._locations.setdefault(rule.location, PatternIndex)
+            functions.setdefault(rule.function, list).append(rule)
+        self._defaults = {level: rule for rule in DEFAULT_RULES for level in rule.risk_levels}
+
+    # 找出最適用的規則：priority 最大者優先，相同時 location、function 越明確越優先
+    def match(self, location: str, function: str, risk_level: int) -> AlertRule:
+        best = None
+        best_key = None
+        for functions, location_rank in self._locations.lookup(location):
+            for rules, function_rank in functions.lookup(function):
+                for rule in rules:
+                    if rule.risk_levels and risk_level not in rule.risk_levels:
+                        continue
+                    key = (rule.priority, location_rank, function_rank)
+                    if best_key is None or key > best_key:
+                        best, best_key = rule, key
+        return best or self._defaults.get(risk_level, FALLBACK_RULE)
+
+
+# 讀取規則檔（JSON 陣列，或 {"rules": [...]}）
+def load_file(path: str) -> List[AlertRule]:
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    if isinstance(data, dict):
+        data = data.get("rules", [])
+    return [AlertRule.model_validate(item) for item in data]
+
+
+def load_db() -> List[AlertRule]:
+    result = db.supabase.table("TB_ALERT_RULES").select("*").eq("enabled", True).execute()
+    return [AlertRule.model_validate(row) for row in result.data or []]
+
+
+_lock = threading.Lock()
+_index: Optional[RuleIndex] = None
+_checked_at = 0.0
+_loaded_at: Optional[float] = None
+_file_mtime: Optional[float] = None
+
+
+def _load() -> Optional[List[AlertRule]]:
+    """依 ALERT_RULES_SOURCE 讀取規則，來源沒有變更時回傳 None"""
+    global _file_mtime
+    source = settings.ALERT_RULES_SOURCE
+    if source == "file":
+        mtime = os.path.getmtime(settings.ALERT_RULES_FILE)
+        if _index is not None and mtime == _file_mtime:
+            return None
+        rules = load_file(settings.ALERT_RULES_FILE)
+        _file_mtime = mtime
+        return rules
+    if source == "db":
+        return load_db()
+    return [] if _index is None else None
+
+
+# 重新載入並編譯規則（載入失敗時保留原本的規則），回傳目前的索引
+def reload(force: bool = False) -> RuleIndex:
+    global _index, _checked_at, _loaded_at, _file_mtime
+    with _lock:
+        if force:
+            _file_mtime = None
+        try:
+            rules = _load()
+            if rules is not None:
+                _index = RuleIndex(rules)
+                _loaded_at = time.time()
+                logger.info(f"已載入 {len(_index.rules)} 條通知規則（來源: {settings.ALERT_RULES_SOURCE or '內建'}）")
+        except Exception as e:
+            logger.error(f"載入通知規則時發生錯誤，沿用目前的規則: {e}", exc_info=True)
+        _checked_at = time.monotonic()
+        if _index is None:
+            _index = RuleIndex([])
+        return _index
+
+
+# 目前的規則索引（超過 ALERT_RULES_RELOAD_SECONDS 時檢查來源是否變更）
+def current() -> RuleIndex:
+    if _index is None or time.monotonic() - _checked_at > settings.ALERT_RULES_RELOAD_SECONDS:
+        return reload()
+    return _index
+
+
+# 以 Redis 計算時間窗內的次數（第一次累加時設定過期時間，即固定時間窗）
+def redis_window_count(rule: AlertRule, fingerprint: str, increment: int) -> int:
+    key = f"{WINDOW_PREFIX}{rule.name}:{fingerprint}"
+    pipe = db.r.pipeline()
+    pipe.set(key, 0, ex=rule.window_seconds, nx=True)
+    pipe.incrby(key, increment)
+    return int(pipe.execute()[1])
+
+
+# 判斷此次寫入是否需要通知，需要時回傳適用的規則
+def evaluate(
+        log: Log,
+        created: bool,
+        increment: int = 1,
+        index: Optional[RuleIndex] = None,
+        window_count: Optional[Callable[[AlertRule, str, int], int]] = None
+    ) -> Optional[AlertRule]:
+    """
+    immediate 的規則在第一次發生時立即通知；其餘依 log.count（window_seconds 為 0）
+    或時間窗內的次數判斷是否達到門檻。window_count 可替換時間窗的計算方式（模擬用）
+    """
+    rule = (index or current()).match(log.location, log.function, log.riskLevel)
+    if created and rule.immediate:
+        return rule
+    if rule.window_seconds:
+        try:
+            count = (window_count or redis_window_count)(rule, log.fingerprint(), increment)
+        except Exception as e:
+            # 時間窗無法計算時退回累計次數，避免漏發通知
+            logger.error(f"計算通知規則時間窗時發生錯誤: {e}", exc_info=True)
+            count = log.count
+    else:
+        count = log.count
+    return rule if count >= rule.threshold else None
+
+
+def stats() -> Dict[str, Any]:
+    index = current()
+    return {
+        "source": settings.ALERT_RULES_SOURCE or "builtin",
+        "loaded_at": _loaded_at,
+        "count": len(index.rules),
+        "rules": [rule.model_dump() for rule in index.rules],
+        "defaults": [rule.model_dump() for rule in DEFAULT_RULES]
+    }
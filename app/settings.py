@@ -61,6 +61,15 @@ class Settings(BaseSettings):
 	# Supabase 設定
 	SUPABASE_URL: str
 	SUPABASE_KEY: str
+	# 唯讀複本（未設定 URL 時所有查詢都走主資料庫；未設定 KEY 時沿用 SUPABASE_KEY）
+	SUPABASE_REPLICA_URL: str = ""
+	SUPABASE_REPLICA_KEY: str = ""
+	# 查詢 API 可接受的複寫延遲（秒），超過時改用主資料庫
+	REPLICA_MAX_STALENESS_SECONDS: int = 10
+	# 量測複寫延遲的間隔（秒）
+	REPLICA_LAG_CHECK_SECONDS: int = 5
+	# 複本查詢失敗後暫停使用複本的秒數
+	REPLICA_RETRY_SECONDS: int = 30
 	
 	# Redis 設定
 	REDIS_HOST: str
@@ -80,9 +89,114 @@ class Settings(BaseSettings):
 	TEAMS_URL: str = ""
 	SLACK_URL: str = ""
 	DISCORD_URL: str = ""
+	# Webhook 並行發送（每個推播通道同時發送的請求數上限、每個主機的 keep-alive 連線數、逾時秒數）
+	WEBHOOK_MAX_CONCURRENCY: int = 32
+	WEBHOOK_POOL_SIZE: int = 4
+	WEBHOOK_TIMEOUT: int = 10
 	
 	# SMS Gateway 設定
 	EMAIL_TO_SMS_GATEWAY: str = ""
+
+	# 次數合併寫入設定（相同指紋的累加先寫入 Redis，定期批次寫回資料庫）
+	COUNTER_COALESCE_ENABLED: int = 1
+	COUNTER_FLUSH_INTERVAL_MS: int = 500
+	COUNTER_CACHE_TTL: int = 3600
+
+	# 推播優先通道設定（每個通道保留的 worker 數與佇列長度）
+	DISPATCH_WORKERS_EMERGENCY: int = 4
+	DISPATCH_WORKERS_HIGH: int = 2
+	DISPATCH_WORKERS_LOW: int = 2
+	DISPATCH_QUEUE_SIZE: int = 1000
+	# 緊急通知從排入佇列到發送完成的延遲目標（毫秒）
+	DISPATCH_EMERGENCY_SLO_MS: int = 5000
+
+	# 通知升級（風險等級達到門檻的通知在確認前，於第一次通知後第 N 分鐘再次通知並加入升級人員）
+	ESCALATION_ENABLED: bool = True
+	ESCALATION_MIN_RISK_LEVEL: int = 3
+	ESCALATION_STEPS_MINUTES: str = "5,15,30"
+	ESCALATION_STEP_EMPLOYEES: str = ""
+	ESCALATION_POLL_SECONDS: int = 5
+	ESCALATION_BATCH_SIZE: int = 500
+	# 搶占到期升級後的租約秒數，處理中途中斷時租約到期後由其他機器重新處理
+	ESCALATION_LEASE_SECONDS: int = 60
+	ESCALATION_ACK_TTL: int = 86400
+
+	# 通知冷卻（相同問題對同一收件者的同一渠道，發送後的冷卻秒數每次加倍，問題停止發生超過重設秒數後回到基本值）
+	COOLDOWN_ENABLED: bool = True
+	COOLDOWN_BASE_SECONDS: int = 60
+	COOLDOWN_MAX_SECONDS: int = 3600
+	COOLDOWN_RESET_SECONDS: int = 3600
+
+	# 日誌寫入准入控制（任一指標達到上限即進入過載，達到上限 * CRITICAL_FACTOR 為嚴重過載）
+	ADMISSION_MAX_INFLIGHT: int = 64
+	ADMISSION_MAX_QUEUE_DEPTH: int = 2000
+	ADMISSION_MAX_DB_LATENCY_MS: int = 1000
+	# 沒有新的資料庫延遲樣本時，延遲每 N 秒衰減一半
+	ADMISSION_DB_LATENCY_HALF_LIFE_SECONDS: float = 5.0
+	ADMISSION_CRITICAL_FACTOR: float = 2.0
+	# 過載時每 N 筆低風險日誌只接受 1 筆
+	ADMISSION_SAMPLE_RATE: int = 10
+	# 拒絕時回傳的 Retry-After 秒數
+	ADMISSION_RETRY_AFTER: int = 5
+
+	# 冷熱資料分層（超過保留天數的資料封存為日期分區的 jsonl.gz 檔）
+	ARCHIVE_DIR: str = "archive"
+	ARCHIVE_LOGS_AFTER_DAYS: int = 90
+	ARCHIVE_NOTIFICATIONS_AFTER_DAYS: int = 90
+	ARCHIVE_BATCH_SIZE: int = 1000
+
+	# 即時 Top-K 統計（每小時、每個維度保留的計數器數量與保存時數）
+	TOPK_CAPACITY: int = 100
+	TOPK_RETENTION_HOURS: int = 168
+
+	# 基數估計（HyperLogLog 每小時 / 每日時間桶的保存天數）
+	HLL_HOURLY_RETENTION_DAYS: int = 7
+	HLL_DAILY_RETENTION_DAYS: int = 400
+
+	# 時間序列（分鐘時間桶保存時數、小時時間桶保存天數、單次查詢讀取的來源時間桶上限）
+	TS_MINUTE_RETENTION_HOURS: int = 48
+	TS_HOUR_RETENTION_DAYS: int = 90
+	TS_MAX_QUERY_BUCKETS: int = 5000
+
+	# 日誌寫入冪等鍵保存秒數
+	IDEMPOTENCY_TTL: int = 86400
+
+	# 批次寫入 /logs/batch（解壓縮後的最大位元組數）
+	LOG_BATCH_MAX_BYTES: int = 10485760
+
+	# 依指紋分片的寫入 worker（啟用後 /logs 只排入分片佇列，由 python -m app.sharding 處理）
+	SHARDING_ENABLED: bool = False
+	SHARD_WORKERS: int = 4
+	SHARD_ID_PREFIX: str = "shard"
+	SHARD_VIRTUAL_NODES: int = 64
+	SHARD_HEARTBEAT_TIMEOUT: int = 5
+	SHARD_CACHE_SIZE: int = 100000
+	SHARD_BATCH_SIZE: int = 500
+
+	# Syslog 接收（UDP / TCP，埠號設為 0 即停用；嚴重度 0~7 依序對應的風險等級，0 表示丟棄）
+	SYSLOG_ENABLED: bool = False
+	SYSLOG_HOST: str = "0.0.0.0"
+	SYSLOG_UDP_PORT: int = 5514
+	SYSLOG_TCP_PORT: int = 5514
+	SYSLOG_SEVERITY_RISK_LEVELS: str = "3,3,3,2,1,1,1,0"
+	SYSLOG_LOG_TYPE: int = 0
+	SYSLOG_EMPLOYEES: str = ""
+	SYSLOG_BATCH_SIZE: int = 1000
+	SYSLOG_BATCH_INTERVAL_MS: int = 200
+	SYSLOG_QUEUE_SIZE: int = 100000
+
+	# 通知規則（來源: 空值為內建門檻、file 為 ALERT_RULES_FILE、db 為 TB_ALERT_RULES；每 N 秒檢查是否需要重新載入）
+	ALERT_RULES_SOURCE: str = ""
+	ALERT_RULES_FILE: str = "alert_rules.json"
+	ALERT_RULES_RELOAD_SECONDS: int = 30
+
+	# 串流彙總（每批讀取筆數、單次查詢的分組數上限）
+	AGG_PAGE_SIZE: int = 5000
+	AGG_MAX_GROUPS: int = 100000
+
+	# 列表 / 統計 API 的 ETag（依資料版本回傳 304；Redis 無法使用時暫停 N 秒）
+	ETAG_ENABLED: bool = True
+	ETAG_RETRY_SECONDS: int = 30
 	
 	class Config:
 		env_file = ".env"
@@ -0,0 +1,341 @@
+"""
+依指紋分片的日誌寫入模組
+啟用 SHARDING_ENABLED 後，API 只負責把日誌依指紋的一致性雜湊排入對應分片的 Redis 佇列，
+由 N 個分片 worker 程序各自處理：每個分片獨佔自己負責的指紋，次數與快取都放在程序內，
+單執行緒處理不需要任何鎖，並定期將累積的次數一次寫回資料庫。
+
+分片以 Redis sorted set 登記心跳，worker 加入或離開時雜湊環會重新計算：
+- 不再負責的指紋會先寫回次數並移出快取，之後收到的事件轉送給新的負責分片
+- 已離開分片的佇列由仍存活的分片接手轉送
+
+worker 處理時的 Redis / 資料庫錯誤只記錄並稍後重試，無法解析的事件記錄後略過；
+收到 SIGTERM（例如 docker stop）時寫回次數後結束，主程序會重新啟動意外結束的 worker。
+
+執行方式：
+    python -m app.sharding --workers 4
+"""
+import argparse
+import bisect
+import hashlib
+import json
+import logging
+import multiprocessing
+import signal
+import time
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+import app.database as db
+import app.dispatcher as dispatcher
+import app.ingest as ingest
+from app.object import Log
+from app.settings import settings
+
+logger = logging.getLogger(__name__)
+
+MEMBERS_KEY = "logs:shards:members"
+QUEUE_PREFIX = "logs:shards:queue:"
+# 雜湊環的快取秒數（API 端避免每個請求都查詢分片清單）
+RING_REFRESH_SECONDS = 1.0
+# worker 處理發生錯誤後等待的秒數
+ERROR_BACKOFF_SECONDS = 1.0
+# 主程序檢查 worker 是否仍在執行的間隔秒數
+SUPERVISE_INTERVAL_SECONDS = 1.0
+
+
+def _hash(value: str) -> int:
+    return int(hashlib.md5(value.encode("utf-8")).hexdigest()[:16], 16)
+
+
+class HashRing:
+    """一致性雜湊環：每個分片配置多個虛擬節點，分片增減時只有少部分指紋會換分片"""
+
+    def __init__(self, nodes: List[str], vnodes: int):
+        self.nodes = sorted(nodes)
+        points = sorted((_hash(f"{node}#{i}"), node) for node in self.nodes for i in range(vnodes))
+        self._hashes = [point[0] for point in points]
+        self._nodes = [point[1] for point in points]
+
+    def node_for(self, fingerprint: str) -> Optional[str]:
+        if not self._hashes:
+            return None
+        index = bisect.bisect(self._hashes, _hash(fingerprint)) % len(self._hashes)
+        return self._nodes[index]
+
+
+# 目前存活（心跳未逾時）的分片
+def live_shards() -> List[str]:
+    return db.r.zrangebyscore(MEMBERS_KEY, time.time() - settings.SHARD_HEARTBEAT_TIMEOUT, "+inf")
+
+
+_ring: Optional[HashRing] = None
+_ring_loaded_at = 0.0
+
+
+# 查詢分片清單失敗時視為沒有存活的分片（RING_REFRESH_SECONDS 秒後再查詢），日誌改為直接寫入
+def _current_ring() -> HashRing:
+    global _ring, _ring_loaded_at
+    if _ring is None or time.monotonic() - _ring_loaded_at > RING_REFRESH_SECONDS:
+        try:
+            members = live_shards()
+        except Exception as e:
+            logger.error(f"查詢分片清單時發生錯誤: {e}", exc_info=True)
+            members = []
+        _ring = HashRing(members, settings.SHARD_VIRTUAL_NODES)
+        _ring_loaded_at = time.monotonic()
+    return _ring
+
+
+def _encode(log: Log, increment: int) -> str:
+    data = {"log": log.model_dump(mode="json"), "increment": increment, "received_at": log.received_at}
+    return json.dumps(data, ensure_ascii=False)
+
+
+def _decode(payload: str) -> Tuple[Log, int]:
+    data = json.loads(payload)
+    log = Log.model_validate(data["log"])
+    if data.get("received_at"):
+        # 保留 API 收到日誌的時間，通知延遲才會包含排隊等待分片處理的時間
+        log.received_at = data["received_at"]
+    return log, int(data.get("increment", 1))
+
+
+# 將日誌排入負責此指紋的分片佇列，回傳分片 ID（沒有存活的分片或排入失敗時回傳 None）
+def submit(log: Log, increment: int = 1) -> Optional[str]:
+    shard = _current_ring().node_for(log.fingerprint())
+    if shard is None:
+        return None
+    try:
+        db.r.rpush(QUEUE_PREFIX + shard, _encode(log, increment))
+    except Exception as e:
+        logger.error(f"排入分片 {shard} 的佇列時發生錯誤: {e}", exc_info=True)
+        return None
+    return shard
+
+
+class LocalCounter:
+    """分片內單一指紋的次數快取"""
+    __slots__ = ("id", "riskLevel", "employees", "total", "pending")
+
+    def __init__(self, stored: Log):
+        self.id = stored.id
+        self.riskLevel = stored.riskLevel
+        self.employees = stored.employees
+        self.total = stored.count
+        self.pending = 0
+
+
+class ShardWorker:
+    """單一分片：單執行緒消費自己的佇列，次數與快取只存在此程序內"""
+
+    def __init__(self, shard_id: str):
+        self.shard_id = shard_id
+        self.queue_key = QUEUE_PREFIX + shard_id
+        self.cache: "OrderedDict[str, LocalCounter]" = OrderedDict()
+        self.ring = HashRing([], settings.SHARD_VIRTUAL_NODES)
+        self._last_flush = time.monotonic()
+        self._last_heartbeat = 0.0
+        # 重新平衡後快取中可能還有不再負責的指紋（寫回成功後移出）
+        self._moved = False
+        self._stopping = False
+
+    # 登記心跳並在分片清單變動時重新計算雜湊環
+    def heartbeat(self):
+        db.r.zadd(MEMBERS_KEY, {self.shard_id: time.time()})
+        members = live_shards()
+        if members != self.ring.nodes:
+            self.rebalance(HashRing(members, settings.SHARD_VIRTUAL_NODES))
+        # 清除逾時的分片並接手轉送它們佇列中的事件
+        expired = db.r.zrangebyscore(MEMBERS_KEY, "-inf", time.time() - settings.SHARD_HEARTBEAT_TIMEOUT)
+        for shard in expired:
+            if db.r.zrem(MEMBERS_KEY, shard):
+                logger.info(f"分片 {shard} 已離開，轉送其佇列中的事件")
+            self.forward_queue(QUEUE_PREFIX + shard)
+        self._last_heartbeat = time.monotonic()
+
+    # 不再負責的指紋寫回次數後移出快取（寫回失敗時保留，下一次寫回成功後再移出）
+    def rebalance(self, ring: HashRing):
+        logger.info(f"分片 {self.shard_id} 重新平衡: {ring.nodes}")
+        self.ring = ring
+        self._moved = True
+        self.flush()
+
+    # 將佇列中的事件依目前的雜湊環轉送給負責的分片
+    def forward_queue(self, queue_key: str):
+        while True:
+            payload = db.r.lpop(queue_key)
+            if payload is None:
+                return
+            try:
+                log, _ = _decode(payload)
+            except (ValueError, KeyError, TypeError) as e:
+                logger.error(f"分片 {self.shard_id} 略過無法解析的事件: {e}")
+                continue
+            owner = self.ring.node_for(log.fingerprint()) or self.shard_id
+            db.r.rpush(QUEUE_PREFIX + owner, payload)
+
+    # 累加次數：快取命中只更新程序內的計數，未命中才走資料庫的原子化 ingest_log
+    def add(self, log: Log, increment: int) -> Optional[Tuple[Log, bool]]:
+        fingerprint = log.fingerprint()
+        entry = self.cache.get(fingerprint)
+        if entry is not None:
+            entry.total += increment
+            entry.pending += increment
+            self.cache.move_to_end(fingerprint)
+            stored = log.model_copy(update={
+                "id": entry.id,
+                "count": entry.total,
+                "riskLevel": entry.riskLevel,
+                "employees": entry.employees
+            })
+            return stored, False
+
+        ingested = db.ingest_log(log, increment)
+        if ingested is None:
+            return None
+        self.cache[fingerprint] = LocalCounter(ingested[0])
+        # 超過快取上限時先寫回次數再移出最久未使用的指紋（寫回失敗時暫時超過上限，避免遺失次數）
+        if len(self.cache) > settings.SHARD_CACHE_SIZE and self.flush():
+            while len(self.cache) > settings.SHARD_CACHE_SIZE:
+                self.cache.popitem(last=False)
+        return ingested
+
+    def handle(self, payload: str):
+        try:
+            log, increment = _decode(payload)
+        except (ValueError, KeyError, TypeError) as e:
+            logger.error(f"分片 {self.shard_id} 略過無法解析的事件: {e}")
+            return
+        owner = self.ring.node_for(log.fingerprint())
+        if owner is not None and owner != self.shard_id:
+            # 重新平衡後才送達的事件，轉送給新的負責分片
+            db.r.rpush(QUEUE_PREFIX + owner, payload)
+            return
+        ingested = self.add(log, increment)
+        if ingested is None:
+            logger.error(f"分片 {self.shard_id} 寫入日誌失敗: {log.location}/{log.function}")
+            return
+        ingest.handle(*ingested, increment)
+
+    # 將累積的次數以一次 add_log_counts 寫回資料庫，回傳是否成功（失敗時次數保留在快取中）
+    def flush(self) -> bool:
+        self._last_flush = time.monotonic()
+        pending = [(entry.id, entry.pending) for entry in self.cache.values() if entry.pending > 0]
+        missing = []
+        if pending:
+            missing = db.add_log_counts([p[0] for p in pending], [p[1] for p in pending])
+            if missing is None:
+                # 寫回失敗時保留次數，下一輪再寫
+                return False
+            for entry in self.cache.values():
+                entry.pending = 0
+        if missing:
+            # 資料列已被封存或刪除：移出快取，之後的事件重新走 ingest_log 建立新的資料列
+            missing = set(missing)
+            logger.warning(f"分片 {self.shard_id} 的日誌已不存在，移出快取: {sorted(missing)}")
+            for fingerprint in [fp for fp, entry in self.cache.items() if entry.id in missing]:
+                del self.cache[fingerprint]
+        # 次數都已寫回，移出重新平衡後不再負責的指紋
+        if self._moved:
+            self._moved = False
+            for fingerprint in [fp for fp in self.cache if self.ring.node_for(fp) != self.shard_id]:
+                del self.cache[fingerprint]
+        return True
+
+    # 處理已取出的事件（單一事件失敗不影響同一批的其他事件）
+    def _process(self, payloads: List[str]):
+        for payload in payloads:
+            try:
+                self.handle(payload)
+            except Exception as e:
+                logger.error(f"分片 {self.shard_id} 處理事件時發生錯誤: {e}", exc_info=True)
+
+    def run(self, stop_after: Optional[float] = None):
+        started = time.monotonic()
+        interval = settings.COUNTER_FLUSH_INTERVAL_MS / 1000
+        while not self._stopping and (stop_after is None or time.monotonic() - started < stop_after):
+            try:
+                now = time.monotonic()
+                if now - self._last_heartbeat >= 1:
+                    self.heartbeat()
+                item = db.r.blpop(self.queue_key, timeout=1)
+                if item is not None:
+                    # 一次取出一批，減少 Redis 往返
+                    self._process([item[1], *(db.r.lpop(self.queue_key, settings.SHARD_BATCH_SIZE) or [])])
+                if time.monotonic() - self._last_flush >= interval:
+                    self.flush()
+            except Exception as e:
+                # Redis 或資料庫暫時無法使用：次數保留在程序內，稍後重試
+                logger.error(f"分片 {self.shard_id} 發生錯誤，{ERROR_BACKOFF_SECONDS} 秒後重試: {e}", exc_info=True)
+                time.sleep(ERROR_BACKOFF_SECONDS)
+        self.shutdown()
+
+    # 要求結束（SIGTERM 時呼叫），目前這一輪處理完後寫回次數並結束
+    def stop(self):
+        self._stopping = True
+
+    # 離開前寫回次數、取消登記並轉送尚未處理的事件
+    def shutdown(self):
+        if not self.flush():
+            logger.error(f"分片 {self.shard_id} 結束前寫回次數失敗，未寫回的次數將遺失")
+        try:
+            db.r.zrem(MEMBERS_KEY, self.shard_id)
+            self.ring = HashRing([node for node in self.ring.nodes if node != self.shard_id], settings.SHARD_VIRTUAL_NODES)
+            if self.ring.nodes:
+                self.forward_queue(self.queue_key)
+        except Exception as e:
+            logger.error(f"分片 {self.shard_id} 取消登記時發生錯誤，其他分片會在心跳逾時後接手佇列: {e}", exc_info=True)
+
+
+def run_worker(shard_id: str):
+    logging.basicConfig(level=logging.INFO)
+    dispatcher.start()
+    worker = ShardWorker(shard_id)
+    signal.signal(signal.SIGTERM, lambda signum, frame: worker.stop())
+    try:
+        worker.run()
+    except KeyboardInterrupt:
+        worker.shutdown()
+    finally:
+        dispatcher.stop()
+
+
+def _start_worker(prefix: str, index: int) -> multiprocessing.Process:
+    process = multiprocessing.Process(target=run_worker, args=(f"{prefix}-{index}",), name=f"shard-{index}")
+    process.start()
+    return process
+
+
+def main():
+    parser = argparse.ArgumentParser(description="啟動依指紋分片的日誌寫入 worker")
+    parser.add_argument("--workers", type=int, default=settings.SHARD_WORKERS, help="分片 worker 數量")
+    parser.add_argument("--prefix", default=settings.SHARD_ID_PREFIX, help="分片 ID 前綴（多台機器時請設定不同前綴）")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    processes = [_start_worker(args.prefix, i) for i in range(args.workers)]
+    stopping = []
+
+    # 收到 SIGTERM 時轉送給各 worker，等待它們寫回次數後結束
+    def terminate(signum, frame):
+        stopping.append(signum)
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+
+    signal.signal(signal.SIGTERM, terminate)
+    try:
+        # 意外結束的 worker 以相同的分片 ID 重新啟動（接手自己的佇列）
+        while not stopping:
+            for i, process in enumerate(processes):
+                process.join(timeout=0)
+                if process.exitcode is not None and not stopping:
+                    logger.error(f"分片 {args.prefix}-{i} 已結束 (exitcode={process.exitcode})，重新啟動")
+                    processes[i] = _start_worker(args.prefix, i)
+            time.sleep(SUPERVISE_INTERVAL_SECONDS)
+    except KeyboardInterrupt:
+        pass
+    for process in processes:
+        process.join()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,391 @@
+"""
+離線重播模擬器
+將歷史 TB_LOGS 資料（或匯出的檔案）依時間順序重播過「重複判斷 → 通知門檻 → 渠道路由 → 推播通道」流程，
+不寫入資料庫也不發送任何通知，用來在調整門檻或增加渠道前預估通知量與推播容量：
+
+- 各渠道 / 收件者的通知數、每秒 / 每分鐘的尖峰發送量
+- 依設定的 worker 數與各渠道發送耗時，以離散事件模擬各推播通道的佇列深度與送達延遲
+
+通知規則預設使用目前生效的規則，可用 --rules 指定新的規則檔試算（時間窗以模擬時間計算）。
+TB_LOGS 每筆資料代表 count 次發生，預設全部視為在該筆的日期時間發生；
+可用 --spread 將每筆的次數平均分散到之後的 N 秒內。匯出檔案每行 / 每列可以是一次事件（count 預設 1）。
+
+執行方式：
+    python -m app.simulate --date-from 2025-01-01 --date-to 2025-01-31
+    python -m app.simulate --file export.jsonl.gz --spread 3600 --rules new_rules.json --workers low=4 --json
+"""
+import argparse
+import collections
+import csv
+import datetime
+import gzip
+import heapq
+import json
+import logging
+import time
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+import numpy as np
+import app.database as db
+import app.dispatcher as dispatcher
+import app.message as msg
+import app.constants as constants
+import app.rules as rules
+from app.object import AlertRule, Log
+from app.settings import settings
+
+logger = logging.getLogger(__name__)
+
+# 各渠道單次發送的預設耗時（毫秒），可用 --service-ms 覆寫
+DEFAULT_SERVICE_MS = {
+    constants.Channel.EMAIL: 800,
+    constants.Channel.LINE: 300,
+    constants.Channel.TEAMS: 400,
+    constants.Channel.SLACK: 300,
+    constants.Channel.DISCORD: 300,
+    constants.Channel.SMS: 1000
+}
+# 找不到聯絡資訊時只查詢一次資料庫並記錄失敗
+UNROUTED_SERVICE_MS = 50
+PAGE_SIZE = 1000
+
+
+# 依 id 分頁讀取日期範圍內的 TB_LOGS
+def rows_from_db(date_from: Optional[datetime.date], date_to: Optional[datetime.date]) -> Iterator[Dict[str, Any]]:
+    last_id = 0
+    while True:
+        query = db.supabase.table("TB_LOGS").select("*").gt("id", last_id)
+        if date_from:
+            query = query.gte("date", date_from.isoformat())
+        if date_to:
+            query = query.lte("date", date_to.isoformat())
+        rows = query.order("id").limit(PAGE_SIZE).execute().data or []
+        yield from rows
+        if len(rows) < PAGE_SIZE:
+            return
+        last_id = rows[-1]["id"]
+
+
+# 讀取匯出檔案（.jsonl / .jsonl.gz / .json / .csv，封存檔格式相同）
+def rows_from_file(path: str) -> Iterator[Dict[str, Any]]:
+    opener = gzip.open if path.endswith(".gz") else open
+    name = path[:-3] if path.endswith(".gz") else path
+    with opener(path, "rt", encoding="utf-8", newline="") as f:
+        if name.endswith(".csv"):
+            for row in csv.DictReader(f):
+                if isinstance(row.get("employees"), str):
+                    row["employees"] = [e.strip() for e in row["employees"].replace(";", ",").split(",") if e.strip()]
+                yield row
+        elif name.endswith(".json"):
+            yield from json.load(f)
+        else:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def _timestamp(row: Dict[str, Any]) -> float:
+    date = datetime.date.fromisoformat(str(row["date"])[:10])
+    clock = datetime.time.fromisoformat(str(row.get("time") or "00:00:00")[:8])
+    return datetime.datetime.combine(date, clock).timestamp()
+
+
+# 將資料列展開為依時間排序的事件（回傳 基準Log 列表、每個事件的時間與對應的資料列）
+def expand(rows: Iterable[Dict[str, Any]], spread: float = 0) -> Tuple[List[Log], np.ndarray, np.ndarray]:
+    bases: List[Log] = []
+    stamps: List[float] = []
+    counts: List[int] = []
+    for row in rows:
+        try:
+            bases.append(Log(
+                riskLevel=int(row.get("riskLevel") or 0),
+                type=int(row.get("type") or 0),
+                location=row["location"],
+                function=row["function"],
+                log=row["log"],
+                employees=row.get("employees") or [],
+                date=str(row["date"])[:10],
+                time=str(row.get("time") or "00:00:00")[:8]
+            ))
+            stamps.append(_timestamp(row))
+            counts.append(max(1, int(row.get("count") or 1)))
+        except (KeyError, ValueError) as e:
+            logger.warning(f"略過無法解析的資料: {e}")
+    count_array = np.array(counts, dtype=np.int64)
+    row_index = np.repeat(np.arange(len(bases)), count_array)
+    event_ts = np.repeat(np.array(stamps, dtype=np.float64), count_array)
+    if spread > 0 and len(row_index):
+        # 每筆資料內的第幾次發生，平均分散到 spread 秒內
+        starts = np.repeat(np.cumsum(count_array) - count_array, count_array)
+        rank = np.arange(len(row_index)) - starts
+        event_ts = event_ts + rank * (spread / np.repeat(count_array, count_array))
+    order = np.argsort(event_ts, kind="stable")
+    return bases, event_ts[order], row_index[order]
+
+
+class LaneModel:
+    """以離散事件模擬單一推播通道：FIFO 佇列 + 固定數量的 worker"""
+
+    def __init__(self, lane: constants.Lane, workers: int, queue_size: int):
+        self.lane = lane
+        self.workers = workers
+        self.queue_size = queue_size
+        self._free = [0.0] * workers
+        # 已排入但尚未開始發送的通知的開始時間（FIFO 下開始時間遞增）
+        self._starts: collections.deque = collections.deque()
+        self.enqueued = 0
+        self.dropped = 0
+        self.sync = 0
+        self.max_queue_depth = 0
+        self.wait_ms: List[float] = []
+        self.latency_ms: List[float] = []
+
+    # 排入一則通知，回傳送達時間（被丟棄時回傳 None）
+    def offer(self, at: float, service: float) -> Optional[float]:
+        while self._starts and self._starts[0] <= at:
+            self._starts.popleft()
+        if len(self._starts) >= self.queue_size:
+            if self.lane != constants.Lane.EMERGENCY:
+                self.dropped += 1
+                return None
+            # 緊急通道佇列滿時由請求執行緒同步發送
+            self.sync += 1
+            self.wait_ms.append(0.0)
+            self.latency_ms.append(service * 1000)
+            return at + service
+        start = max(at, heapq.heappop(self._free))
+        finish = start + service
+        heapq.heappush(self._free, finish)
+        if start > at:
+            self._starts.append(start)
+        self.enqueued += 1
+        self.max_queue_depth = max(self.max_queue_depth, len(self._starts))
+        self.wait_ms.append((start - at) * 1000)
+        self.latency_ms.append((finish - at) * 1000)
+        return finish
+
+    def report(self) -> Dict[str, Any]:
+        wait = sorted(self.wait_ms)
+        latency = sorted(self.latency_ms)
+        return {
+            "workers": self.workers,
+            "enqueued": self.enqueued,
+            "sync": self.sync,
+            "dropped": self.dropped,
+            "max_queue_depth": self.max_queue_depth,
+            "wait_ms": {p: dispatcher.percentile(wait, n) for p, n in (("p50", 50), ("p95", 95), ("p99", 99))},
+            "latency_ms": {p: dispatcher.percentile(latency, n) for p, n in (("p50", 50), ("p95", 95), ("p99", 99))}
+        }
+
+
+def _peak(counter: Dict[int, int]) -> int:
+    return max(counter.values()) if counter else 0
+
+
+class Simulator:
+    """重播事件並累計通知量與通道負載"""
+
+    def __init__(
+            self,
+            contacts: List[dict],
+            index: Optional[rules.RuleIndex] = None,
+            workers: Optional[Dict[constants.Lane, int]] = None,
+            service_ms: Optional[Dict[constants.Channel, float]] = None,
+            queue_size: Optional[int] = None
+        ):
+        self.contacts = {str(contact.get("no")): contact for contact in contacts}
+        self.index = index or rules.current()
+        self.service = {channel: ms / 1000 for channel, ms in {**DEFAULT_SERVICE_MS, **(service_ms or {})}.items()}
+        workers = {
+            constants.Lane.EMERGENCY: settings.DISPATCH_WORKERS_EMERGENCY,
+            constants.Lane.HIGH: settings.DISPATCH_WORKERS_HIGH,
+            constants.Lane.LOW: settings.DISPATCH_WORKERS_LOW,
+            **(workers or {})
+        }
+        size = queue_size or settings.DISPATCH_QUEUE_SIZE
+        self.lanes = {lane: LaneModel(lane, count, size) for lane, count in workers.items()}
+        self._routes: Dict[Tuple[Tuple[str, ...], Tuple[str, ...]], Tuple[Dict[constants.Channel, List[str]], float]] = {}
+        self.seen: Dict[str, int] = {}
+        # 規則時間窗：{(規則名稱, 指紋): (時間窗結束時間, 次數)}
+        self._windows: Dict[Tuple[str, str], Tuple[float, int]] = {}
+        self._now = 0.0
+        self.events = 0
+        self.notifications = 0
+        self.unrouted = 0
+        self.by_lane: Dict[str, int] = collections.Counter()
+        self.by_risk_level: Dict[int, int] = collections.Counter()
+        self.channels: Dict[str, int] = collections.Counter()
+        self.recipients: Dict[str, int] = collections.Counter()
+        self.notify_per_second: Dict[int, int] = collections.Counter()
+        self.notify_per_minute: Dict[int, int] = collections.Counter()
+        self.sends_per_second: Dict[int, int] = collections.Counter()
+        self.sends_per_minute: Dict[int, int] = collections.Counter()
+
+    # 與 message.send_message 相同的路由，並依各渠道耗時估算一則通知的發送時間（同一組收件者只計算一次）
+    # 回傳 ({渠道: 發送次數}, 發送耗時)，與 message._send_message 相同的路由
+    def _route(self, employees: List[str], channels: List[str]) -> Tuple[Dict[constants.Channel, int], float]:
+        """
+        Email 每個信箱發送一次，Line / SMS 各一次；Teams / Slack / Discord 依 route_webhooks 每個 URL 發送一次
+        （沒有可用 URL 的不發送）。Email、Line、SMS 依序發送，所有 Webhook 並行發送，耗時取最慢的渠道
+        """
+        key = (tuple(employees), tuple(channels))
+        cached = self._routes.get(key)
+        if cached is None:
+            contacts = [self.contacts[e] for e in employees if e in self.contacts]
+            sends = {
+                channel: len(targets) if channel == constants.Channel.EMAIL else 1
+                for channel, targets in msg.route_contacts(contacts, channels).items()
+                if channel not in msg.WEBHOOK_ROUTED
+            }
+            for channel, targets in msg.route_webhooks(contacts, channels).items():
+                urls = sum(1 for url in targets if url)
+                if urls:
+                    sends[channel] = urls
+            service = sum(self.service[channel] * count for channel, count in sends.items() if channel not in msg.WEBHOOK_ROUTED)
+            service += max((self.service[channel] for channel in sends if channel in msg.WEBHOOK_ROUTED), default=0)
+            cached = self._routes[key] = (sends, service if sends else UNROUTED_SERVICE_MS / 1000)
+        return cached
+
+    # 以模擬時間計算規則時間窗內的次數（與 rules.redis_window_count 相同的固定時間窗）
+    def _window_count(self, rule: AlertRule, fingerprint: str, increment: int) -> int:
+        key = (rule.name, fingerprint)
+        expires_at, count = self._windows.get(key, (0.0, 0))
+        if expires_at <= self._now:
+            expires_at, count = self._now + rule.window_seconds, 0
+        count += increment
+        self._windows[key] = (expires_at, count)
+        return count
+
+    def replay(self, bases: List[Log], event_ts: np.ndarray, row_index: np.ndarray) -> None:
+        fingerprints = [base.fingerprint() for base in bases]
+        for at, index in zip(event_ts.tolist(), row_index.tolist()):
+            self.events += 1
+            self._now = at
+            fingerprint = fingerprints[index]
+            count = self.seen.get(fingerprint, 0) + 1
+            self.seen[fingerprint] = count
+            base = bases[index]
+            message = db.build_notification(
+                base.model_copy(update={"count": count}), count == 1,
+                index=self.index, window_count=self._window_count
+            )
+            if message is not None:
+                self._notify(at, base, message.employees, message.channels)
+
+    def _notify(self, at: float, log: Log, employees: List[str], channels: List[str]) -> None:
+        lane = dispatcher.lane_for(log.riskLevel)
+        self.notifications += 1
+        self.by_lane[lane.value] += 1
+        self.by_risk_level[log.riskLevel] += 1
+        self.notify_per_second[int(at)] += 1
+        self.notify_per_minute[int(at) // 60] += 1
+        routes, service = self._route(employees, channels)
+        finished = self.lanes[lane].offer(at, service)
+        if finished is None:
+            return
+        if not routes:
+            self.unrouted += 1
+            return
+        for employee in employees:
+            if employee in self.contacts:
+                self.recipients[employee] += 1
+        sends = 0
+        for channel, count in routes.items():
+            self.channels[channel.value] += count
+            sends += count
+        self.sends_per_second[int(finished)] += sends
+        self.sends_per_minute[int(finished) // 60] += sends
+
+    def report(self, event_ts: np.ndarray, top: int = 20) -> Dict[str, Any]:
+        return {
+            "events": self.events,
+            "fingerprints": len(self.seen),
+            "simulated_seconds": round(float(event_ts[-1] - event_ts[0]), 3) if len(event_ts) else 0,
+            "rules": len(self.index.rules),
+            "notifications": {
+                "total": self.notifications,
+                "unrouted": self.unrouted,
+                "by_lane": dict(self.by_lane),
+                "by_risk_level": dict(self.by_risk_level)
+            },
+            "channels": dict(self.channels),
+            "recipients": dict(self.recipients.most_common(top)),
+            "peak": {
+                "notifications_per_second": _peak(self.notify_per_second),
+                "notifications_per_minute": _peak(self.notify_per_minute),
+                "sends_per_second": _peak(self.sends_per_second),
+                "sends_per_minute": _peak(self.sends_per_minute)
+            },
+            "lanes": {lane.value: model.report() for lane, model in self.lanes.items()}
+        }
+
+
+def load_contacts(path: Optional[str]) -> List[dict]:
+    if path:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    result = db.supabase.table("TB_EMPLOYEE_CONTACT").select("*").execute()
+    return result.data or []
+
+
+# 解析 "key=value,key=value" 形式的參數
+def _pairs(value: Optional[str]) -> Dict[str, str]:
+    if not value:
+        return {}
+    return dict(item.split("=", 1) for item in value.split(",") if "=" in item)
+
+
+def _print_report(report: Dict[str, Any], elapsed: float) -> None:
+    print(f"重播事件: {report['events']} 筆（{report['fingerprints']} 種日誌，模擬時間 {report['simulated_seconds']} 秒，耗時 {elapsed:.1f} 秒）")
+    print(f"通知規則: {report['rules']} 條（未符合任何規則時使用內建門檻）")
+    notifications = report["notifications"]
+    print(f"通知數: {notifications['total']}（找不到聯絡資訊 {notifications['unrouted']}）")
+    print(f"  依通道: {notifications['by_lane']}")
+    print(f"  依風險等級: {notifications['by_risk_level']}")
+    print(f"各渠道發送數: {report['channels']}")
+    print(f"尖峰: {report['peak']}")
+    print("收件者（前 20 名）:")
+    for recipient, count in report["recipients"].items():
+        print(f"  {recipient}: {count}")
+    print("推播通道:")
+    for lane, stats in report["lanes"].items():
+        print(
+            f"  {lane}: workers={stats['workers']} 最大佇列深度={stats['max_queue_depth']} "
+            f"丟棄={stats['dropped']} 同步發送={stats['sync']} 等待={stats['wait_ms']} 送達延遲={stats['latency_ms']}"
+        )
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="以歷史日誌離線模擬通知量與推播容量（不會發送任何通知）")
+    parser.add_argument("--file", help="匯出的日誌檔案（.jsonl / .jsonl.gz / .json / .csv），未指定時讀取 TB_LOGS")
+    parser.add_argument("--date-from", type=datetime.date.fromisoformat, help="TB_LOGS 開始日期")
+    parser.add_argument("--date-to", type=datetime.date.fromisoformat, help="TB_LOGS 結束日期")
+    parser.add_argument("--spread", type=float, default=0, help="將每筆資料的次數平均分散到之後的 N 秒內")
+    parser.add_argument("--contacts", help="員工聯絡方式 JSON 檔（預設讀取 TB_EMPLOYEE_CONTACT）")
+    parser.add_argument("--rules", help="以指定的規則檔試算（預設使用目前生效的規則）")
+    parser.add_argument("--workers", help="覆寫各通道 worker 數，例如 emergency=4,low=8")
+    parser.add_argument("--queue-size", type=int, help="各通道佇列上限（預設 DISPATCH_QUEUE_SIZE）")
+    parser.add_argument("--service-ms", help="覆寫各渠道單次發送耗時，例如 Email=500,SMS=1500")
+    parser.add_argument("--json", action="store_true", help="以 JSON 輸出結果")
+    args = parser.parse_args()
+
+    started = time.monotonic()
+    rows = rows_from_file(args.file) if args.file else rows_from_db(args.date_from, args.date_to)
+    bases, event_ts, row_index = expand(rows, args.spread)
+    simulator = Simulator(
+        load_contacts(args.contacts),
+        index=rules.RuleIndex(rules.load_file(args.rules)) if args.rules else None,
+        workers={constants.Lane(k): int(v) for k, v in _pairs(args.workers).items()},
+        service_ms={constants.Channel(k): float(v) for k, v in _pairs(args.service_ms).items()},
+        queue_size=args.queue_size
+    )
+    simulator.replay(bases, event_ts, row_index)
+    report = simulator.report(event_ts)
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    else:
+        _print_report(report, time.monotonic() - started)
+
+
+if __name__ == "__main__":
+    main()
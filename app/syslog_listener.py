@@ -0,0 +1,357 @@
+"""
+Syslog 接收模組
+提供 UDP / TCP syslog 監聽（RFC 5424 與 RFC 3164），將訊息解析為 Log 後批次交給寫入流程，
+讓只能輸出 syslog 的舊系統不需要每筆事件都呼叫一次 HTTP /logs。
+
+- 依 SYSLOG_SEVERITY_RISK_LEVELS 將 syslog 嚴重度（0~7）對應到風險等級，對應為 0 的訊息直接丟棄
+- 接收執行緒只負責解析並排入佇列，由批次執行緒每 SYSLOG_BATCH_INTERVAL_MS 毫秒
+  （或累積 SYSLOG_BATCH_SIZE 筆）將同一批內相同指紋的訊息合併成一次寫入
+- TCP 支援 RFC 6587 的長度前綴與換行分隔兩種框架
+
+執行方式（或設定 SYSLOG_ENABLED=1 隨 API 一起啟動）：
+    python -m app.syslog_listener
+"""
+import datetime
+import logging
+import queue
+import re
+import socketserver
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+import app.admission as admission
+import app.counter as counter
+import app.dispatcher as dispatcher
+import app.ingest as ingest
+import app.sharding as sharding
+from app.object import Log
+from app.settings import settings
+
+logger = logging.getLogger(__name__)
+
+# 單一訊息的最大長度（超過的部分截斷）
+MAX_MESSAGE_SIZE = 64 * 1024
+
+_PRI = re.compile(r"<(\d{1,3})>")
+_RFC5424 = re.compile(
+    r"1 (?P<timestamp>\S+) (?P<hostname>\S+) (?P<app>\S+) (?P<procid>\S+) (?P<msgid>\S+) "
+    r"(?P<sd>-|(?:\[(?:[^\]\\]|\\.)*\])+)(?: (?P<msg>.*))?",
+    re.DOTALL
+)
+_RFC3164 = re.compile(
+    r"(?P<timestamp>[A-Z][a-z]{2} [ \d]\d \d{2}:\d{2}:\d{2}) (?P<hostname>\S+) "
+    r"(?:(?P<tag>[^\s:\[]+)(?:\[(?P<procid>[^\]]*)\])?: ?)?(?P<msg>.*)",
+    re.DOTALL
+)
+_MONTHS = {m: i for i, m in enumerate(["Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"], 1)}
+
+
+# 解析嚴重度對應風險等級的設定（依嚴重度 0~7 排列，以逗號分隔）
+def severity_levels() -> List[int]:
+    levels = [int(value) for value in settings.SYSLOG_SEVERITY_RISK_LEVELS.split(",") if value.strip()]
+    if len(levels) != 8:
+        raise ValueError("SYSLOG_SEVERITY_RISK_LEVELS 必須依序設定 8 個嚴重度的風險等級")
+    return levels
+
+
+def _employees() -> List[str]:
+    return [employee.strip() for employee in settings.SYSLOG_EMPLOYEES.split(",") if employee.strip()]
+
+
+def _nil(value: Optional[str]) -> Optional[str]:
+    return None if value in (None, "-") else value
+
+
+def _parse_5424_timestamp(value: str) -> Optional[datetime.datetime]:
+    if value == "-":
+        return None
+    try:
+        parsed = datetime.datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    # 轉為本機時間，與 /logs 預設的日期時間一致
+    return parsed.astimezone().replace(tzinfo=None) if parsed.tzinfo else parsed
+
+
+def _parse_3164_timestamp(value: str) -> Optional[datetime.datetime]:
+    now = datetime.datetime.now()
+    try:
+        clock = datetime.datetime.strptime(value[7:], "%H:%M:%S").time()
+        parsed = datetime.datetime.combine(datetime.date(now.year, _MONTHS[value[:3]], int(value[4:6])), clock)
+    except (KeyError, ValueError):
+        return None
+    # RFC 3164 沒有年份，跨年時的十二月訊息屬於去年
+    if parsed - now > datetime.timedelta(days=1):
+        parsed = parsed.replace(year=now.year - 1)
+    return parsed
+
+
+# 解析一則 syslog 訊息，無法解析或嚴重度對應為 0 時回傳 None
+def parse(data: str, levels: Optional[List[int]] = None) -> Optional[Log]:
+    match = _PRI.match(data)
+    if match is None or int(match.group(1)) > 191:
+        return None
+    severity = int(match.group(1)) % 8
+    risk_level = (levels or severity_levels())[severity]
+    if risk_level <= 0:
+        return None
+    body = data[match.end():]
+
+    hostname = app_name = message = None
+    timestamp = None
+    structured = _RFC5424.match(body)
+    if structured:
+        timestamp = _parse_5424_timestamp(structured.group("timestamp"))
+        hostname = _nil(structured.group("hostname"))
+        app_name = _nil(structured.group("app"))
+        message = structured.group("msg") or ""
+        if message.startswith("\ufeff"):
+            message = message[1:]
+    else:
+        legacy = _RFC3164.match(body)
+        if legacy:
+            timestamp = _parse_3164_timestamp(legacy.group("timestamp"))
+            hostname = legacy.group("hostname")
+            app_name = legacy.group("tag")
+            message = legacy.group("msg")
+        else:
+            message = body
+
+    message = message.strip()
+    if not message:
+        return None
+    timestamp = timestamp or datetime.datetime.now()
+    return Log(
+        riskLevel=risk_level,
+        type=settings.SYSLOG_LOG_TYPE,
+        location=hostname or "syslog",
+        function=app_name or "syslog",
+        log=message,
+        employees=_employees(),
+        date=timestamp.date(),
+        time=timestamp.time().replace(microsecond=0)
+    )
+
+
+# 將 TCP 串流依 RFC 6587 切成訊息（長度前綴或換行分隔），回傳 (訊息列表, 未完整的剩餘資料)
+# 長度前綴超過 MAX_MESSAGE_SIZE（或為 0）時剩餘資料回傳 None，呼叫端應關閉連線
+def split_frames(buffer: bytes) -> Tuple[List[bytes], Optional[bytes]]:
+    frames = []
+    while buffer:
+        # 長度前綴：「長度 訊息」（非長度前綴的訊息一定以 "<PRI>" 開頭）
+        if buffer[:1].isdigit():
+            space = buffer.find(b" ")
+            if space == -1 or not buffer[:space].isdigit():
+                if space == -1 and len(buffer) < 16:
+                    break
+                # 格式錯誤，丟棄到下一個換行
+                newline = buffer.find(b"\n")
+                buffer = buffer[newline + 1:] if newline != -1 else b""
+                continue
+            # 先檢查位數再轉換，避免超長的數字字串
+            if space > len(str(MAX_MESSAGE_SIZE)) or not 0 < int(buffer[:space]) <= MAX_MESSAGE_SIZE:
+                return [frame for frame in frames if frame], None
+            end = space + 1 + int(buffer[:space])
+            if len(buffer) < end:
+                break
+            frames.append(buffer[space + 1:end])
+            buffer = buffer[end:]
+            continue
+        newline = buffer.find(b"\n")
+        if newline == -1:
+            if len(buffer) > MAX_MESSAGE_SIZE:
+                frames.append(buffer[:MAX_MESSAGE_SIZE])
+                buffer = b""
+            break
+        frames.append(buffer[:newline].rstrip(b"\r"))
+        buffer = buffer[newline + 1:]
+    return [frame for frame in frames if frame], buffer
+
+
+class SyslogBatcher:
+    """接收端的批次交接：解析後的 Log 排入佇列，由單一執行緒合併相同指紋後寫入"""
+
+    def __init__(self):
+        self.queue: queue.Queue = queue.Queue(maxsize=settings.SYSLOG_QUEUE_SIZE)
+        self.levels = severity_levels()
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self.received = 0
+        self.ignored = 0
+        self.dropped = 0
+        self.written = 0
+
+    def submit(self, data: bytes):
+        log = parse(data[:MAX_MESSAGE_SIZE].decode("utf-8", errors="replace"), self.levels)
+        with self._lock:
+            self.received += 1
+            if log is None:
+                self.ignored += 1
+                return
+        try:
+            self.queue.put_nowait(log)
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="syslog-batcher", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=10)
+            self._thread = None
+
+    def _collect(self) -> List[Log]:
+        deadline = time.monotonic() + settings.SYSLOG_BATCH_INTERVAL_MS / 1000
+        batch = []
+        while len(batch) < settings.SYSLOG_BATCH_SIZE:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while not self._stop.is_set() or not self.queue.empty():
+            batch = self._collect()
+            if batch:
+                self.flush(batch)
+
+    # 同一批內相同指紋的訊息合併為一次寫入（保留最後一筆的日期時間）
+    def flush(self, batch: List[Log]):
+        grouped: Dict[str, Tuple[Log, int]] = {}
+        for log in batch:
+            fingerprint = log.fingerprint()
+            previous = grouped.get(fingerprint)
+            grouped[fingerprint] = (log, previous[1] + 1 if previous else 1)
+        for log, increment in grouped.values():
+            try:
+                if not admission.admit(log.riskLevel):
+                    with self._lock:
+                        self.dropped += increment
+                    continue
+                with admission.inflight():
+                    if settings.SHARDING_ENABLED and sharding.submit(log, increment) is not None:
+                        ingested = True
+                    else:
+                        ingested = ingest.process(log, increment)
+            except Exception as e:
+                logger.error(f"寫入 syslog 日誌時發生錯誤: {e}", exc_info=True)
+                ingested = None
+            with self._lock:
+                if ingested is None:
+                    self.dropped += increment
+                else:
+                    self.written += increment
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "received": self.received,
+                "ignored": self.ignored,
+                "dropped": self.dropped,
+                "written": self.written,
+                "queue_depth": self.queue.qsize()
+            }
+
+
+class _UDPHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        self.server.batcher.submit(self.request[0])
+
+
+class _TCPHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        buffer = b""
+        while True:
+            try:
+                chunk = self.request.recv(65536)
+            except OSError:
+                break
+            if not chunk:
+                break
+            frames, buffer = split_frames(buffer + chunk)
+            for frame in frames:
+                self.server.batcher.submit(frame)
+            if buffer is None:
+                logger.warning(f"syslog 長度前綴不合法，關閉連線: {self.client_address}")
+                return
+        # 連線結束時最後一則訊息可能沒有換行
+        if buffer.strip():
+            self.server.batcher.submit(buffer)
+
+
+class _UDPServer(socketserver.UDPServer):
+    # UDP 在接收執行緒直接解析，避免每則訊息建立執行緒
+    allow_reuse_address = True
+    max_packet_size = MAX_MESSAGE_SIZE
+
+
+class _TCPServer(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+_batcher: Optional[SyslogBatcher] = None
+_servers: List[socketserver.BaseServer] = []
+
+
+def start():
+    global _batcher
+    if _batcher is not None:
+        return
+    _batcher = SyslogBatcher()
+    _batcher.start()
+    if settings.SYSLOG_UDP_PORT:
+        _servers.append(_UDPServer((settings.SYSLOG_HOST, settings.SYSLOG_UDP_PORT), _UDPHandler))
+    if settings.SYSLOG_TCP_PORT:
+        _servers.append(_TCPServer((settings.SYSLOG_HOST, settings.SYSLOG_TCP_PORT), _TCPHandler))
+    for server in _servers:
+        server.batcher = _batcher
+        threading.Thread(target=server.serve_forever, name=f"syslog-{type(server).__name__}", daemon=True).start()
+    logger.info(f"Syslog 監聽已啟動: UDP {settings.SYSLOG_UDP_PORT or '停用'} / TCP {settings.SYSLOG_TCP_PORT or '停用'}")
+
+
+def stop():
+    global _batcher
+    for server in _servers:
+        server.shutdown()
+        server.server_close()
+    _servers.clear()
+    if _batcher is not None:
+        _batcher.stop()
+        _batcher = None
+
+
+# 接收統計（未啟動時回傳 None）
+def stats() -> Optional[Dict[str, int]]:
+    return _batcher.stats() if _batcher else None
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    counter.start()
+    dispatcher.start()
+    start()
+    try:
+        while True:
+            time.sleep(60)
+            logger.info(f"Syslog 接收統計: {stats()}")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop()
+        counter.stop()
+        dispatcher.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""
+日誌數量時間序列模組
+寫入日誌時在 Redis 中累加每分鐘與每小時的時間桶（欄位為風險等級），
+查詢時依範圍選擇最細且仍保存中的來源時間桶，再以 numpy 陣列運算向下取樣成分鐘 / 小時 / 日。
+"""
+import datetime
+import logging
+from typing import Any, Dict, List, Tuple
+import numpy as np
+import app.database as db
+from app.object import Log
+from app.settings import settings
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = "logs:ts:"
+# 風險等級欄位（0=無, 1=普通, 2=高風險, 3=緊急）
+RISK_LEVELS = ("0", "1", "2", "3")
+
+BUCKET_MINUTE = "minute"
+BUCKET_HOUR = "hour"
+BUCKET_DAY = "day"
+BUCKET_SECONDS = {BUCKET_MINUTE: 60, BUCKET_HOUR: 3600, BUCKET_DAY: 86400}
+_KEY_FORMAT = {BUCKET_MINUTE: "%Y%m%d%H%M", BUCKET_HOUR: "%Y%m%d%H"}
+
+
+def _key(source: str, moment: datetime.datetime) -> str:
+    return f"{KEY_PREFIX}{source[0]}:{moment.strftime(_KEY_FORMAT[source])}"
+
+
+# 取整到時間桶的開頭
+def floor(moment: datetime.datetime, bucket: str) -> datetime.datetime:
+    if bucket == BUCKET_MINUTE:
+        return moment.replace(second=0, microsecond=0)
+    if bucket == BUCKET_HOUR:
+        return moment.replace(minute=0, second=0, microsecond=0)
+    return moment.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+# 將累加目前分鐘與小時時間桶的指令排入 pipeline，由呼叫端執行
+def queue(pipe, log: Log, increment: int = 1) -> None:
+    now = datetime.datetime.now()
+    field = str(log.riskLevel)
+    for source, ttl in (
+        (BUCKET_MINUTE, settings.TS_MINUTE_RETENTION_HOURS * 3600),
+        (BUCKET_HOUR, settings.TS_HOUR_RETENTION_DAYS * 86400)
+    ):
+        key = _key(source, now)
+        pipe.hincrby(key, field, increment)
+        pipe.expire(key, ttl)
+
+
+# 依查詢範圍自動選擇回傳的時間桶（避免回傳過多資料點）
+def auto_bucket(start: datetime.datetime, end: datetime.datetime) -> str:
+    span = end - start
+    if span <= datetime.timedelta(hours=6):
+        return BUCKET_MINUTE
+    if span <= datetime.timedelta(days=7):
+        return BUCKET_HOUR
+    return BUCKET_DAY
+
+
+# 分鐘時間桶只保存 TS_MINUTE_RETENTION_HOURS，其餘一律由小時時間桶取樣
+def source_for(bucket: str) -> str:
+    return BUCKET_MINUTE if bucket == BUCKET_MINUTE else BUCKET_HOUR
+
+
+# 查詢範圍需要讀取的來源時間桶數
+def source_buckets(source: str, start: datetime.datetime, end: datetime.datetime) -> int:
+    return int((end - floor(start, source)) / datetime.timedelta(seconds=BUCKET_SECONDS[source])) + 1
+
+
+# 讀取來源時間桶，回傳 (開始時間, 次數矩陣 shape=(時間桶數, 風險等級數))
+def _load(source: str, start: datetime.datetime, end: datetime.datetime) -> Tuple[datetime.datetime, np.ndarray]:
+    step = datetime.timedelta(seconds=BUCKET_SECONDS[source])
+    first = floor(start, source)
+    count = source_buckets(source, start, end)
+    pipe = db.r.pipeline(transaction=False)
+    for i in range(count):
+        pipe.hmget(_key(source, first + i * step), *RISK_LEVELS)
+    replies = np.array(pipe.execute(), dtype=object).reshape(count, len(RISK_LEVELS))
+    replies[replies == None] = 0  # noqa: E711（numpy 元素比較）
+    return first, replies.astype(np.int64)
+
+
+# 查詢範圍內每個時間桶的日誌數量
+def query(start: datetime.datetime, end: datetime.datetime, bucket: str) -> Dict[str, Any]:
+    """回傳欄位導向的結果：timestamps 與各風險等級對應的數量陣列"""
+    source = source_for(bucket)
+    source_start, matrix = _load(source, start, end)
+
+    # 以陣列運算將來源時間桶對應到目標時間桶後加總（向下取樣）
+    bucket_start = floor(start, bucket)
+    offsets = (source_start - bucket_start).total_seconds() + np.arange(len(matrix)) * BUCKET_SECONDS[source]
+    groups = (offsets // BUCKET_SECONDS[bucket]).astype(np.int64)
+    n_buckets = int(groups[-1]) + 1 if len(groups) else 0
+    totals = np.zeros((n_buckets, len(RISK_LEVELS)), dtype=np.int64)
+    np.add.at(totals, groups, matrix)
+
+    step = datetime.timedelta(seconds=BUCKET_SECONDS[bucket])
+    timestamps: List[str] = [(bucket_start + i * step).isoformat() for i in range(n_buckets)]
+    return {
+        "bucket": bucket,
+        "timestamps": timestamps,
+        "by_risk_level": {level: totals[:, i].tolist() for i, level in enumerate(RISK_LEVELS)},
+        "total": totals.sum(axis=1).tolist()
+    }
@@ -0,0 +1,103 @@
+"""
+即時 Top-K 統計模組
+寫入日誌時以 Space-Saving 演算法在 Redis 中維護每小時、每個維度（location / function）
+出現次數最多的項目，每個時間桶最多保留 TOPK_CAPACITY 個計數器，記憶體用量固定；
+查詢時合併最近 N 小時的時間桶即可立即回答，不需要掃描 TB_LOGS。
+"""
+import datetime
+import logging
+from typing import Any, Dict, List
+from redis.exceptions import NoScriptError
+import app.database as db
+from app.object import Log
+from app.settings import settings
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = "logs:topk:"
+# 支援的統計維度
+DIMENSIONS = ("location", "function")
+
+# Space-Saving：已追蹤的項目直接累加；計數器已滿時取代最小的項目，
+# 新項目的次數 = 被取代項目的次數 + 本次次數，並記錄可能高估的誤差上限
+_RECORD_SCRIPT = db.r.register_script("""
+if redis.call('ZSCORE', KEYS[1], ARGV[1]) then
+    redis.call('ZINCRBY', KEYS[1], ARGV[2], ARGV[1])
+elseif redis.call('ZCARD', KEYS[1]) < tonumber(ARGV[3]) then
+    redis.call('ZADD', KEYS[1], ARGV[2], ARGV[1])
+else
+    local evicted = redis.call('ZPOPMIN', KEYS[1])
+    redis.call('HDEL', KEYS[2], evicted[1])
+    redis.call('ZADD', KEYS[1], tonumber(evicted[2]) + tonumber(ARGV[2]), ARGV[1])
+    redis.call('HSET', KEYS[2], ARGV[1], evicted[2])
+end
+redis.call('EXPIRE', KEYS[1], ARGV[4])
+redis.call('EXPIRE', KEYS[2], ARGV[4])
+return 1
+""")
+# 腳本是否已載入 Redis（以 EVALSHA 排入 pipeline 時，redis-py 不會每次執行前再以 SCRIPT EXISTS 檢查）
+_script_loaded = False
+
+
+def _bucket(moment: datetime.datetime) -> str:
+    return moment.strftime("%Y%m%d%H")
+
+
+def _keys(dimension: str, bucket: str) -> List[str]:
+    key = f"{KEY_PREFIX}{dimension}:{bucket}"
+    return [key, key + ":err"]
+
+
+# 將一筆日誌（次數為 increment）的更新排入 pipeline，由呼叫端執行
+def queue(pipe, log: Log, increment: int = 1) -> None:
+    global _script_loaded
+    if not _script_loaded:
+        db.r.script_load(_RECORD_SCRIPT.script)
+        _script_loaded = True
+    bucket = _bucket(datetime.datetime.now())
+    ttl = settings.TOPK_RETENTION_HOURS * 3600
+    for dimension in DIMENSIONS:
+        pipe.evalsha(
+            _RECORD_SCRIPT.sha, 2, *_keys(dimension, bucket),
+            getattr(log, dimension), increment, settings.TOPK_CAPACITY, ttl
+        )
+
+
+# pipeline 執行失敗時呼叫：Redis 重新啟動後腳本快取被清除，下一次排入前重新載入
+def handle_error(e: Exception) -> None:
+    global _script_loaded
+    if isinstance(e, NoScriptError):
+        _script_loaded = False
+
+
+# 查詢最近 hours 小時內次數最多的 k 個項目
+def top(dimension: str, hours: int, k: int) -> List[Dict[str, Any]]:
+    """
+    合併各時間桶的計數器，count 為次數上限、count - error 為保證的最少次數：
+    項目在時間桶中的分數本身就是上限；不在已滿的時間桶中時，該桶的次數不會超過桶內最小的分數，
+    因此上限與誤差都要加上這些時間桶的最小分數（未滿的時間桶沒有取代過項目，不在桶內即為 0 次）
+    """
+    now = datetime.datetime.now()
+    buckets = [_bucket(now - datetime.timedelta(hours=i)) for i in range(hours)]
+    pipe = db.r.pipeline(transaction=False)
+    for bucket in buckets:
+        key, err_key = _keys(dimension, bucket)
+        pipe.zrange(key, 0, -1, withscores=True)
+        pipe.hgetall(err_key)
+    replies = pipe.execute()
+
+    # 先假設每個項目都不在各時間桶中（加上各桶的最小分數），出現在桶內時再換成實際的分數與誤差
+    floor_total = 0.0
+    counts: Dict[str, float] = {}
+    errors: Dict[str, float] = {}
+    for entries, bucket_errors in zip(replies[0::2], replies[1::2]):
+        floor = entries[0][1] if entries and len(entries) >= settings.TOPK_CAPACITY else 0.0
+        floor_total += floor
+        for value, score in entries:
+            counts[value] = counts.get(value, 0) + score - floor
+            errors[value] = errors.get(value, 0) + float(bucket_errors.get(value, 0)) - floor
+    ranked = sorted(counts.items(), key=lambda x: x[1], reverse=True)[:k]
+    return [
+        {"value": value, "count": int(count + floor_total), "error": int(errors[value] + floor_total)}
+        for value, count in ranked
+    ]
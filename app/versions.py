@@ -0,0 +1,141 @@
+"""
+資料版本模組（ETag / 條件式 GET）
+儀表板會持續輪詢列表與統計 API，大部分時候拿到的內容完全相同。
+寫入流程在資料變更後累加對應範圍的版本號（logs: TB_LOGS、notifications: TB_NOTIFICATION_HISTORY），
+查詢 API 以「路徑 + 查詢參數 + 今天日期 + 各範圍版本號」計算 ETag，
+請求的 If-None-Match 相符時直接回傳 304，不查詢資料庫也不序列化回應。
+
+- 版本號存在 Redis hash（多台機器共用），key 被清除後重新建立時換一個新的 epoch，不會與舊的 ETag 重複
+- 使用唯讀複本時，最近 REPLICA_MAX_STALENESS_SECONDS 秒內有變更的範圍不回傳 ETag（複本可能還沒有這些資料）
+- Redis 無法使用時 ETAG_RETRY_SECONDS 秒內不回傳 ETag，期間略過的版本累加在 Redis 恢復後補上
+"""
+import datetime
+import hashlib
+import logging
+import secrets
+import threading
+import time
+from typing import Iterable, List, Optional, Tuple
+import app.database as db
+from app.settings import settings
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = "version:"
+
+LOGS = "logs"
+NOTIFICATIONS = "notifications"
+
+# 資料表對應的版本範圍
+TABLE_SCOPES = {
+    "TB_LOGS": LOGS,
+    "TB_NOTIFICATION_HISTORY": NOTIFICATIONS
+}
+
+_lock = threading.Lock()
+_down_until = 0.0
+# Redis 無法使用期間略過的版本累加
+_missed = set()
+
+
+def _mark_down(reason: str) -> None:
+    global _down_until
+    _down_until = time.monotonic() + settings.ETAG_RETRY_SECONDS
+    logger.error(f"存取資料版本時發生錯誤，{settings.ETAG_RETRY_SECONDS} 秒內不使用 ETag: {reason}")
+
+
+def _available() -> bool:
+    return time.monotonic() >= _down_until
+
+
+def _increment(scopes: Iterable[str]) -> None:
+    pipe = db.r.pipeline(transaction=False)
+    for scope in scopes:
+        key = KEY_PREFIX + scope
+        pipe.hincrby(key, "v", 1)
+        pipe.hsetnx(key, "epoch", secrets.token_hex(8))
+        pipe.hset(key, "at", time.time())
+    pipe.execute()
+
+
+def _flush_missed() -> None:
+    with _lock:
+        missed = set(_missed)
+        _missed.clear()
+    if missed:
+        try:
+            _increment(missed)
+        except Exception:
+            with _lock:
+                _missed.update(missed)
+            raise
+
+
+# 資料變更後累加版本號（寫入流程呼叫，失敗時不影響寫入）
+def bump(scope: str) -> None:
+    if not settings.ETAG_ENABLED:
+        return
+    if not _available():
+        with _lock:
+            _missed.add(scope)
+        return
+    try:
+        _flush_missed()
+        _increment([scope])
+    except Exception as e:
+        with _lock:
+            _missed.add(scope)
+        _mark_down(str(e))
+
+
+# 取得各範圍目前的 (epoch, 版本號, 最後變更時間)，無法取得時回傳 None
+def current(scopes: List[str]) -> Optional[List[Tuple[str, int, float]]]:
+    if not _available():
+        return None
+    try:
+        _flush_missed()
+        pipe = db.r.pipeline(transaction=False)
+        for scope in scopes:
+            pipe.hmget(KEY_PREFIX + scope, "epoch", "v", "at")
+        rows = pipe.execute()
+    except Exception as e:
+        _mark_down(str(e))
+        return None
+    missing = [scope for scope, (epoch, _, _) in zip(scopes, rows) if epoch is None]
+    if missing:
+        # 第一次使用（或 key 被清除）時建立版本號，這次不回傳 ETag
+        for scope in missing:
+            bump(scope)
+        return None
+    return [(epoch, int(version), float(changed_at)) for epoch, version, changed_at in rows]
+
+
+# 計算查詢的 ETag（不可使用時回傳 None，照常查詢）
+def etag(path: str, query: Iterable[Tuple[str, str]], scopes: List[str]) -> Optional[str]:
+    if not settings.ETAG_ENABLED:
+        return None
+    versions = current(scopes)
+    if versions is None:
+        return None
+    if db.replica is not None:
+        now = time.time()
+        if any(now - changed_at < settings.REPLICA_MAX_STALENESS_SECONDS for _, _, changed_at in versions):
+            return None
+    # 預設日期範圍以今天為準，日期改變時 ETag 也要改變
+    parts = [path, "&".join(f"{k}={v}" for k, v in sorted(query)), datetime.date.today().isoformat()]
+    parts += [f"{scope}:{epoch}:{version}" for scope, (epoch, version, _) in zip(scopes, versions)]
+    return '"' + hashlib.sha1("|".join(parts).encode("utf-8")).hexdigest()[:24] + '"'
+
+
+# 判斷 If-None-Match 是否與目前的 ETag 相符（弱比較）
+def matches(if_none_match: Optional[str], tag: Optional[str]) -> bool:
+    if not if_none_match or tag is None:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return any(candidate.strip().removeprefix("W/") == tag for candidate in if_none_match.split(","))
+
+
+# 回應的快取標頭（瀏覽器 / 代理每次都要帶 If-None-Match 重新驗證）
+def headers(tag: str) -> dict:
+    return {"ETag": tag, "Cache-Control": "no-cache"}
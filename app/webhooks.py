@@ -0,0 +1,121 @@
+"""
+Webhook 並行發送模組
+Teams / Slack / Discord 的通知可以送到員工各自設定的 Webhook URL（TB_EMPLOYEE_CONTACT 的 teams / slack / discord 欄位，
+同一個團隊頻道的員工填相同 URL 即可），未設定時使用全域的 TEAMS_URL / SLACK_URL / DISCORD_URL。
+
+- 相同 URL 與相同內容只發送一次
+- 每個主機各自一個 requests.Session（keep-alive 連線池，最多 WEBHOOK_POOL_SIZE 條連線），重複發送不必重新建立 TLS 連線
+- 每個推播通道各自一個執行緒池（同時發送的請求數各不超過 WEBHOOK_MAX_CONCURRENCY），
+  大量失敗的普通通知不會佔滿緊急通知的執行緒
+- 執行緒池只負責單次請求，重試前的退避在呼叫端（推播通道的 worker）等待，不佔用執行緒池
+"""
+import json
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+from app.settings import settings
+import app.constants as constants
+
+logger = logging.getLogger(__name__)
+
+HEADERS = {"Content-Type": "application/json"}
+
+_lock = threading.Lock()
+_sessions: Dict[str, requests.Session] = {}
+_executors: Dict[constants.Lane, ThreadPoolExecutor] = {}
+
+
+# 取得主機對應的 Session（第一次使用時建立）
+def session_for(url: str) -> requests.Session:
+    parts = urlsplit(url)
+    host = f"{parts.scheme}://{parts.netloc}"
+    session = _sessions.get(host)
+    if session is None:
+        with _lock:
+            session = _sessions.get(host)
+            if session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=settings.WEBHOOK_POOL_SIZE)
+                session.mount(host, adapter)
+                session.headers.update(HEADERS)
+                _sessions[host] = session
+    return session
+
+
+# 取得推播通道的執行緒池（第一次使用時建立）
+def _get_executor(lane: constants.Lane) -> ThreadPoolExecutor:
+    executor = _executors.get(lane)
+    if executor is None:
+        with _lock:
+            executor = _executors.get(lane)
+            if executor is None:
+                executor = ThreadPoolExecutor(max_workers=settings.WEBHOOK_MAX_CONCURRENCY, thread_name_prefix=f"webhook-{lane.value}")
+                _executors[lane] = executor
+    return executor
+
+
+# 發送單一 Webhook 一次，回傳 (是否成功, 錯誤訊息)
+def post(url: str, payload: Dict[str, Any]) -> Tuple[bool, Optional[str]]:
+    try:
+        r = session_for(url).post(url, json=payload, timeout=settings.WEBHOOK_TIMEOUT)
+        if r.status_code in [200, 204]:
+            return True, None
+        return False, f"狀態碼: {r.status_code}, 回應: {r.text}"
+    except requests.exceptions.RequestException as e:
+        return False, str(e)
+
+
+# 並行發送多個 Webhook（失敗時以指數退避重試），回傳與 targets 順序相同的 (是否成功, 錯誤訊息, 重試次數)
+def deliver(
+        targets: List[Tuple[str, Dict[str, Any]]],
+        max_retries: int = 3,
+        lane: constants.Lane = constants.Lane.LOW
+    ) -> List[Tuple[bool, Optional[str], int]]:
+    """相同 URL 且內容相同的只發送一次，結果共用；每一輪只重送失敗的目的地"""
+    keys = [(url, json.dumps(payload, sort_keys=True, ensure_ascii=False)) for url, payload in targets]
+    unique = dict(zip(keys, targets))
+    results: Dict[Tuple[str, str], Tuple[bool, Optional[str], int]] = {}
+    waiting = list(unique)
+    for attempt in range(max_retries):
+        if len(waiting) == 1:
+            # 只有一個目的地時直接在目前執行緒發送
+            outcomes = {waiting[0]: post(*unique[waiting[0]])}
+        else:
+            executor = _get_executor(lane)
+            futures = {key: executor.submit(post, *unique[key]) for key in waiting}
+            outcomes = {key: future.result() for key, future in futures.items()}
+        for key, (success, error_msg) in outcomes.items():
+            results[key] = (success, error_msg, attempt if success else max_retries)
+            if not success:
+                logger.error(f"Webhook 請求失敗 (嘗試 {attempt + 1}/{max_retries}): {urlsplit(key[0]).netloc} {error_msg}")
+        waiting = [key for key in waiting if not outcomes[key][0]]
+        if not waiting:
+            break
+        if attempt < max_retries - 1:
+            time.sleep(2 ** attempt)
+    return [results[key] for key in keys]
+
+
+def stats() -> Dict[str, Any]:
+    return {
+        "hosts": len(_sessions),
+        "max_concurrency": settings.WEBHOOK_MAX_CONCURRENCY,
+        "lanes": sorted(lane.value for lane in _executors),
+        "pool_size": settings.WEBHOOK_POOL_SIZE
+    }
+
+
+# 關閉連線池與執行緒池
+def shutdown() -> None:
+    with _lock:
+        for executor in _executors.values():
+            executor.shutdown(wait=True)
+        _executors.clear()
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
@@ -0,0 +1,384 @@
+"""
+熱點函數的微基準測試與效能回歸檢查
+以記憶體內的假資料庫、假 Redis 與假發送渠道執行下列函數，量測每次呼叫的時間與 Redis 往返次數：
+
+- makeFilter（建立查詢條件）
+- need_send / build_notification（通知門檻）
+- route_contacts / send_message（依 contactWay 位元遮罩分配渠道與整個發送流程）
+- Log 模型建立與序列化
+- _save_notification_history（新增與合併既有通知歷史）
+- 日誌 / 通知統計（串流彙總與 /notifications/statistics 的統計迴圈）
+- 重複日誌的寫入流程（ingest.process 次數快取命中：Redis 累加次數 → Top-K / 基數 / 時間序列）
+
+每項量測多輪，每輪緊接在固定純 Python 工作量（校準）之後執行，以兩者時間的比值取最小值作為分數，
+讓不同速度的機器可以共用同一份基準（baseline.json）；
+任何一項比基準慢超過容許比例（預設 25%），或 Redis 往返次數比基準多時以結束代碼 1 結束，可直接放在 CI 中執行。
+
+執行方式：
+    python -m benchmarks.bench_hot_paths
+    python -m benchmarks.bench_hot_paths --only send_message,route_contacts --tolerance 0.5
+    python -m benchmarks.bench_hot_paths --update-baseline
+"""
+import argparse
+import datetime
+import json
+import logging
+import os
+import sys
+import time
+from contextlib import ExitStack
+from types import SimpleNamespace
+from typing import Any, Callable, Dict, List, Optional
+from unittest import mock
+import fakeredis
+import app.aggregate as aggregate
+import app.archive as archive
+import app.constants as constants
+import app.counter as counter
+import app.database as db
+import app.ingest as ingest
+import app.main as main
+import app.message as msg
+import app.notification as notification
+import app.versions as versions
+from app.object import DBFilter, Log, Message
+from app.settings import settings
+from benchmarks.bench_serialization import make_log_rows, make_notification_rows
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "baseline.json")
+DEFAULT_TOLERANCE = 0.25
+
+
+class FakeQuery:
+    """記憶體內的 Supabase 查詢：支援串接條件、id 分頁（gt + limit）、新增與更新"""
+
+    def __init__(self, table: "FakeTable"):
+        self.table = table
+        self.after_id: Optional[int] = None
+        self.size: Optional[int] = None
+        self.payload: Optional[Dict[str, Any]] = None
+
+    def select(self, *args, **kwargs) -> "FakeQuery":
+        return self
+
+    def eq(self, *args) -> "FakeQuery":
+        return self
+
+    def gte(self, *args) -> "FakeQuery":
+        return self
+
+    def lte(self, *args) -> "FakeQuery":
+        return self
+
+    def filter(self, *args) -> "FakeQuery":
+        return self
+
+    def order(self, *args, **kwargs) -> "FakeQuery":
+        return self
+
+    def range(self, *args) -> "FakeQuery":
+        return self
+
+    def gt(self, column: str, value: Any) -> "FakeQuery":
+        self.after_id = value
+        return self
+
+    def limit(self, size: int) -> "FakeQuery":
+        self.size = size
+        return self
+
+    def insert(self, data: Dict[str, Any]) -> "FakeQuery":
+        self.payload = data
+        return self
+
+    def update(self, data: Dict[str, Any]) -> "FakeQuery":
+        self.payload = data
+        return self
+
+    def execute(self) -> SimpleNamespace:
+        if self.payload is not None:
+            self.table.writes += 1
+            return SimpleNamespace(data=[{"id": 1, **self.payload}])
+        rows = self.table.rows
+        if self.after_id is not None:
+            rows = [row for row in rows if row["id"] > self.after_id]
+        if self.size is not None:
+            rows = rows[:self.size]
+        return SimpleNamespace(data=rows)
+
+
+class FakeTable:
+    def __init__(self, rows: List[Dict[str, Any]]):
+        self.rows = rows
+        self.writes = 0
+
+
+class FakeSupabase:
+    def __init__(self, tables: Dict[str, List[Dict[str, Any]]]):
+        self.tables = {name: FakeTable(rows) for name, rows in tables.items()}
+
+    def table(self, name: str) -> FakeQuery:
+        return FakeQuery(self.tables.setdefault(name, FakeTable([])))
+
+
+class CountingRedis:
+    """記憶體內的 Redis，計算送出的次數（一個指令或一整個 pipeline 為一次往返）"""
+
+    def __init__(self, stack: ExitStack):
+        self.client = fakeredis.FakeRedis(decode_responses=True)
+        self.round_trips = 0
+        connection_class = self.client.connection_pool.connection_class
+        send = connection_class.send_packed_command
+
+        def counted(connection, *args, **kwargs):
+            self.round_trips += 1
+            return send(connection, *args, **kwargs)
+
+        stack.enter_context(mock.patch.object(connection_class, "send_packed_command", counted))
+
+
+def make_log() -> Log:
+    return Log(
+        id=1, riskLevel=1, type=1, location="API-1", function="UserService.login",
+        log="連線失敗: timeout after 30s", employees=["emp001", "emp002"],
+        date=datetime.date(2025, 1, 2), time=datetime.time(10, 0), count=7
+    )
+
+
+def make_contacts(n: int) -> List[Dict[str, Any]]:
+    """各種 contactWay 組合的員工聯絡資訊"""
+    return [
+        {"no": f"emp{i:03d}", "contactWay": i % 64, "email": f"emp{i:03d}@example.com", "phone": f"09{i:08d}"}
+        for i in range(n)
+    ]
+
+
+def build_benchmarks(stack: ExitStack, redis: CountingRedis) -> Dict[str, Callable[[], Any]]:
+    """建立各項基準測試（以 stack 掛上假資料庫、假 Redis 與假發送渠道，結束時還原）"""
+    log_rows = make_log_rows(5000)
+    for row in log_rows:
+        row["id"] += 1
+    contacts = make_contacts(50)
+    fake = FakeSupabase({
+        "TB_LOGS": log_rows[:1],
+        "TB_EMPLOYEE_CONTACT": contacts,
+        "TB_NOTIFICATION_HISTORY": []
+    })
+    stack.enter_context(mock.patch.object(db, "supabase", fake))
+    stack.enter_context(mock.patch.object(archive, "covers", lambda table, date_from: False))
+    stack.enter_context(mock.patch.object(db, "r", redis.client))
+    # 資料版本的累加不在重複日誌的寫入流程中（只在資料庫寫入後），基準測試不計入
+    stack.enter_context(mock.patch.object(versions, "bump", lambda scope: None))
+    # 次數快取的 Lua 腳本在匯入時已註冊到原本的 Redis，改註冊到假 Redis
+    for name in ("_HIT_SCRIPT", "_SEED_SCRIPT"):
+        stack.enter_context(mock.patch.object(counter, name, redis.client.register_script(getattr(counter, name).script)))
+    stack.enter_context(mock.patch.object(settings, "COUNTER_COALESCE_ENABLED", True))
+    # 發送渠道只保存通知歷史，不連線外部服務
+    def send(*args, log_id=None, **kwargs):
+        return notification._save_notification_history(notification.NotificationHistory(
+            log_id=log_id, recipient="bench", message="ok", status=constants.STATUS_SUCCESS
+        ))
+    for name in ("send_email", "send_line", "send_webhooks", "sms"):
+        stack.enter_context(mock.patch.object(msg, name, send))
+
+    filters = [
+        DBFilter(name="riskLevel", operator=db.Opreator.EQUAL, values=["1"]),
+        DBFilter(name="location", operator=db.Opreator.ILIKE, values=["%API%"]),
+        DBFilter(name="date", operator=db.Opreator.GREATER_OR_EQUAL, values=["2025-01-01"]),
+        DBFilter(name="date", operator=db.Opreator.LESS_OR_EQUAL, values=["2025-01-31"]),
+        DBFilter(name="id", operator=db.Opreator.IN.value, values=[str(i) for i in range(20)])
+    ]
+    log = make_log()
+    payload = log.model_dump(mode="json")
+    message = Message(title="系統通知", body="位置:API-1", employees=[c["no"] for c in contacts], risk_level=1)
+    history = notification.NotificationHistory(log_id=1, recipient="emp001@example.com", message="ok", status=constants.STATUS_SUCCESS)
+    existing = [{"id": 9, "log_id": 1, "recipient": "emp001@example.com", "message": "old", "status": 2, "retry_count": 1}]
+    notification_rows = make_notification_rows(5000)
+    logs_table = fake.tables["TB_LOGS"]
+    history_table = fake.tables["TB_NOTIFICATION_HISTORY"]
+
+    def save_history_insert():
+        history_table.rows = []
+        notification._save_notification_history(history.model_copy())
+
+    def save_history_merge():
+        history_table.rows = existing
+        notification._save_notification_history(history.model_copy(update={"status": constants.STATUS_FAILED}))
+
+    def log_statistics():
+        logs_table.rows = log_rows
+        aggregate.aggregate(
+            aggregate.log_chunks(datetime.date(2025, 1, 1), datetime.date(2025, 1, 31), [], ["riskLevel", "location", "function", "count"]),
+            [aggregate.Aggregation(["riskLevel"]), aggregate.Aggregation(["location"]), aggregate.Aggregation(["function"])]
+        )
+
+    def notification_statistics():
+        history_table.rows = notification_rows
+        main.get_notification_statistics(datetime.date(2025, 1, 1), datetime.date(2025, 1, 31))
+
+    # 重複日誌：次數快取已建立，通知流程另由 send_message 量測
+    redis.client.hset(counter.KEY_PREFIX + log.fingerprint(), mapping={
+        "id": log.id, "riskLevel": log.riskLevel, "employees": json.dumps(log.employees), "total": log.count, "pending": 0
+    })
+    stack.enter_context(mock.patch.object(db, "notify_log", lambda stored, created, increment=1: None))
+
+    return {
+        "make_filter": lambda: db.makeFilter(FakeQuery(logs_table), filters),
+        "need_send": lambda: db.need_send(log),
+        "build_notification": lambda: db.build_notification(log, False),
+        "route_contacts": lambda: msg.route_contacts(contacts),
+        "send_message": lambda: msg.send_message(message, 1),
+        "log_construct": lambda: Log(**payload),
+        "log_serialize": lambda: log.model_dump_json(),
+        "save_history_insert": save_history_insert,
+        "save_history_merge": save_history_merge,
+        "log_statistics_5000": log_statistics,
+        "notification_statistics_5000": notification_statistics,
+        "ingest_hit": lambda: ingest.process(log)
+    }
+
+
+# 固定的純 Python 工作量，用來換算不同機器的速度
+def _calibration_work():
+    total = 0
+    data = {}
+    for i in range(2000):
+        data[i % 97] = data.get(i % 97, 0) + i
+        total += len(str(i))
+    return total
+
+
+def _calls_for(fn: Callable[[], Any], min_time: float) -> int:
+    """每輪需要的呼叫次數（至少執行 min_time 秒）"""
+    fn()
+    calls = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(calls):
+            fn()
+        if time.perf_counter() - start >= min_time:
+            return calls
+        calls *= 2
+
+
+def _timed(fn: Callable[[], Any], calls: int) -> float:
+    start = time.perf_counter()
+    for _ in range(calls):
+        fn()
+    return (time.perf_counter() - start) / calls * 1e6
+
+
+def measure(fn: Callable[[], Any], rounds: int = 15, min_time: float = 0.02) -> Dict[str, float]:
+    """
+    每輪先執行校準工作量再執行待測函數，以相鄰兩次量測的比值作為相對分數
+    （同一時段的 CPU 頻率與負載相近），回傳各輪最小的微秒數與分數
+    """
+    calls = _calls_for(fn, min_time)
+    calibration_calls = _calls_for(_calibration_work, min_time)
+    best_us = best_score = None
+    for _ in range(rounds):
+        calibration_us = _timed(_calibration_work, calibration_calls)
+        us = _timed(fn, calls)
+        score = us / calibration_us
+        best_us = us if best_us is None else min(best_us, us)
+        best_score = score if best_score is None else min(best_score, score)
+    return {"us": round(best_us, 3), "score": round(best_score, 6)}
+
+
+def run(only: Optional[List[str]] = None, rounds: int = 15) -> Dict[str, Any]:
+    """執行基準測試，回傳各項的微秒數、相對分數（微秒 / 校準工作量的微秒數）與每次呼叫的 Redis 往返次數"""
+    results = {}
+    with ExitStack() as stack:
+        redis = CountingRedis(stack)
+        benchmarks = build_benchmarks(stack, redis)
+        for name, fn in benchmarks.items():
+            if only and name not in only:
+                continue
+            results[name] = measure(fn, rounds)
+            # 量測後再呼叫一次計算往返次數（連線建立與腳本載入等一次性的往返不計入）
+            before = redis.round_trips
+            fn()
+            results[name]["round_trips"] = redis.round_trips - before
+    return {"results": results}
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[Dict[str, Any]]:
+    """
+    依相對分數比較基準，回傳每項的變化比例與是否超過容許範圍；
+    Redis 往返次數與機器速度無關，比基準多就視為回歸
+    """
+    rows = []
+    for name, result in current["results"].items():
+        base = baseline.get("results", {}).get(name)
+        round_trips = result.get("round_trips")
+        if base is None:
+            rows.append({"name": name, "us": result["us"], "round_trips": round_trips, "change": None, "regressed": False})
+            continue
+        change = result["score"] / base["score"] - 1
+        more_round_trips = round_trips is not None and round_trips > base.get("round_trips", round_trips)
+        rows.append({
+            "name": name, "us": result["us"], "round_trips": round_trips, "change": change,
+            "regressed": change > tolerance or more_round_trips
+        })
+    return rows
+
+
+def load_baseline(path: str = BASELINE_PATH) -> Optional[Dict[str, Any]]:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def save_baseline(current: Dict[str, Any], path: str = BASELINE_PATH) -> None:
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(current, f, ensure_ascii=False, indent=2, sort_keys=True)
+        f.write("\n")
+
+
+def main_cli(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="熱點函數微基準測試與效能回歸檢查")
+    parser.add_argument("--only", help="只執行指定項目（以逗號分隔）")
+    parser.add_argument("--rounds", type=int, default=15, help="每項量測輪數")
+    parser.add_argument("--tolerance", type=float, default=float(os.environ.get("BENCH_TOLERANCE", DEFAULT_TOLERANCE)),
+                        help="容許的變慢比例（預設 0.25 即 25%%，也可用環境變數 BENCH_TOLERANCE）")
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="基準檔路徑")
+    parser.add_argument("--update-baseline", action="store_true", help="以本次結果更新基準檔")
+    args = parser.parse_args(argv)
+
+    logging.disable(logging.WARNING)
+    only = [name.strip() for name in args.only.split(",")] if args.only else None
+    current = run(only, args.rounds)
+
+    if args.update_baseline:
+        baseline = load_baseline(args.baseline) or {"results": {}}
+        if only:
+            # 只更新本次執行的項目（分數與機器速度無關，可與其他項目的基準共用）
+            baseline["results"].update(current["results"])
+            current = baseline
+        save_baseline(current, args.baseline)
+        print(f"已更新基準檔: {args.baseline}")
+        return 0
+
+    baseline = load_baseline(args.baseline)
+    if baseline is None:
+        print(f"找不到基準檔 {args.baseline}，請先以 --update-baseline 建立")
+        return 1
+
+    rows = compare(current, baseline, args.tolerance)
+    print(f"{'benchmark':<32}{'us/call':>12}{'redis':>8}{'change':>10}")
+    for row in rows:
+        change = "new" if row["change"] is None else f"{row['change']:+.1%}"
+        flag = "  REGRESSED" if row["regressed"] else ""
+        round_trips = "-" if row["round_trips"] is None else str(row["round_trips"])
+        print(f"{row['name']:<32}{row['us']:>12.2f}{round_trips:>8}{change:>10}{flag}")
+    regressed = [row["name"] for row in rows if row["regressed"]]
+    if regressed:
+        print(f"效能回歸（超過 {args.tolerance:.0%} 或 Redis 往返次數增加）: {', '.join(regressed)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
@@ -0,0 +1,131 @@
+"""
+序列化效能比較：預設回應流程 vs FastJSONResponse
+分別以 100 / 500 筆資料模擬 /logs/list 與 /notifications/history 一頁的回應，
+量測每頁回應的 CPU 時間（time.process_time）。
+
+執行方式：
+    python -m benchmarks.bench_serialization
+"""
+import datetime
+import time
+from typing import Any, Callable, Dict, List
+from fastapi import FastAPI
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from fastapi.testclient import TestClient
+from pydantic import TypeAdapter
+from app.responses import FastJSONResponse
+
+
+def make_log_rows(n: int) -> List[Dict[str, Any]]:
+    """模擬 Supabase 回傳的 TB_LOGS 資料列"""
+    today = datetime.date.today()
+    return [
+        {
+            "id": i,
+            "riskLevel": i % 4,
+            "type": 1,
+            "location": f"API-{i % 17}",
+            "function": f"UserService.method_{i % 23}",
+            "log": f"連線失敗: timeout after 30s (request {i})",
+            "employees": ["emp001", "emp002"],
+            "date": (today - datetime.timedelta(days=i % 7)).isoformat(),
+            "time": "14:30:00",
+            "count": i % 50 + 1,
+            "created_at": "2024-12-07T14:30:00.123456",
+            "fingerprint": f"{i:032x}"
+        }
+        for i in range(n)
+    ]
+
+
+def make_notification_rows(n: int) -> List[Dict[str, Any]]:
+    """模擬 Supabase 回傳的 TB_NOTIFICATION_HISTORY 資料列"""
+    return [
+        {
+            "id": i,
+            "log_id": i // 3,
+            "channel": "Email",
+            "recipient": f"user{i}@example.com",
+            "message": f"Email 已發送！收件者: user{i}@example.com",
+            "status": 1,
+            "error_message": None,
+            "retry_count": 0,
+            "sent_at": "2024-12-07T14:30:00.123456",
+            "created_at": "2024-12-07T14:30:00.123456"
+        }
+        for i in range(n)
+    ]
+
+
+def build_app(rows: List[Dict[str, Any]]) -> FastAPI:
+    """兩個 endpoint 回傳相同內容，只差在回應流程"""
+    app = FastAPI()
+
+    def page() -> Dict[str, Any]:
+        return {"status": "success", "data": rows, "count": len(rows), "limit": len(rows), "offset": 0}
+
+    @app.get("/default", response_model=Dict[str, Any])
+    def default() -> Dict[str, Any]:
+        return page()
+
+    @app.get("/fast", response_class=FastJSONResponse)
+    def fast():
+        return FastJSONResponse(page())
+
+    return app
+
+
+def cpu_per_call(fn: Callable[[], Any], repeat: int) -> float:
+    """回傳每次呼叫的平均 CPU 毫秒數"""
+    fn()
+    start = time.process_time()
+    for _ in range(repeat):
+        fn()
+    return (time.process_time() - start) / repeat * 1000
+
+
+_page_adapter = TypeAdapter(Dict[str, Any])
+
+
+def default_render(payload: Dict[str, Any]) -> bytes:
+    """預設流程：依 response_model 驗證 → jsonable_encoder → 標準庫 json"""
+    return JSONResponse(jsonable_encoder(_page_adapter.validate_python(payload))).body
+
+
+def fast_render(payload: Dict[str, Any]) -> bytes:
+    return FastJSONResponse(payload).body
+
+
+def run(repeat: int = 200) -> List[Dict[str, Any]]:
+    """
+    serialize: 只量測序列化本身（不含 HTTP），預設流程為 jsonable_encoder 版本的 FastAPI 行為
+    request: 透過 TestClient 完整走一次 HTTP 請求（使用目前安裝的 FastAPI 版本）
+    """
+    results = []
+    for name, factory in [("/logs/list", make_log_rows), ("/notifications/history", make_notification_rows)]:
+        for size in (100, 500):
+            rows = factory(size)
+            payload = {"status": "success", "data": rows, "count": size, "limit": size, "offset": 0}
+            client = TestClient(build_app(rows))
+            for mode, default_fn, fast_fn in [
+                ("serialize", lambda: default_render(payload), lambda: fast_render(payload)),
+                ("request", lambda: client.get("/default"), lambda: client.get("/fast")),
+            ]:
+                default_ms = cpu_per_call(default_fn, repeat)
+                fast_ms = cpu_per_call(fast_fn, repeat)
+                results.append({
+                    "endpoint": name,
+                    "rows": size,
+                    "mode": mode,
+                    "default_ms": round(default_ms, 3),
+                    "fast_ms": round(fast_ms, 3),
+                    "saved_ms": round(default_ms - fast_ms, 3)
+                })
+    return results
+
+
+if __name__ == "__main__":
+    print(f"{'endpoint':<24}{'rows':>6}{'mode':>11}{'default(ms)':>14}{'fast(ms)':>12}{'saved(ms)':>12}")
+    for row in run():
+        print(f"{row['endpoint']:<24}{row['rows']:>6}{row['mode']:>11}{row['default_ms']:>14}{row['fast_ms']:>12}{row['saved_ms']:>12}")
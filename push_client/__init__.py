@@ -0,0 +1,6 @@
+"""
+Push System 嵌入式客戶端（本機合併 + gzip 批次發送）
+"""
+from push_client.client import PushClient
+
+__all__ = ["PushClient"]
@@ -0,0 +1,236 @@
+"""
+Push System 嵌入式客戶端
+在服務內以背景執行緒緩衝日誌，相同 (location, function, log) 先在本機合併成次數，
+再以 gzip 壓縮的批次送到 POST /logs/batch，取代每筆事件呼叫一次 GET /logs。
+
+- 記憶體上限：最多保留 max_pending 個不同的日誌，超過時丟棄最舊的一筆
+- 發送失敗（連線錯誤、5xx、429）依指數退避重試，每個批次帶固定的 Idempotency-Key，重試不會重複計數
+- 重試後仍送不出去的批次連同冪等鍵保留，之後原封不動重送（不與新的日誌合併），伺服器已處理過時不會再計數一次
+- 緊急日誌（riskLevel >= 3）在呼叫端同步送出，不等待背景批次；失敗時才交給背景重送
+
+使用方式：
+    client = PushClient("http://localhost:8000", employees=["emp001"])
+    client.log(2, "API", "UserService", "連線失敗")
+    client.close()
+"""
+import datetime
+import gzip
+import json
+import logging
+import threading
+import uuid
+from collections import OrderedDict, deque
+from typing import Any, Dict, List, Optional, Tuple
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+RISK_LEVEL_EMERGENCY = 3
+# 伺服器單一批次的筆數上限
+MAX_BATCH_SIZE = 1000
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+
+class PushClient:
+    """背景批次發送的日誌客戶端（可在多個執行緒共用）"""
+
+    def __init__(
+            self,
+            base_url: str,
+            employees: Optional[List[str]] = None,
+            flush_interval: float = 1.0,
+            batch_size: int = 500,
+            max_pending: int = 10000,
+            max_retries: int = 5,
+            backoff: float = 0.5,
+            timeout: float = 5.0,
+            session: Optional[requests.Session] = None
+        ):
+        self.url = base_url.rstrip("/") + "/logs/batch"
+        self.employees = list(employees or [])
+        self.flush_interval = flush_interval
+        self.batch_size = min(batch_size, MAX_BATCH_SIZE)
+        self.max_pending = max_pending
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.session = session or requests.Session()
+        self._pending: "OrderedDict[Tuple[str, str, str], Dict[str, Any]]" = OrderedDict()
+        # 送出結果不明的批次 (冪等鍵, 批次)，重送時沿用原本的冪等鍵
+        self._unsent: "deque[Tuple[str, List[Dict[str, Any]]]]" = deque()
+        self._lock = threading.Lock()
+        self._send_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._closed = threading.Event()
+        self.sent = 0
+        self.dropped = 0
+        self._thread = threading.Thread(target=self._run, name="push-client", daemon=True)
+        self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # 記錄一筆日誌，緊急日誌同步送出並回傳是否送達，其他日誌排入緩衝區後回傳 True
+    def log(
+            self,
+            risk_level: int,
+            location: str,
+            function: str,
+            message: str,
+            employees: Optional[List[str]] = None,
+            type: int = 0
+        ) -> bool:
+        now = datetime.datetime.now()
+        entry = {
+            "riskLevel": risk_level,
+            "type": type,
+            "location": location,
+            "function": function,
+            "log": message,
+            "employees": list(employees) if employees is not None else self.employees,
+            "date": now.date().isoformat(),
+            "time": now.time().replace(microsecond=0).isoformat(),
+            "count": 1
+        }
+        if risk_level >= RISK_LEVEL_EMERGENCY:
+            # 同步只重試一次，避免阻塞呼叫端太久；失敗時由背景以相同的冪等鍵重送
+            return self._ship([entry], retries=1)
+        self._add([entry])
+        return True
+
+    # 本機合併：相同日誌只累加次數（風險等級取最高），超過上限時丟棄最舊的日誌
+    def _add(self, entries: List[Dict[str, Any]]):
+        with self._lock:
+            for entry in entries:
+                key = (entry["location"], entry["function"], entry["log"])
+                pending = self._pending.get(key)
+                if pending is None:
+                    self._pending[key] = dict(entry)
+                else:
+                    pending["count"] += entry["count"]
+                    pending["riskLevel"] = max(pending["riskLevel"], entry["riskLevel"])
+            while len(self._pending) > self.max_pending:
+                _, oldest = self._pending.popitem(last=False)
+                self.dropped += oldest["count"]
+            if len(self._pending) >= self.batch_size:
+                self._wakeup.set()
+
+    # 保留送不出去的批次與冪等鍵（超過上限時丟棄最舊的批次）
+    def _hold(self, key: str, batch: List[Dict[str, Any]]):
+        with self._lock:
+            self._unsent.append((key, batch))
+            while sum(len(held) for _, held in self._unsent) > self.max_pending:
+                _, oldest = self._unsent.popleft()
+                self.dropped += sum(entry["count"] for entry in oldest)
+
+    # 取出下一個要送出的批次，回傳 (冪等鍵, 批次)；先重送結果不明的批次（沿用冪等鍵），新的批次冪等鍵為 None
+    def _take(self) -> Tuple[Optional[str], List[Dict[str, Any]]]:
+        with self._lock:
+            if self._unsent:
+                return self._unsent.popleft()
+            batch = []
+            while self._pending and len(batch) < self.batch_size:
+                batch.append(self._pending.popitem(last=False)[1])
+            return None, batch
+
+    def pending(self) -> int:
+        with self._lock:
+            return len(self._pending) + sum(len(batch) for _, batch in self._unsent)
+
+    # 發送一個批次（含重試），回傳是否全部送達；requeue 時送不出去的批次連同冪等鍵保留，被伺服器拒絕的項目放回緩衝區
+    def _ship(self, batch: List[Dict[str, Any]], retries: Optional[int] = None, requeue: bool = True, key: Optional[str] = None) -> bool:
+        body = gzip.compress(json.dumps({"logs": batch}, ensure_ascii=False).encode("utf-8"))
+        # 同一批次的重試（包含之後重送）使用相同的冪等鍵，伺服器已處理過時直接回傳第一次的結果
+        key = key or uuid.uuid4().hex
+        headers = {
+            "Content-Type": "application/json",
+            "Content-Encoding": "gzip",
+            "Idempotency-Key": key
+        }
+        retries = self.max_retries if retries is None else retries
+        delay = self.backoff
+        for attempt in range(retries + 1):
+            if attempt:
+                # 關閉中不再等待退避
+                self._closed.wait(delay)
+                delay *= 2
+            try:
+                response = self.session.post(self.url, data=body, headers=headers, timeout=self.timeout)
+            except requests.RequestException as e:
+                logger.warning(f"發送日誌批次失敗（第 {attempt + 1} 次）: {e}")
+                continue
+            if response.status_code == 200:
+                return self._settle(batch, response.json().get("results", []), requeue)
+            if response.status_code not in RETRY_STATUS:
+                logger.error(f"日誌批次被拒絕，已丟棄 {len(batch)} 筆: {response.status_code} {response.text[:200]}")
+                self._drop(batch)
+                return False
+            delay = max(delay, float(response.headers.get("Retry-After") or 0))
+        if requeue:
+            self._hold(key, batch)
+        else:
+            self._drop(batch)
+        return False
+
+    def _settle(self, batch: List[Dict[str, Any]], results: List[str], requeue: bool) -> bool:
+        retry = [entry for entry, status in zip(batch, results) if status in ("rejected", "failed")]
+        with self._lock:
+            self.sent += sum(entry["count"] for entry in batch) - sum(entry["count"] for entry in retry)
+        if not retry:
+            return True
+        if requeue:
+            self._add(retry)
+        else:
+            self._drop(retry)
+        return False
+
+    def _drop(self, entries: List[Dict[str, Any]]):
+        with self._lock:
+            self.dropped += sum(entry["count"] for entry in entries)
+
+    # 立即送出緩衝區內所有日誌，回傳是否全部送達（送不出去的日誌留在緩衝區）
+    def flush(self) -> bool:
+        with self._send_lock:
+            while True:
+                key, batch = self._take()
+                if not batch:
+                    return True
+                if not self._ship(batch, key=key):
+                    return False
+
+    def _run(self):
+        while not self._closed.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            if self._closed.is_set():
+                break
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"背景發送日誌時發生錯誤: {e}", exc_info=True)
+
+    # 停止背景執行緒並盡量送出剩餘的日誌
+    def close(self, timeout: float = 10.0):
+        if self._closed.is_set():
+            return
+        self._closed.set()
+        self._wakeup.set()
+        self._thread.join(timeout=timeout)
+        with self._send_lock:
+            key, batch = self._take()
+            while batch:
+                self._ship(batch, retries=1, requeue=False, key=key)
+                key, batch = self._take()
+        self.session.close()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "sent": self.sent,
+                "dropped": self.dropped,
+                "pending": len(self._pending) + sum(len(batch) for _, batch in self._unsent)
+            }
@@ -1,2 +1,13 @@
 import sys, os
-sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
\ No newline at end of file
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import fakeredis
+import pytest
+
+
+@pytest.fixture
+def redis(monkeypatch):
+    """以記憶體內的 Redis（支援 Lua 腳本）取代 app.database.r"""
+    import app.database as db
+    fake = fakeredis.FakeRedis(decode_responses=True)
+    monkeypatch.setattr(db, "r", fake)
+    return fake
@@ -0,0 +1,42 @@
+import datetime
+import app.admission as admission
+import app.main as main
+import app.sharding as sharding
+from app.object import Log
+from app.settings import settings
+
+
+def test_db_latency_decays_without_samples(monkeypatch):
+    """測試資料庫延遲尖峰之後沒有新樣本時，准入狀態會隨時間恢復"""
+    monkeypatch.setattr(admission, "_db_latency_ms", 0.0)
+    monkeypatch.setattr(admission, "_db_latency_at", 0.0)
+    monkeypatch.setattr(settings, "ADMISSION_DB_LATENCY_HALF_LIFE_SECONDS", 5.0)
+    admission.record_db_latency(5000)
+    assert admission.state() == admission.STATE_CRITICAL
+    # 模擬 60 秒內沒有任何資料庫呼叫
+    monkeypatch.setattr(admission, "_db_latency_at", admission._db_latency_at - 60)
+    assert admission.db_latency() < 10
+    assert admission.state() == admission.STATE_NORMAL
+    # 新樣本以衰減後的值為基準計算移動平均
+    admission.record_db_latency(100)
+    assert admission.db_latency() < 100
+
+
+def test_sharded_requests_count_as_inflight(monkeypatch):
+    """測試排入分片佇列的請求也計入進行中的請求數"""
+    seen = []
+
+    def submit(log, increment=1):
+        seen.append(admission._inflight)
+        return "shard-0"
+
+    monkeypatch.setattr(settings, "SHARDING_ENABLED", True)
+    monkeypatch.setattr(sharding, "submit", submit)
+    before = admission._inflight
+    item = Log(
+        riskLevel=3, type=1, location="API", function="UserService", log="連線失敗", employees=[],
+        date=datetime.date(2025, 1, 2), time=datetime.time(10, 0)
+    )
+    assert main._record_log(item)["status"] == "queued"
+    assert seen == [before + 1]
+    assert admission._inflight == before
@@ -0,0 +1,121 @@
+import datetime
+import app.archive as archive
+import app.database as db
+from app.object import DBFilter
+
+
+class FakeQuery:
+    """模擬 supabase 查詢鏈，只支援封存用到的 lt / gt / in_ / order / limit"""
+
+    def __init__(self, rows):
+        self.rows = rows
+
+    def select(self, *args):
+        return self
+
+    def lt(self, column, value):
+        return FakeQuery([row for row in self.rows if str(row[column]) < value])
+
+    def gt(self, column, value):
+        return FakeQuery([row for row in self.rows if row[column] > value])
+
+    def in_(self, column, values):
+        return FakeQuery([row for row in self.rows if str(row[column]) in values])
+
+    def order(self, column):
+        return FakeQuery(sorted(self.rows, key=lambda row: row[column]))
+
+    def limit(self, n):
+        return FakeQuery(self.rows[:n])
+
+    def execute(self):
+        return type("Result", (), {"data": self.rows})()
+
+
+def _setup(tmp_path, monkeypatch, tables, batch_size=1):
+    """以記憶體中的資料表取代 supabase，回傳被清除次數快取的 (fingerprint, id)"""
+    monkeypatch.setattr(archive.settings, "ARCHIVE_DIR", str(tmp_path))
+    monkeypatch.setattr(archive.settings, "ARCHIVE_BATCH_SIZE", batch_size)
+    monkeypatch.setattr(db.supabase, "table", lambda name: FakeQuery(tables[name]))
+
+    def fake_delete(name, filters):
+        ids = set(filters[0].values)
+        tables[name][:] = [row for row in tables[name] if str(row["id"]) not in ids]
+        return True
+
+    monkeypatch.setattr(db, "delete", fake_delete)
+    invalidated = []
+    monkeypatch.setattr(archive.counter, "invalidate", lambda fingerprint, log_id: invalidated.append((fingerprint, log_id)) or True)
+    return invalidated
+
+
+def _log(id, date, last_seen=None, time="10:00:00", **columns):
+    return {
+        "id": id, "riskLevel": 1, "location": "API", "function": "Login", "date": date.isoformat(), "time": time,
+        "last_seen": (last_seen or date).isoformat(), "fingerprint": f"fp{id}", **columns
+    }
+
+
+def test_archive_and_read_back(tmp_path, monkeypatch):
+    """測試封存後從熱資料表刪除，並可依日期範圍與篩選條件讀回"""
+    today = datetime.date.today()
+    old = today - datetime.timedelta(days=100)
+    logs = [
+        _log(1, old),
+        _log(2, old, time="11:00:00", riskLevel=2, location="Batch", function="Job"),
+        _log(3, today, time="09:00:00"),
+    ]
+    invalidated = _setup(tmp_path, monkeypatch, {"TB_LOGS": logs, "TB_NOTIFICATION_HISTORY": []})
+
+    assert archive.archive_table("TB_LOGS", 90) == 2
+    assert [row["id"] for row in logs] == [3]
+    assert invalidated == [("fp1", 1), ("fp2", 2)]
+    assert archive.load_manifest("TB_LOGS")["partitions"][old.isoformat()]["rows"] == 2
+    assert archive.covers("TB_LOGS", old)
+    assert not archive.covers("TB_LOGS", today)
+
+    archived = list(archive.read_archived("TB_LOGS", old, today))
+    assert [row["id"] for row in archived] == [2, 1]
+    filters = [DBFilter(name="location", operator=db.Opreator.ILIKE, values=["%ap%"])]
+    assert [row["id"] for row in archive.read_archived("TB_LOGS", old, today, filters)] == [1]
+
+    page = archive.merge_page(logs, iter(archived), lambda row: (row["date"], row["time"]), limit=2, offset=1)
+    assert [row["id"] for row in page] == [2, 1]
+
+
+def test_archive_keeps_recurring_logs_and_logs_with_history(tmp_path, monkeypatch):
+    """測試仍在發生的日誌與仍有通知歷史的日誌不封存，通知歷史封存後日誌才封存"""
+    today = datetime.date.today()
+    old = today - datetime.timedelta(days=100)
+    logs = [_log(1, old), _log(2, old, last_seen=today), _log(3, old)]
+    history = [
+        {"id": 1, "log_id": 3, "sent_at": today.isoformat()},
+        {"id": 2, "log_id": 3, "sent_at": old.isoformat()},
+    ]
+    tables = {"TB_LOGS": logs, "TB_NOTIFICATION_HISTORY": history}
+    _setup(tmp_path, monkeypatch, tables)
+
+    assert archive.archive_table("TB_LOGS", 90) == 1
+    assert [row["id"] for row in logs] == [2, 3]
+    assert archive.archive_table("TB_NOTIFICATION_HISTORY", 90) == 1
+    history[:] = []
+    assert archive.archive_table("TB_LOGS", 90) == 1
+    assert [row["id"] for row in logs] == [2]
+
+
+def test_rerun_after_failed_delete_has_no_duplicates(tmp_path, monkeypatch):
+    """測試刪除失敗後重新封存，讀取時同一筆資料只出現一次（以較新的內容為準）"""
+    old = datetime.date.today() - datetime.timedelta(days=100)
+    logs = [_log(1, old, count=1), _log(2, old, count=1)]
+    _setup(tmp_path, monkeypatch, {"TB_LOGS": logs, "TB_NOTIFICATION_HISTORY": []}, batch_size=10)
+    deleted = db.delete
+    monkeypatch.setattr(db, "delete", lambda name, filters: None)
+    assert archive.archive_table("TB_LOGS", 90) == 0
+    assert len(logs) == 2
+
+    logs[0]["count"] = 5
+    monkeypatch.setattr(db, "delete", deleted)
+    assert archive.archive_table("TB_LOGS", 90) == 2
+    archived = list(archive.read_archived("TB_LOGS", old, old))
+    assert sorted(row["id"] for row in archived) == [1, 2]
+    assert {row["id"]: row["count"] for row in archived}[1] == 5
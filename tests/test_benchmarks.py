@@ -0,0 +1,29 @@
+from benchmarks.bench_hot_paths import compare, run
+
+
+def test_compare_flags_regressions_beyond_tolerance():
+    """測試依相對分數比較基準，超過容許比例才視為效能回歸"""
+    baseline = {"results": {"fast": {"us": 1.0, "score": 0.010}, "slow": {"us": 1.0, "score": 0.010}}}
+    current = {"results": {
+        "fast": {"us": 1.2, "score": 0.012},
+        "slow": {"us": 1.5, "score": 0.015},
+        "new": {"us": 3.0, "score": 0.030}
+    }}
+    rows = {row["name"]: row for row in compare(current, baseline, tolerance=0.25)}
+    assert rows["fast"]["regressed"] is False
+    assert rows["slow"]["regressed"] is True
+    assert round(rows["slow"]["change"], 2) == 0.5
+    assert rows["new"]["change"] is None and rows["new"]["regressed"] is False
+
+
+def test_compare_flags_more_redis_round_trips():
+    """測試 Redis 往返次數比基準多時視為效能回歸（與機器速度無關）"""
+    baseline = {"results": {"ingest": {"us": 1.0, "score": 0.010, "round_trips": 2}}}
+    assert not compare({"results": {"ingest": {"us": 1.0, "score": 0.010, "round_trips": 2}}}, baseline, 0.25)[0]["regressed"]
+    assert compare({"results": {"ingest": {"us": 1.0, "score": 0.010, "round_trips": 3}}}, baseline, 0.25)[0]["regressed"]
+
+
+def test_repeated_log_uses_two_redis_round_trips():
+    """測試重複日誌的寫入流程只有兩次 Redis 往返（累加次數 + 即時統計共用的 pipeline）"""
+    result = run(["ingest_hit"], rounds=1)["results"]["ingest_hit"]
+    assert result["round_trips"] == 2
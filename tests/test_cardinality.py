@@ -0,0 +1,41 @@
+import datetime
+import app.cardinality as cardinality
+import app.ingest as ingest
+from app.object import Log
+
+
+def _log(location: str, log: str, employees) -> Log:
+    return Log(
+        riskLevel=1, type=1, location=location, function="Login", log=log, employees=employees,
+        date=datetime.date(2025, 1, 2), time=datetime.time(10, 0)
+    )
+
+
+def test_record_adds_to_hourly_and_daily_buckets(redis):
+    """測試日誌加入目前小時與當日的 HyperLogLog，並設定保存期限"""
+    ingest.record_stats(_log("API", "timeout", ["emp001", "emp002"]))
+    ingest.record_stats(_log("API", "timeout", ["emp001"]))
+    ingest.record_stats(_log("DB", "deadlock", []))
+    now = datetime.datetime.now()
+    for granularity in (cardinality.GRANULARITY_HOUR, cardinality.GRANULARITY_DAY):
+        assert redis.pfcount(cardinality._key("fingerprint", granularity, now)) == 2
+        assert redis.pfcount(cardinality._key("location", granularity, now)) == 2
+        assert redis.pfcount(cardinality._key("employee", granularity, now)) == 2
+        assert redis.ttl(cardinality._key("fingerprint", granularity, now)) > 0
+
+
+def test_count_merges_buckets_in_range(redis):
+    """測試各時間桶的數量與整段範圍合併後的不重複數量"""
+    day1 = datetime.datetime(2025, 1, 1)
+    day2 = datetime.datetime(2025, 1, 2)
+    redis.pfadd(cardinality._key("location", cardinality.GRANULARITY_DAY, day1), "API", "DB")
+    redis.pfadd(cardinality._key("location", cardinality.GRANULARITY_DAY, day2), "API", "Batch")
+    result = cardinality.count("location", day1.date(), day2.date(), cardinality.GRANULARITY_DAY)
+    assert result == {
+        "total": 3,
+        "buckets": [{"bucket": "2025-01-01", "count": 2}, {"bucket": "2025-01-02", "count": 2}]
+    }
+    hourly = cardinality.count("location", day1.date(), day1.date(), cardinality.GRANULARITY_HOUR)
+    assert len(hourly["buckets"]) == 24
+    assert hourly["buckets"][0] == {"bucket": "2025-01-01T00:00", "count": 0}
+    assert hourly["total"] == 2
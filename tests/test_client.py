@@ -0,0 +1,119 @@
+import gzip
+import json
+import requests
+from push_client import PushClient
+
+
+class FakeResponse:
+    def __init__(self, status_code, results=None):
+        self.status_code = status_code
+        self.headers = {}
+        self.text = ""
+        self._results = results
+
+    def json(self):
+        return {"status": "success", "results": self._results}
+
+
+class FakeSession:
+    """記錄送出的批次，依序回傳預先設定的結果（沒有設定時全部成功）"""
+
+    def __init__(self, outcomes=None):
+        self.outcomes = list(outcomes or [])
+        self.batches = []
+        self.keys = []
+
+    def post(self, url, data=None, headers=None, timeout=None):
+        batch = json.loads(gzip.decompress(data))["logs"]
+        self.batches.append(batch)
+        self.keys.append(headers["Idempotency-Key"])
+        outcome = self.outcomes.pop(0) if self.outcomes else "ok"
+        if outcome == "error":
+            raise requests.ConnectionError("connection refused")
+        if isinstance(outcome, list):
+            return FakeResponse(200, outcome)
+        return FakeResponse(200, ["created"] * len(batch))
+
+    def close(self):
+        pass
+
+
+def test_local_aggregation():
+    """測試相同日誌在本機合併成次數後以一個批次送出"""
+    session = FakeSession()
+    client = PushClient("http://push", flush_interval=60, session=session)
+    for _ in range(5):
+        client.log(1, "API", "UserService", "連線失敗")
+    client.log(2, "API", "UserService", "連線失敗")
+    client.log(1, "API", "OrderService", "逾時")
+    assert client.flush()
+    client.close()
+
+    assert len(session.batches) == 1
+    batch = {entry["function"]: entry for entry in session.batches[0]}
+    assert batch["UserService"]["count"] == 6
+    assert batch["UserService"]["riskLevel"] == 2
+    assert batch["OrderService"]["count"] == 1
+    assert client.stats() == {"sent": 7, "dropped": 0, "pending": 0}
+
+
+def test_drop_oldest_when_full():
+    """測試超過記憶體上限時丟棄最舊的日誌"""
+    client = PushClient("http://push", flush_interval=60, max_pending=2, session=FakeSession())
+    client.log(1, "A", "F", "first")
+    client.log(1, "A", "F", "second")
+    client.log(1, "A", "F", "third")
+    assert client.pending() == 2
+    assert client.stats()["dropped"] == 1
+    client.close()
+
+
+def test_retry_reuses_idempotency_key_and_requeues_rejected():
+    """測試連線失敗時以相同冪等鍵重試，伺服器拒絕的項目放回緩衝區"""
+    session = FakeSession(["error", ["created", "rejected"]])
+    client = PushClient("http://push", flush_interval=60, backoff=0, session=session)
+    client.log(1, "A", "F", "first")
+    client.log(1, "A", "F", "second")
+    assert not client.flush()
+    assert session.keys[0] == session.keys[1]
+    assert client.pending() == 1
+    assert client.flush()
+    assert session.batches[-1][0]["log"] == "second"
+    client.close()
+
+
+def test_emergency_sent_synchronously():
+    """測試緊急日誌不經緩衝區直接送出"""
+    session = FakeSession()
+    client = PushClient("http://push", flush_interval=60, session=session)
+    assert client.log(3, "DB", "Primary", "資料庫無回應")
+    assert len(session.batches) == 1
+    assert client.pending() == 0
+    client.close()
+
+
+def test_unsent_batch_resent_with_same_key():
+    """測試重試後仍送不出去的批次保留冪等鍵，之後原封不動重送（不與新的日誌合併）"""
+    session = FakeSession(["error", "error"])
+    client = PushClient("http://push", flush_interval=60, max_retries=1, backoff=0, session=session)
+    client.log(1, "A", "F", "first")
+    assert not client.flush()
+    client.log(1, "A", "F", "first")
+    assert client.pending() == 2
+    assert client.flush()
+    assert session.keys[2] == session.keys[0]
+    assert session.batches[2] == session.batches[0]
+    assert session.keys[3] != session.keys[0]
+    assert session.batches[3][0]["count"] == 1
+    client.close()
+
+
+def test_failed_emergency_resent_with_same_key():
+    """測試同步送出失敗的緊急日誌由背景以相同的冪等鍵重送"""
+    session = FakeSession(["error", "error"])
+    client = PushClient("http://push", flush_interval=60, backoff=0, session=session)
+    assert not client.log(3, "DB", "Primary", "資料庫無回應")
+    assert client.flush()
+    assert session.keys == [session.keys[0]] * 3
+    assert client.stats() == {"sent": 1, "dropped": 0, "pending": 0}
+    client.close()
@@ -0,0 +1,74 @@
+import app.constants as constants
+import app.cooldown as cooldown
+import app.database as db
+import app.message as msg
+from app.object import Message
+
+
+def test_acquire_without_fingerprint_is_not_limited():
+    """測試沒有日誌指紋的通知（例如升級通知）不受冷卻限制"""
+    assert cooldown.acquire(None, "Email", "emp001@example.com") == (True, 0)
+
+
+def test_annotate_reports_suppressed_count():
+    """測試通知內容附上冷卻期間未發送的次數"""
+    assert cooldown.annotate("位置:API", 0) == "位置:API"
+    assert cooldown.annotate("位置:API", 42).endswith("（冷卻期間另有 42 次相同通知未發送）")
+
+
+def test_apply_cooldown_skips_and_groups_recipients(monkeypatch):
+    """測試冷卻中的收件者略過，其餘依附上的未發送次數分組"""
+    state = {"a@example.com": (True, 0), "b@example.com": (False, 0), "c@example.com": (True, 5), "d@example.com": (True, 0)}
+    calls = []
+
+    def acquire(fingerprint, channel, recipient, skipped=0):
+        calls.append((fingerprint, channel, recipient))
+        return state[recipient]
+
+    monkeypatch.setattr(cooldown, "acquire", acquire)
+    message = Message(title="系統通知", body="位置:API", employees=[], fingerprint="abc")
+    grouped = msg.apply_cooldown(message, constants.Channel.EMAIL, list(state))
+    assert grouped == {
+        "位置:API": ["a@example.com", "d@example.com"],
+        "位置:API\n（冷卻期間另有 5 次相同通知未發送）": ["c@example.com"]
+    }
+    assert calls[0] == ("abc", "Email", "a@example.com")
+
+
+def test_gate_skips_enqueue_until_first_recipient_cooldown_ends(redis, monkeypatch):
+    """測試所有收件者都在冷卻中時不排入推播通道，未排入的次數加到各收件者下一則通知"""
+    monkeypatch.setattr(cooldown, "_scripts", {})
+    monkeypatch.setattr(cooldown.settings, "COOLDOWN_ENABLED", True)
+    monkeypatch.setattr(cooldown.settings, "COOLDOWN_BASE_SECONDS", 60)
+    assert cooldown.gate("abc") == (True, 0)
+    assert cooldown.acquire("abc", "Email", "a@example.com") == (True, 0)
+    assert cooldown.acquire("abc", "SMS", "0912345678") == (True, 0)
+    assert 0 < redis.pttl(cooldown._gate_keys("abc")[0]) <= 60000
+
+    assert cooldown.gate("abc") == (False, 0)
+    assert cooldown.gate("abc") == (False, 0)
+    # 其中一個收件者的冷卻結束後閘門開啟，帶出未排入的次數
+    redis.delete(*cooldown._gate_keys("abc")[:1], cooldown._keys("abc", "Email", "a@example.com")[0])
+    assert cooldown.gate("abc") == (True, 2)
+    assert cooldown.acquire("abc", "Email", "a@example.com", 2) == (True, 2)
+    assert cooldown.acquire("abc", "SMS", "0912345678", 2) == (False, 0)
+    assert redis.hget(cooldown._keys("abc", "SMS", "0912345678")[1], "suppressed") == "3"
+    # 閘門縮短為仍在冷卻中的收件者結束冷卻的時間（不是剛發送的收件者的 120 秒）
+    assert 0 < redis.pttl(cooldown._gate_keys("abc")[0]) <= 60000
+
+
+def test_notify_log_does_not_enqueue_while_gate_closed(monkeypatch):
+    """測試閘門關閉時不排入推播通道也不排定升級"""
+    message = Message(title="系統通知", body="位置:API", employees=["emp001"], fingerprint="abc")
+    dispatched = []
+    monkeypatch.setattr(db, "build_notification", lambda log, created, increment: message.model_copy())
+    monkeypatch.setattr(db.dispatcher, "dispatch", lambda message, log_id, risk_level: dispatched.append(message.suppressed))
+    monkeypatch.setattr(db.escalation, "schedule", lambda log_id, message, risk_level: True)
+    log = type("Log", (), {"id": 1, "riskLevel": 1})()
+
+    monkeypatch.setattr(cooldown, "gate", lambda fingerprint: (False, 0))
+    db.notify_log(log, False)
+    assert dispatched == []
+    monkeypatch.setattr(cooldown, "gate", lambda fingerprint: (True, 4))
+    db.notify_log(log, False)
+    assert dispatched == [4]
@@ -0,0 +1,169 @@
+import datetime
+import threading
+import pytest
+import app.counter as counter
+import app.database as db
+from app.object import Log
+from app.settings import settings
+
+SCRIPTS = ("_HIT_SCRIPT", "_SEED_SCRIPT", "_DRAIN_SCRIPT", "_RESTORE_SCRIPT", "_FORGET_SCRIPT")
+
+
+@pytest.fixture
+def store(redis, monkeypatch):
+    """Lua 腳本改註冊到記憶體內的 Redis，資料庫以 dict 代替"""
+    for name in SCRIPTS:
+        monkeypatch.setattr(counter, name, redis.register_script(getattr(counter, name).script))
+    monkeypatch.setattr(settings, "COUNTER_COALESCE_ENABLED", True)
+    monkeypatch.setattr(counter, "_orphans", {})
+    state = {"rows": {}, "next_id": 7, "ingests": 0, "flushes": [], "fail": False}
+
+    def ingest_log(log, increment=1):
+        state["ingests"] += 1
+        fingerprint = log.fingerprint()
+        created = fingerprint not in state["rows"]
+        if created:
+            state["rows"][fingerprint] = {"id": state["next_id"], "count": 0}
+            state["next_id"] += 1
+        row = state["rows"][fingerprint]
+        row["count"] += increment
+        return log.model_copy(update={"id": row["id"], "count": row["count"]}), created
+
+    def add_log_counts(ids, increments):
+        if state["fail"]:
+            return None
+        state["flushes"].append(dict(zip(ids, increments)))
+        by_id = {row["id"]: row for row in state["rows"].values()}
+        for log_id, increment in zip(ids, increments):
+            if log_id in by_id:
+                by_id[log_id]["count"] += increment
+        return [log_id for log_id in ids if log_id not in by_id]
+
+    monkeypatch.setattr(db, "ingest_log", ingest_log)
+    monkeypatch.setattr(db, "add_log_counts", add_log_counts)
+    return state
+
+
+def _log() -> Log:
+    return Log(
+        riskLevel=1, type=1, location="API", function="UserService", log="連線失敗", employees=["emp001"],
+        date=datetime.date(2025, 1, 2), time=datetime.time(10, 0)
+    )
+
+
+def _key(log: Log) -> str:
+    return counter.KEY_PREFIX + log.fingerprint()
+
+
+def test_add_seeds_cache_then_counts_in_redis(store, redis):
+    """測試第一次走 ingest_log 建立快取，之後只在 Redis 累加"""
+    log = _log()
+    stored, created = counter.add(log)
+    assert created and stored.id == 7 and stored.count == 1
+    stored, created = counter.add(log, 2)
+    assert not created and stored.id == 7 and stored.count == 3
+    assert stored.employees == ["emp001"]
+    assert store["ingests"] == 1
+    assert redis.hget(_key(log), "pending") == "2"
+    assert redis.smembers(counter.DIRTY_KEY) == {log.fingerprint()}
+
+
+def test_seed_keeps_pending_counts(store, redis):
+    """測試快取過期重建時保留尚未寫回的次數"""
+    log = _log()
+    redis.hset(_key(log), mapping={"id": 7, "riskLevel": 1, "employees": "[]", "total": 5, "pending": 3})
+    total = counter._SEED_SCRIPT(keys=[_key(log)], args=[7, 1, "[]", 4, 60])
+    assert total == 7
+    assert redis.hget(_key(log), "pending") == "3"
+
+
+def test_flush_writes_pending_once(store, redis):
+    """測試寫回後歸零待寫回次數並清除標記"""
+    log = _log()
+    counter.add(log)
+    counter.add(log, 4)
+    assert counter.flush() == 1
+    assert store["flushes"] == [{7: 4}]
+    assert store["rows"][log.fingerprint()]["count"] == 5
+    assert redis.hget(_key(log), "pending") == "0"
+    assert redis.scard(counter.DIRTY_KEY) == 0
+    assert counter.flush() == 0
+
+
+def test_flush_failure_restores_pending(store, redis):
+    """測試寫回失敗時次數放回 Redis，下一輪再寫"""
+    log = _log()
+    counter.add(log)
+    counter.add(log, 2)
+    store["fail"] = True
+    assert counter.flush() == 0
+    assert redis.hget(_key(log), "pending") == "2"
+    assert redis.sismember(counter.DIRTY_KEY, log.fingerprint())
+    store["fail"] = False
+    assert counter.flush() == 1
+    assert store["flushes"] == [{7: 2}]
+
+
+def test_flush_failure_keeps_counts_when_cache_expired(store, redis, monkeypatch):
+    """測試寫回失敗且快取已過期時，次數保留在程序內並於下一輪寫回"""
+    log = _log()
+    counter.add(log)
+    counter.add(log, 3)
+
+    def add_log_counts(ids, increments):
+        redis.delete(_key(log))
+        return None
+
+    original = db.add_log_counts
+    monkeypatch.setattr(db, "add_log_counts", add_log_counts)
+    assert counter.flush() == 0
+    assert counter._orphans == {7: 3}
+    monkeypatch.setattr(db, "add_log_counts", original)
+    assert counter.flush() == 1
+    assert store["flushes"] == [{7: 3}]
+    assert counter._orphans == {}
+
+
+def test_flush_drops_cache_of_missing_rows(store, redis):
+    """測試資料列已被封存時清除快取，下一次事件重新建立資料列"""
+    log = _log()
+    counter.add(log)
+    counter.add(log)
+    del store["rows"][log.fingerprint()]
+    assert counter.flush() == 1
+    assert not redis.exists(_key(log))
+    stored, created = counter.add(log)
+    assert created and stored.id == 8 and stored.count == 1
+    assert store["ingests"] == 2
+
+
+def test_invalidate_keeps_reseeded_cache(store, redis):
+    """測試快取已換成新的資料列時不會被清除"""
+    log = _log()
+    counter.add(log)
+    assert not counter.invalidate(log.fingerprint(), 99)
+    assert redis.exists(_key(log))
+    assert counter.invalidate(log.fingerprint(), 7)
+    assert not redis.exists(_key(log))
+
+
+def test_flusher_flushes_periodically_and_on_stop(monkeypatch):
+    """測試背景執行緒定期寫回，停止時再寫回一次"""
+    calls = []
+    ticked = threading.Event()
+
+    def flush():
+        calls.append(1)
+        if len(calls) >= 2:
+            ticked.set()
+        return 0
+
+    monkeypatch.setattr(counter, "flush", flush)
+    flusher = counter.CounterFlusher(10)
+    flusher.start()
+    assert ticked.wait(2)
+    before = len(calls)
+    flusher.stop()
+    assert not flusher.is_alive()
+    # 停止時最後再寫回一次
+    assert len(calls) > before
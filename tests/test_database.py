@@ -0,0 +1,100 @@
+import datetime
+import pytest
+import app.database as db
+from app.object import Log, make_fingerprint
+from app.settings import settings
+
+
+def _log(riskLevel: int = 1, count: int = 1) -> Log:
+    return Log(
+        riskLevel=riskLevel,
+        type=1,
+        location="API",
+        function="UserService",
+        log="連線失敗",
+        employees=["emp001"],
+        date=datetime.date(2024, 12, 7),
+        time=datetime.time(14, 30),
+        count=count
+    )
+
+
+def test_fingerprint_ignores_non_key_fields():
+    """測試指紋只由 location + function + log 決定"""
+    a = _log(riskLevel=1, count=1)
+    b = _log(riskLevel=3, count=9)
+    assert a.fingerprint() == b.fingerprint()
+    assert a.fingerprint() == make_fingerprint("API", "UserService", "連線失敗")
+    assert make_fingerprint("a", "bc", "d") != make_fingerprint("ab", "c", "d")
+
+
+def test_need_send_uses_returned_count():
+    """測試閾值判斷直接使用原子化累加後的次數"""
+    assert not db.need_send(_log(riskLevel=1, count=4))
+    assert db.need_send(_log(riskLevel=1, count=5))
+    assert db.need_send(_log(riskLevel=2, count=3))
+    assert db.need_send(_log(riskLevel=3, count=1))
+
+
+def test_to_tsquery_prefix_tokens():
+    """測試搜尋字串轉為前綴比對的 tsquery，並去除特殊字元"""
+    assert db.to_tsquery("User conn") == "user:* & conn:*"
+    assert db.to_tsquery("timeout's & (x|y)") == "timeout:* & s:* & x:* & y:*"
+    assert db.to_tsquery("  !!  ") == ""
+
+
+@pytest.fixture
+def replica(monkeypatch):
+    """以兩個標記物件代替主資料庫與唯讀複本"""
+    primary, replica = object(), object()
+    monkeypatch.setattr(db, "supabase", primary)
+    monkeypatch.setattr(db, "replica", replica)
+    monkeypatch.setattr(db, "_replica_state", {
+        "lag": None, "checked_at": 0.0, "down_until": 0.0,
+        "replica_reads": 0, "primary_reads": 0, "fallbacks": 0
+    })
+    monkeypatch.setattr(settings, "REPLICA_MAX_STALENESS_SECONDS", 10)
+    monkeypatch.setattr(settings, "REPLICA_LAG_CHECK_SECONDS", 0)
+    monkeypatch.setattr(settings, "REPLICA_RETRY_SECONDS", 30)
+    return primary, replica
+
+
+def test_read_uses_replica_within_staleness_budget(replica, monkeypatch):
+    """測試複寫延遲在容許範圍內時使用複本，超過時改用主資料庫"""
+    primary, rep = replica
+    monkeypatch.setattr(db, "replica_lag", lambda: 2.0)
+    assert db.read(lambda client: client) is rep
+    assert db.read(lambda client: client, max_staleness=1) is primary
+    monkeypatch.setattr(db, "replica_lag", lambda: 60.0)
+    assert db.read(lambda client: client) is primary
+    stats = db.replica_stats()
+    assert stats["replica_reads"] == 1 and stats["primary_reads"] == 2
+    assert stats["lag_seconds"] == 60.0
+
+
+def test_read_falls_back_to_primary_on_replica_error(replica, monkeypatch):
+    """測試複本查詢失敗時改用主資料庫重試，並暫停使用複本"""
+    primary, rep = replica
+    monkeypatch.setattr(db, "replica_lag", lambda: 0.0)
+    calls = []
+
+    def query(client):
+        calls.append(client)
+        if client is rep:
+            raise ConnectionError("replica down")
+        return "ok"
+
+    assert db.read(query) == "ok"
+    assert calls == [rep, primary]
+    assert db.read(query) == "ok"
+    assert calls[-1] is primary and len(calls) == 3
+    stats = db.replica_stats()
+    assert not stats["available"] and stats["fallbacks"] == 1
+
+
+def test_read_without_replica_uses_primary(monkeypatch):
+    """測試未設定複本時一律使用主資料庫"""
+    primary = object()
+    monkeypatch.setattr(db, "supabase", primary)
+    monkeypatch.setattr(db, "replica", None)
+    assert db.reader() is primary
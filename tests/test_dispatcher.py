@@ -0,0 +1,56 @@
+import threading
+import time
+import app.constants as constants
+import app.dispatcher as dispatcher
+from app.object import Message
+
+
+def test_lane_for_risk_level():
+    """測試風險等級對應的推播通道"""
+    assert dispatcher.lane_for(3) == constants.Lane.EMERGENCY
+    assert dispatcher.lane_for(2) == constants.Lane.HIGH
+    assert dispatcher.lane_for(1) == constants.Lane.LOW
+    assert dispatcher.lane_for(0) == constants.Lane.LOW
+
+
+def test_emergency_not_blocked_by_low_storm(monkeypatch):
+    """測試大量普通通知排隊時，緊急通知仍由保留的 worker 立即發送"""
+    release = threading.Event()
+    delivered = []
+
+    def fake_send(message, log_id=None):
+        if message.title == "low":
+            release.wait(5)
+        delivered.append(message.title)
+
+    monkeypatch.setattr(dispatcher.msg, "send_message", fake_send)
+    dispatcher.start()
+    try:
+        for i in range(50):
+            dispatcher.dispatch(Message(title="low", body="", employees=[]), i, constants.RISK_LEVEL_LOW)
+        dispatcher.dispatch(Message(title="emergency", body="", employees=[]), 99, constants.RISK_LEVEL_EMERGENCY)
+        deadline = time.monotonic() + 2
+        while "emergency" not in delivered and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert delivered == ["emergency"]
+        assert dispatcher.stats()["emergency"]["completed"] == 1
+    finally:
+        release.set()
+        dispatcher.stop()
+
+
+def test_stop_does_not_hang_when_lane_is_full(monkeypatch):
+    """測試通道佇列已滿時停止不會卡住"""
+    release = threading.Event()
+    monkeypatch.setattr(dispatcher.msg, "send_message", lambda message, log_id=None: release.wait(5))
+    lane = dispatcher.DispatchLane(constants.Lane.LOW, workers=1, queue_size=2)
+    lane.start()
+    try:
+        for i in range(3):
+            lane.put(Message(title="low", body="", employees=[]), i)
+        assert lane.queue.full()
+        started = time.monotonic()
+        lane.stop(timeout=0.5)
+        assert time.monotonic() - started < 2
+    finally:
+        release.set()
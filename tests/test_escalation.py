@@ -0,0 +1,92 @@
+import app.escalation as escalation
+from app.object import Message
+
+
+def test_step_employees_widen_audience(monkeypatch):
+    """測試升級人員逐階段累加，之後的階段沿用最後一組"""
+    monkeypatch.setattr(escalation.settings, "ESCALATION_STEP_EMPLOYEES", "lead01; manager01,lead01")
+    assert escalation.step_employees(0) == ["lead01"]
+    assert escalation.step_employees(1) == ["lead01", "manager01"]
+    assert escalation.step_employees(5) == ["lead01", "manager01"]
+
+
+def test_escalated_message_keeps_channels_and_adds_employees(monkeypatch):
+    """測試升級通知標示階段、保留渠道並加入升級人員"""
+    monkeypatch.setattr(escalation.settings, "ESCALATION_STEP_EMPLOYEES", "lead01")
+    message = Message(title="系統緊急通知", body="位置:DB", employees=["emp001", "lead01"], channels=["SMS"], risk_level=3)
+    alert = {"message": message.model_dump(), "risk_level": 3, "step": 0, "notified_at": 100.0}
+    escalated = escalation.escalated_message(alert)
+    assert escalated.title == "系統緊急通知（第 1 次升級，尚未確認）"
+    assert escalated.employees == ["emp001", "lead01"]
+    assert escalated.channels == ["SMS"]
+    assert escalated.received_at == 100.0
+
+
+def test_schedule_skips_non_emergency(monkeypatch):
+    """測試未達風險等級門檻、沒有日誌 ID 或沒有升級階段時不排定升級"""
+    message = Message(title="t", body="b", employees=["emp001"])
+    assert escalation.schedule(1, message, 2) is False
+    assert escalation.schedule(None, message, 3) is False
+    monkeypatch.setattr(escalation.settings, "ESCALATION_STEPS_MINUTES", "")
+    assert escalation.schedule(1, message, 3) is False
+
+
+def _scheduled(redis, monkeypatch):
+    """排定一筆升級，回傳發送的升級通知"""
+    monkeypatch.setattr(escalation, "_claim_script", None)
+    monkeypatch.setattr(escalation.settings, "ESCALATION_STEPS_MINUTES", "5,15")
+    monkeypatch.setattr(escalation.settings, "ESCALATION_LEASE_SECONDS", 60)
+    message = Message(title="系統緊急通知", body="位置:DB", employees=["emp001"], risk_level=3)
+    assert escalation.schedule(7, message, 3)
+    return redis.zscore(escalation.DUE_KEY, "7")
+
+
+def test_fire_due_keeps_escalation_when_dispatch_fails(redis, monkeypatch):
+    """測試發送失敗時保留租約，租約到期後重新發送同一階段"""
+    due = _scheduled(redis, monkeypatch)
+
+    def fail(message, log_id, risk_level):
+        raise RuntimeError("worker crashed")
+
+    monkeypatch.setattr(escalation.dispatcher, "dispatch", fail)
+    assert escalation.fire_due(due) == 0
+    assert redis.zscore(escalation.DUE_KEY, "7") == due + 60
+    # 租約期間其他機器不會重複處理
+    assert escalation.fire_due(due + 30) == 0
+
+    sent = []
+    monkeypatch.setattr(escalation.dispatcher, "dispatch", lambda message, log_id, risk_level: sent.append(message.title))
+    assert escalation.fire_due(due + 60) == 1
+    assert sent == ["系統緊急通知（第 1 次升級，尚未確認）"]
+    # 下一個階段以第一次通知的時間排定（第 15 分鐘）
+    assert redis.zscore(escalation.DUE_KEY, "7") == due + 10 * 60
+
+    assert escalation.fire_due(due + 10 * 60) == 1
+    assert redis.zscore(escalation.DUE_KEY, "7") is None
+    assert not redis.exists(f"{escalation.ALERT_PREFIX}7")
+
+
+def test_fire_due_does_not_reschedule_acknowledged(redis, monkeypatch):
+    """測試發送期間已確認的通知不會重新排入下一個階段"""
+    due = _scheduled(redis, monkeypatch)
+    monkeypatch.setattr(escalation.dispatcher, "dispatch", lambda message, log_id, risk_level: escalation.acknowledge(7, "emp001"))
+    assert escalation.fire_due(due) == 1
+    assert redis.zscore(escalation.DUE_KEY, "7") is None
+    assert not redis.exists(f"{escalation.ALERT_PREFIX}7")
+
+
+def test_ack_only_applies_to_the_pending_alert(redis, monkeypatch):
+    """測試確認只取消當時待升級的通知，同一個日誌之後的緊急通知重新排定升級"""
+    _scheduled(redis, monkeypatch)
+    assert escalation.acknowledge(7, "emp001")["cancelled"] is True
+    assert escalation.acknowledgement(7)["by"] == "emp001"
+
+    message = Message(title="系統緊急通知", body="位置:DB", employees=["emp001"], risk_level=3)
+    assert escalation.schedule(7, message, 3)
+    assert redis.zscore(escalation.DUE_KEY, "7") is not None
+    assert escalation.acknowledgement(7) is None
+
+    # 沒有待升級的通知時不記錄確認
+    result = escalation.acknowledge(8, "emp001")
+    assert result["acknowledged"] is False
+    assert escalation.acknowledgement(8) is None
@@ -56,3 +56,172 @@ def test_get_logs_statistics():
     assert "total_logs" in data
     assert "by_risk_level" in data
     assert "by_location" in data
+
+
+def test_logs_statistics_route_aggregates_chunks(monkeypatch):
+    """測試 /logs/statistics 不會被 /logs/{log_id} 攔截，並以分批彙總計算統計"""
+    import app.main as main
+    monkeypatch.setattr(main.versions, "current", lambda scopes: None)
+    chunks = [
+        [{"riskLevel": 1, "location": "API", "function": "Login", "count": 3}, {"riskLevel": 3, "location": "DB", "function": "Query", "count": 1}],
+        [{"riskLevel": 1, "location": "API", "function": "Logout", "count": 2}]
+    ]
+    monkeypatch.setattr(main.aggregate, "log_chunks", lambda date_from, date_to, filters, columns: iter(chunks))
+    r = client.get("/logs/statistics?date_from=2025-01-01&date_to=2025-01-07")
+    assert r.status_code == 200
+    data = r.json()
+    assert data["period"] == {"from": "2025-01-01", "to": "2025-01-07"}
+    assert data["total_logs"] == 3
+    assert data["by_risk_level"] == {"1": 2, "3": 1}
+    assert data["by_location"] == {"API": 2, "DB": 1}
+
+
+def test_admission_state():
+    """測試准入狀態查詢"""
+    r = client.get("/logs/admission")
+    assert r.status_code == 200
+    data = r.json()
+    assert data["state"] == "normal"
+    assert "inflight" in data
+    assert "rejected" in data
+
+
+def test_logs_shed_when_overloaded(monkeypatch):
+    """測試嚴重過載時拒絕普通日誌並回傳 Retry-After"""
+    import app.admission as admission
+    monkeypatch.setattr(admission, "load", lambda: 10.0)
+    r = client.get("/logs?riskLevel=1&type=1&location=API&function=UserService&log=timeout")
+    assert r.status_code == 429
+    assert "Retry-After" in r.headers
+    assert client.get("/logs/admission").json()["rejected"]["1"] >= 1
+
+
+def test_lookup_logs_embeds_notifications(monkeypatch):
+    """測試批次查詢日誌並以單次查詢附加通知歷史"""
+    import app.database as db
+    calls = []
+    monkeypatch.setattr(db, "get_logs_by_ids", lambda ids: [{"id": 2}, {"id": 1}])
+
+    def fake_histories(log_ids):
+        calls.append(log_ids)
+        return {1: [{"id": 10, "log_id": 1}]}
+
+    monkeypatch.setattr(db, "get_notifications_by_log_ids", fake_histories)
+    r = client.post("/logs/lookup", json={"ids": [1, 2, 3, 1], "include_notifications": True})
+    assert r.status_code == 200
+    data = r.json()
+    assert [row["id"] for row in data["data"]] == [1, 2]
+    assert data["data"][0]["notifications"] == [{"id": 10, "log_id": 1}]
+    assert data["data"][1]["notifications"] == []
+    assert data["missing"] == [3]
+    assert calls == [[1, 2]]
+
+
+def test_logs_idempotent_replay(monkeypatch):
+    """測試帶相同 Idempotency-Key 的重試直接回傳第一次的結果"""
+    import app.idempotency as idempotency
+    import app.ingest as ingest
+    stored = {"status": "updated", "message": "日誌次數已更新", "count": 3}
+    monkeypatch.setattr(idempotency, "begin", lambda key: stored if key == "retry-1" else None)
+
+    def fail_process(*args, **kwargs):
+        raise AssertionError("重試不應再次寫入")
+
+    monkeypatch.setattr(ingest, "process", fail_process)
+    r = client.get(
+        "/logs?riskLevel=1&type=1&location=API&function=UserService&log=timeout",
+        headers={"Idempotency-Key": "retry-1"}
+    )
+    assert r.status_code == 200
+    assert r.json() == stored
+    assert r.headers["Idempotent-Replayed"] == "true"
+
+
+def test_logs_batch_gzip(monkeypatch):
+    """測試 gzip 批次寫入依每筆的 count 累加次數"""
+    import gzip
+    import json
+    import app.ingest as ingest
+    calls = []
+
+    def fake_process(log, increment=1):
+        calls.append((log.function, increment))
+        return log, len(calls) == 1
+
+    monkeypatch.setattr(ingest, "process", fake_process)
+    body = gzip.compress(json.dumps({"logs": [
+        {"riskLevel": 1, "location": "API", "function": "UserService", "log": "timeout", "count": 7},
+        {"riskLevel": 2, "location": "API", "function": "OrderService", "log": "timeout"}
+    ]}).encode("utf-8"))
+    r = client.post("/logs/batch", content=body, headers={"Content-Encoding": "gzip", "Content-Type": "application/json"})
+    assert r.status_code == 200
+    data = r.json()
+    assert data["results"] == ["created", "updated"]
+    assert data["accepted"] == 2
+    assert calls == [("UserService", 7), ("OrderService", 1)]
+
+    r = client.post("/logs/batch", json={"logs": [{"riskLevel": 1, "location": "API", "function": "F", "log": ""}]})
+    assert r.status_code == 422
+
+
+def test_logs_batch_error_mid_batch_keeps_idempotency_result(monkeypatch):
+    """測試批次中途發生非預期錯誤時，已寫入的項目保留結果並完成冪等鍵，重試不會重複計數"""
+    import app.idempotency as idempotency
+    import app.ingest as ingest
+    calls = []
+    stored = {}
+
+    def fake_process(log, increment=1):
+        calls.append(log.function)
+        if log.function == "Broken":
+            raise RuntimeError("unexpected")
+        return log, True
+
+    monkeypatch.setattr(ingest, "process", fake_process)
+    monkeypatch.setattr(idempotency, "begin", lambda key: stored.get(key))
+    monkeypatch.setattr(idempotency, "complete", lambda key, result: stored.__setitem__(key, result))
+    monkeypatch.setattr(idempotency, "release", lambda key: stored.pop(key, None))
+    body = {"logs": [
+        {"riskLevel": 1, "location": "API", "function": "UserService", "log": "timeout"},
+        {"riskLevel": 1, "location": "API", "function": "Broken", "log": "timeout"},
+        {"riskLevel": 1, "location": "API", "function": "OrderService", "log": "timeout"}
+    ]}
+    r = client.post("/logs/batch", json=body, headers={"Idempotency-Key": "batch-1"})
+    assert r.status_code == 200
+    assert r.json()["results"] == ["created", "failed", "created"]
+    assert stored["batch-1"]["failed"] == 1
+
+    r = client.post("/logs/batch", json=body, headers={"Idempotency-Key": "batch-1"})
+    assert r.headers["Idempotent-Replayed"] == "true"
+    assert calls == ["UserService", "Broken", "OrderService"]
+
+
+def test_logs_timeseries_clamps_future_date_to(monkeypatch):
+    """測試時間序列的結束時間不超過現在，超過時間桶上限時回傳 400"""
+    import app.main as main
+    queried = []
+    monkeypatch.setattr(main.timeseries, "query", lambda start, end, bucket: queried.append((start, end, bucket)) or {"bucket": bucket})
+    date_from = (datetime.datetime.now() - datetime.timedelta(hours=1)).isoformat(timespec="minutes")
+    r = client.get(f"/logs/timeseries?date_from={date_from}&date_to=3000-01-01T00:00&bucket=minute")
+    assert r.status_code == 200
+    assert queried[0][1] <= datetime.datetime.now()
+
+    monkeypatch.setattr(main.settings, "TS_MAX_QUERY_BUCKETS", 30)
+    r = client.get(f"/logs/timeseries?date_from={date_from}&date_to=3000-01-01T00:00&bucket=minute")
+    assert r.status_code == 400
+    assert len(queried) == 1
+
+
+def test_logs_cardinality_rejects_ranges_outside_retention(monkeypatch):
+    """測試基數統計只能查詢保存期限內的日期，結束日期不超過今天"""
+    import app.main as main
+    queried = []
+    monkeypatch.setattr(main.cardinality, "count", lambda dimension, date_from, date_to, granularity: queried.append((date_from, date_to)) or {})
+    r = client.get("/logs/cardinality?date_from=0001-01-01&date_to=9999-12-31")
+    assert r.status_code == 400
+    week_ago = datetime.date.today() - datetime.timedelta(days=6)
+    r = client.get(f"/logs/cardinality?date_from={week_ago}&date_to=9999-12-31&granularity=hour")
+    assert r.status_code == 200
+    assert queried == [(week_ago, datetime.date.today())]
+    r = client.get(f"/logs/cardinality?date_from={week_ago - datetime.timedelta(days=2)}&granularity=hour")
+    assert r.status_code == 400
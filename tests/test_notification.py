@@ -0,0 +1,77 @@
+import app.constants as constants
+import app.notification as notification
+from app.notification import NotificationHistory
+from app.object import Message
+
+
+def _row(channel, risk_level, received, delivered, status=constants.STATUS_SUCCESS):
+    return {
+        "channel": channel,
+        "risk_level": risk_level,
+        "status": status,
+        "received_at": f"2025-01-02T10:00:{received}",
+        "triggered_at": f"2025-01-02T10:00:{received}",
+        "enqueued_at": f"2025-01-02T10:00:{received}",
+        "first_attempt_at": f"2025-01-02T10:00:{received}",
+        "delivered_at": f"2025-01-02T10:00:{delivered}" if delivered else None
+    }
+
+
+def test_delivery_context_fills_history():
+    """測試發送中的通知會在儲存歷史時帶入渠道、風險等級與各階段時間"""
+    message = Message(title="t", body="b", employees=[], risk_level=3, received_at=1.0, triggered_at=2.0, enqueued_at=3.0)
+    token = notification.begin_delivery(message)
+    try:
+        notification.begin_attempt(constants.Channel.SMS)
+        history = NotificationHistory(log_id=1, recipient="0900", message="ok", status=constants.STATUS_SUCCESS, sent_at="2025-01-02T10:00:00")
+        notification._apply_delivery(history)
+    finally:
+        notification.end_delivery(token)
+    assert history.channel == "SMS"
+    assert history.risk_level == 3
+    assert history.received_at is not None and history.enqueued_at is not None
+    assert history.first_attempt_at is not None
+    assert history.delivered_at == "2025-01-02T10:00:00"
+
+    other = NotificationHistory(log_id=1, recipient="x", message="m", status=constants.STATUS_FAILED)
+    notification._apply_delivery(other)
+    assert other.channel is None and other.delivered_at is None
+
+
+def test_parallel_webhook_attempts_recorded_per_channel():
+    """測試多個 Webhook 渠道並行發送時，每個渠道的通知歷史都帶入各自的嘗試時間"""
+    message = Message(title="t", body="b", employees=[], risk_level=1)
+    token = notification.begin_delivery(message)
+    try:
+        notification.begin_attempt(constants.Channel.EMAIL)
+        notification.begin_attempt(constants.Channel.TEAMS, constants.Channel.SLACK)
+        rows = {
+            channel: NotificationHistory(log_id=1, recipient=channel, message="ok", status=constants.STATUS_SUCCESS, channel=channel)
+            for channel in ("Teams", "Slack", "Email", "Discord")
+        }
+        unknown = NotificationHistory(log_id=1, recipient="x", message="m", status=constants.STATUS_FAILED)
+        for history in [*rows.values(), unknown]:
+            notification._apply_delivery(history)
+    finally:
+        notification.end_delivery(token)
+    assert rows["Teams"].first_attempt_at is not None
+    assert rows["Slack"].first_attempt_at == rows["Teams"].first_attempt_at
+    assert rows["Email"].first_attempt_at is not None
+    assert rows["Discord"].first_attempt_at is None
+    # 並行發送多個渠道時不替沒有渠道的通知歷史猜測渠道
+    assert unknown.channel is None
+
+
+def test_latency_report_by_channel_and_slo():
+    """測試依渠道 / 風險等級計算延遲百分位數與緊急通知 SLO 達成率"""
+    rows = [
+        _row("Email", 1, "00", "02"),
+        _row("SMS", 3, "00", "01"),
+        _row("SMS", 3, "00", "09"),
+        _row("SMS", 3, "00", None, status=constants.STATUS_FAILED),
+    ]
+    report = notification.latency_report(rows, slo_ms=5000)
+    assert report["by_channel"]["Email"]["end_to_end_ms"]["p50"] == 2000.0
+    assert report["by_channel"]["SMS"]["end_to_end_ms"]["count"] == 2
+    assert report["by_risk_level"]["3"]["end_to_end_ms"]["p99"] == 9000.0
+    assert report["emergency_slo"] == {"slo_ms": 5000, "total": 3, "met": 1, "met_rate": 33.33}
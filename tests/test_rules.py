@@ -0,0 +1,70 @@
+import datetime
+import json
+import app.rules as rules
+from app.object import AlertRule, Log
+
+
+def _log(location="API", function="UserService", riskLevel=1, count=1):
+    return Log(
+        riskLevel=riskLevel, type=0, location=location, function=function, log="timeout",
+        employees=[], date=datetime.date(2025, 1, 2), time=datetime.time(10, 0), count=count
+    )
+
+
+def test_match_prefers_specific_patterns():
+    """測試完全比對優先於前綴比對，較長的前綴優先於較短的前綴與 *"""
+    index = rules.RuleIndex([
+        AlertRule(name="all", threshold=50),
+        AlertRule(name="api", location="API*", threshold=40),
+        AlertRule(name="api-user", location="API-User*", threshold=30),
+        AlertRule(name="exact", location="API-User-01", function="Login", threshold=20),
+    ])
+    assert index.match("API-User-01", "Login", 1).name == "exact"
+    assert index.match("API-User-01", "Logout", 1).name == "api-user"
+    assert index.match("API-Order", "Login", 1).name == "api"
+    assert index.match("Batch", "Login", 1).name == "all"
+
+
+def test_match_priority_risk_levels_and_defaults():
+    """測試 priority 優先、風險等級篩選與沒有規則符合時的內建門檻"""
+    index = rules.RuleIndex([
+        AlertRule(name="specific", location="API", function="UserService", threshold=2),
+        AlertRule(name="important", location="API*", risk_levels=[2], threshold=1, priority=10),
+        AlertRule(name="disabled", location="Batch", enabled=False),
+    ])
+    assert index.match("API", "UserService", 2).name == "important"
+    assert index.match("API", "UserService", 1).name == "specific"
+    assert index.match("Batch", "Job", 1).name == "default-low"
+    assert index.match("Batch", "Job", 3).name == "default-emergency"
+    assert len(index.rules) == 2
+
+
+def test_evaluate_threshold_window_and_immediate():
+    """測試累計門檻、時間窗門檻與立即通知"""
+    index = rules.RuleIndex([
+        AlertRule(name="burst", location="API", threshold=3, window_seconds=60),
+        AlertRule(name="critical", location="DB", immediate=True, threshold=10),
+    ])
+    assert rules.evaluate(_log(location="Batch", count=4), False, index=index) is None
+    assert rules.evaluate(_log(location="Batch", count=5), False, index=index).name == "default-low"
+
+    windows = {}
+
+    def window_count(rule, fingerprint, increment):
+        windows[fingerprint] = windows.get(fingerprint, 0) + increment
+        return windows[fingerprint]
+
+    assert rules.evaluate(_log(count=100), False, index=index, window_count=window_count) is None
+    assert rules.evaluate(_log(count=101), False, 2, index=index, window_count=window_count).name == "burst"
+
+    assert rules.evaluate(_log(location="DB"), True, index=index).name == "critical"
+    assert rules.evaluate(_log(location="DB", count=2), False, index=index) is None
+
+
+def test_load_file(tmp_path):
+    """測試讀取規則檔"""
+    path = tmp_path / "rules.json"
+    path.write_text(json.dumps({"rules": [{"name": "api", "location": "API*", "threshold": 2, "channels": ["Email"]}]}), encoding="utf-8")
+    loaded = rules.load_file(str(path))
+    assert loaded[0].name == "api"
+    assert loaded[0].channels == ["Email"]
@@ -0,0 +1,143 @@
+import datetime
+import app.database as db
+import app.sharding as sharding
+from app.object import Log
+from app.settings import settings
+
+
+def test_hash_ring_is_deterministic():
+    """測試相同分片清單下，同一指紋永遠由同一分片負責"""
+    ring = sharding.HashRing(["shard-0", "shard-1", "shard-2"], 64)
+    other = sharding.HashRing(["shard-2", "shard-0", "shard-1"], 64)
+    for i in range(200):
+        fingerprint = f"fp-{i}"
+        assert ring.node_for(fingerprint) == other.node_for(fingerprint)
+    assert sharding.HashRing([], 64).node_for("fp-0") is None
+
+
+def test_hash_ring_minimal_movement():
+    """測試新增分片時只有少部分指紋換分片，且只會換到新分片"""
+    before = sharding.HashRing(["shard-0", "shard-1", "shard-2"], 64)
+    after = sharding.HashRing(["shard-0", "shard-1", "shard-2", "shard-3"], 64)
+    fingerprints = [f"fp-{i}" for i in range(2000)]
+    moved = [fp for fp in fingerprints if before.node_for(fp) != after.node_for(fp)]
+    assert all(after.node_for(fp) == "shard-3" for fp in moved)
+    assert len(moved) < len(fingerprints) * 0.4
+
+
+def test_payload_round_trip():
+    """測試排入分片佇列的日誌可以完整還原"""
+    log = Log(
+        riskLevel=2, type=1, location="API", function="UserService", log="連線失敗", employees=["emp001"],
+        date=datetime.date(2025, 1, 2), time=datetime.time(3, 4, 5)
+    )
+    decoded, increment = sharding._decode(sharding._encode(log, 3))
+    assert decoded.fingerprint() == log.fingerprint()
+    assert decoded.employees == ["emp001"]
+    assert decoded.date == log.date and decoded.time == log.time
+    assert increment == 3
+
+
+def _log(text: str) -> Log:
+    return Log(
+        riskLevel=1, type=1, location="API", function="UserService", log=text, employees=[],
+        date=datetime.date(2025, 1, 2), time=datetime.time(3, 4, 5)
+    )
+
+
+def _worker(monkeypatch, results):
+    """建立只有一個分片的 worker，add_log_counts 依序回傳 results（None 表示寫回失敗）"""
+    worker = sharding.ShardWorker("shard-0")
+    worker.ring = sharding.HashRing(["shard-0"], 64)
+    flushed = []
+
+    def add_log_counts(ids, increments):
+        flushed.append(dict(zip(ids, increments)))
+        return results.pop(0)
+
+    def ingest_log(log, increment=1):
+        return log.model_copy(update={"id": len(worker.cache) + 1, "count": increment}), True
+
+    monkeypatch.setattr(db, "add_log_counts", add_log_counts)
+    monkeypatch.setattr(db, "ingest_log", ingest_log)
+    return worker, flushed
+
+
+def test_rebalance_keeps_moved_entries_until_flush_succeeds(monkeypatch):
+    """測試重新平衡時寫回失敗不移出快取，次數保留到下一次寫回成功"""
+    worker, flushed = _worker(monkeypatch, [None, []])
+    logs = [_log(f"error {i}") for i in range(20)]
+    for log in logs:
+        worker.add(log, 1)
+        worker.add(log, 2)
+    ring = sharding.HashRing(["shard-0", "shard-1"], 64)
+    moved = [log.fingerprint() for log in logs if ring.node_for(log.fingerprint()) == "shard-1"]
+    assert moved
+
+    worker.rebalance(ring)
+    assert all(worker.cache[fp].pending == 2 for fp in moved)
+    assert worker.flush()
+    assert flushed[1] == flushed[0] and set(flushed[0].values()) == {2}
+    assert not any(fp in worker.cache for fp in moved)
+    assert len(worker.cache) == len(logs) - len(moved)
+
+
+def test_cache_eviction_waits_for_successful_flush(monkeypatch):
+    """測試超過快取上限時寫回失敗不移出指紋，寫回成功後才縮回上限"""
+    monkeypatch.setattr(settings, "SHARD_CACHE_SIZE", 2)
+    worker, flushed = _worker(monkeypatch, [None, []])
+    for i in range(3):
+        log = _log(f"error {i}")
+        worker.add(log, 1)
+        worker.add(log, 1)
+    assert len(worker.cache) == 3
+    worker.add(_log("error 3"), 1)
+    assert len(worker.cache) == 2
+    assert flushed == [{1: 1, 2: 1}, {1: 1, 2: 1, 3: 1}]
+
+
+def test_submit_returns_none_when_redis_fails(monkeypatch):
+    """測試 Redis 無法使用時 submit 回傳 None（由呼叫端改為直接寫入）"""
+    def fail(*args, **kwargs):
+        raise ConnectionError("redis down")
+
+    monkeypatch.setattr(sharding, "_ring", None)
+    monkeypatch.setattr(sharding, "live_shards", fail)
+    assert sharding.submit(_log("error"), 1) is None
+
+    monkeypatch.setattr(sharding, "_ring", sharding.HashRing(["shard-0"], 64))
+    monkeypatch.setattr(sharding, "_ring_loaded_at", float("inf"))
+    monkeypatch.setattr(db.r, "rpush", fail)
+    assert sharding.submit(_log("error"), 1) is None
+
+
+def test_run_survives_redis_errors_and_bad_payloads(redis, monkeypatch):
+    """測試 Redis 錯誤與無法解析的事件不會讓 worker 結束，之後的事件照常處理並在結束時寫回"""
+    worker, flushed = _worker(monkeypatch, [[]])
+    handled = []
+    monkeypatch.setattr(sharding.ingest, "handle", lambda stored, created, increment: handled.append(stored.log))
+    monkeypatch.setattr(sharding, "ERROR_BACKOFF_SECONDS", 0)
+    blpop = redis.blpop
+    failures = [ConnectionError("redis down")]
+
+    def flaky_blpop(*args, **kwargs):
+        if failures:
+            raise failures.pop()
+        return blpop(*args, **kwargs)
+
+    monkeypatch.setattr(redis, "blpop", flaky_blpop)
+    redis.rpush(worker.queue_key, "not json", sharding._encode(_log("error 1"), 1), sharding._encode(_log("error 1"), 2))
+    worker.run(stop_after=0.5)
+    assert handled == ["error 1", "error 1"]
+    assert flushed == [{1: 2}]
+    assert redis.zscore(sharding.MEMBERS_KEY, "shard-0") is None
+
+
+def test_stop_flushes_before_exit(redis, monkeypatch):
+    """測試收到 SIGTERM（stop）後結束迴圈並寫回次數"""
+    worker, flushed = _worker(monkeypatch, [[]])
+    worker.add(_log("error"), 1)
+    worker.add(_log("error"), 4)
+    worker.stop()
+    worker.run()
+    assert flushed == [{1: 4}]
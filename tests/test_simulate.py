@@ -0,0 +1,88 @@
+import app.constants as constants
+import app.rules as rules
+import app.simulate as simulate
+from app.object import AlertRule
+
+CONTACTS = [
+    {"no": "emp001", "contactWay": constants.PUBLISHER_EMAIL | constants.PUBLISHER_LINE, "email": "emp001@example.com"},
+    {"no": "emp002", "contactWay": constants.PUBLISHER_SMS, "phone": "0900000000"}
+]
+
+
+def _row(risk_level, log, count, time="10:00:00", employees=("emp001",)):
+    return {
+        "riskLevel": risk_level, "location": "API", "function": "UserService", "log": log,
+        "employees": list(employees), "date": "2025-01-02", "time": time, "count": count
+    }
+
+
+def test_expand_orders_and_spreads_events():
+    """測試資料列依次數展開並依時間排序，spread 會平均分散每筆的次數"""
+    rows = [_row(1, "b", 1, time="10:00:05"), _row(1, "a", 4, time="10:00:00")]
+    bases, event_ts, row_index = simulate.expand(rows, spread=8)
+    assert len(bases) == 2
+    assert row_index.tolist() == [1, 1, 1, 0, 1]
+    assert (event_ts[1:] >= event_ts[:-1]).all()
+    assert event_ts[1] - event_ts[0] == 2
+
+
+def test_replay_applies_thresholds_and_routes():
+    """測試重播套用通知門檻並依聯絡方式統計渠道與收件者"""
+    rows = [_row(1, "timeout", 6), _row(3, "db down", 1, employees=("emp001", "emp002"))]
+    simulator = simulate.Simulator(CONTACTS)
+    bases, event_ts, row_index = simulate.expand(rows)
+    simulator.replay(bases, event_ts, row_index)
+    report = simulator.report(event_ts)
+
+    # 普通等級第 5、6 次通知，緊急等級新增時通知
+    assert report["notifications"]["total"] == 3
+    assert report["notifications"]["by_lane"] == {"low": 2, "emergency": 1}
+    assert report["channels"] == {"Email": 3, "Line": 3, "SMS": 1}
+    assert report["recipients"] == {"emp001": 3, "emp002": 1}
+
+    strict = simulate.Simulator(CONTACTS, index=rules.RuleIndex([AlertRule(name="strict", risk_levels=[1], threshold=10)]))
+    strict.replay(bases, event_ts, row_index)
+    assert strict.report(event_ts)["notifications"]["total"] == 1
+
+
+def test_replay_rule_window_in_simulated_time():
+    """測試規則時間窗以模擬時間計算，並只發送規則指定的渠道"""
+    rule = AlertRule(name="burst", location="API", threshold=2, window_seconds=10, channels=["Line"])
+    rows = [_row(1, "timeout", 1, time=f"10:00:{second:02d}") for second in (0, 5, 30, 50)]
+    simulator = simulate.Simulator(CONTACTS, index=rules.RuleIndex([rule]))
+    simulator.replay(*simulate.expand(rows))
+    report = simulator.report(simulate.expand(rows)[1])
+    # 只有 10:00:05 在 10 秒的時間窗內達到 2 次
+    assert report["notifications"]["total"] == 1
+    assert report["channels"] == {"Line": 1}
+
+
+def test_replay_counts_each_webhook_url(monkeypatch):
+    """測試 Webhook 渠道依 route_webhooks 每個 URL 計算一次發送，沒有 URL 的不計入"""
+    monkeypatch.setattr(simulate.settings, "TEAMS_URL", "https://teams.example.com/global")
+    monkeypatch.setattr(simulate.settings, "SLACK_URL", "")
+    monkeypatch.setattr(simulate.settings, "DISCORD_URL", "")
+    contacts = [
+        {"no": "emp001", "contactWay": constants.PUBLISHER_TEAMS | constants.PUBLISHER_SLACK, "slack": "https://slack.example.com/1"},
+        {"no": "emp002", "contactWay": constants.PUBLISHER_TEAMS | constants.PUBLISHER_SLACK, "teams": "https://teams.example.com/2"},
+        {"no": "emp003", "contactWay": constants.PUBLISHER_DISCORD}
+    ]
+    rows = [_row(3, "db down", 1, employees=("emp001", "emp002", "emp003"))]
+    simulator = simulate.Simulator(contacts)
+    bases, event_ts, row_index = simulate.expand(rows)
+    simulator.replay(bases, event_ts, row_index)
+    report = simulator.report(event_ts)
+    # Teams: 全域 URL + emp002 自己的 URL；Slack: emp001 自己的 URL（emp002 沒有可用 URL）；Discord 沒有 URL
+    assert report["channels"] == {"Teams": 2, "Slack": 1}
+
+
+def test_lane_model_queue_and_drop():
+    """測試通道模型的排隊延遲與佇列滿時丟棄"""
+    lane = simulate.LaneModel(constants.Lane.LOW, workers=1, queue_size=1)
+    assert lane.offer(0, 1.0) == 1.0
+    assert lane.offer(0, 1.0) == 2.0
+    assert lane.offer(0, 1.0) is None
+    report = lane.report()
+    assert report["dropped"] == 1
+    assert report["max_queue_depth"] == 1
+    assert report["latency_ms"]["p99"] == 2000.0
@@ -0,0 +1,58 @@
+import datetime
+import app.syslog_listener as syslog_listener
+
+LEVELS = [3, 3, 3, 2, 1, 1, 1, 0]
+
+
+def test_parse_rfc5424():
+    """測試解析 RFC 5424 訊息（含結構化資料與 BOM）"""
+    log = syslog_listener.parse(
+        '<11>1 2025-01-02T03:04:05.123Z web01 order-service 1234 ID47 [exampleSDID@32473 iut="3"] ﻿連線失敗',
+        LEVELS
+    )
+    assert log.riskLevel == 2
+    assert log.location == "web01"
+    assert log.function == "order-service"
+    assert log.log == "連線失敗"
+    assert log.time.microsecond == 0
+
+
+def test_parse_rfc3164():
+    """測試解析 RFC 3164 訊息"""
+    log = syslog_listener.parse("<34>Oct 11 22:14:15 mymachine su[230]: 'su root' failed for lonvick", LEVELS)
+    assert log.riskLevel == 3
+    assert log.location == "mymachine"
+    assert log.function == "su"
+    assert log.log == "'su root' failed for lonvick"
+    assert log.date.month == 10 and log.date.day == 11
+    assert log.time == datetime.time(22, 14, 15)
+
+
+def test_parse_severity_mapping():
+    """測試嚴重度對應為 0 的訊息與無效訊息會被丟棄"""
+    assert syslog_listener.parse("<15>1 - host app - - - debug", LEVELS) is None
+    assert syslog_listener.parse("no priority", LEVELS) is None
+    assert syslog_listener.parse("<14>plain message", LEVELS).log == "plain message"
+
+
+def test_split_frames():
+    """測試 TCP 串流的長度前綴與換行分隔框架"""
+    frames, rest = syslog_listener.split_frames(b"<14>first\n5 <14>a<14>second\r\n<14>par")
+    assert frames == [b"<14>first", b"<14>a", b"<14>second"]
+    assert rest == b"<14>par"
+
+    frames, rest = syslog_listener.split_frames(b"12 <14>abc")
+    assert frames == []
+    assert rest == b"12 <14>abc"
+
+
+def test_split_frames_rejects_oversized_length_prefix():
+    """測試長度前綴超過上限或為 0 時回傳 None（關閉連線），之前已完整的訊息仍會交出"""
+    frames, rest = syslog_listener.split_frames(b"<14>first\n99999999999999999999 <14>abc")
+    assert frames == [b"<14>first"]
+    assert rest is None
+    oversized = str(syslog_listener.MAX_MESSAGE_SIZE + 1).encode()
+    assert syslog_listener.split_frames(oversized + b" <14>abc") == ([], None)
+    assert syslog_listener.split_frames(b"0 <14>abc") == ([], None)
+    limit = str(syslog_listener.MAX_MESSAGE_SIZE).encode()
+    assert syslog_listener.split_frames(limit + b" <14>abc") == ([], limit + b" <14>abc")
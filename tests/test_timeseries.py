@@ -0,0 +1,29 @@
+import datetime
+import numpy as np
+import app.timeseries as timeseries
+
+
+def test_auto_bucket():
+    """測試依查詢範圍自動選擇時間桶"""
+    now = datetime.datetime(2024, 12, 7, 14, 30)
+    assert timeseries.auto_bucket(now - datetime.timedelta(hours=1), now) == timeseries.BUCKET_MINUTE
+    assert timeseries.auto_bucket(now - datetime.timedelta(days=2), now) == timeseries.BUCKET_HOUR
+    assert timeseries.auto_bucket(now - datetime.timedelta(days=30), now) == timeseries.BUCKET_DAY
+
+
+def test_query_downsamples_hours_to_days(monkeypatch):
+    """測試小時時間桶向下取樣為日時間桶"""
+    start = datetime.datetime(2024, 12, 6, 12, 15)
+    end = datetime.datetime(2024, 12, 7, 23, 0)
+    first = timeseries.floor(start, timeseries.BUCKET_HOUR)
+    hours = int((end - first) / datetime.timedelta(hours=1)) + 1
+    matrix = np.zeros((hours, len(timeseries.RISK_LEVELS)), dtype=np.int64)
+    matrix[:, 1] = 1
+    matrix[:, 3] = 2
+    monkeypatch.setattr(timeseries, "_load", lambda source, s, e: (first, matrix))
+
+    result = timeseries.query(start, end, timeseries.BUCKET_DAY)
+    assert result["timestamps"] == ["2024-12-06T00:00:00", "2024-12-07T00:00:00"]
+    assert result["by_risk_level"]["1"] == [12, 24]
+    assert result["by_risk_level"]["3"] == [24, 48]
+    assert result["total"] == [36, 72]
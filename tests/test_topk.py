@@ -0,0 +1,61 @@
+import datetime
+import pytest
+import app.ingest as ingest
+import app.topk as topk
+from app.object import Log
+from app.settings import settings
+
+
+@pytest.fixture
+def store(redis, monkeypatch):
+    """Lua 腳本改載入到記憶體內的 Redis，每個時間桶只保留 2 個計數器"""
+    monkeypatch.setattr(topk, "_script_loaded", False)
+    monkeypatch.setattr(settings, "TOPK_CAPACITY", 2)
+    return redis
+
+
+def _log(location: str) -> Log:
+    return Log(
+        riskLevel=1, type=1, location=location, function="Login", log="timeout", employees=[],
+        date=datetime.date(2025, 1, 2), time=datetime.time(10, 0)
+    )
+
+
+def test_record_replaces_minimum_and_tracks_error(store):
+    """測試計數器已滿時取代最小的項目，新項目繼承其次數並記錄誤差"""
+    ingest.record_stats(_log("API"), 5)
+    ingest.record_stats(_log("DB"), 2)
+    ingest.record_stats(_log("Batch"), 1)
+    key, err_key = topk._keys("location", topk._bucket(datetime.datetime.now()))
+    assert store.zrange(key, 0, -1, withscores=True) == [("Batch", 3.0), ("API", 5.0)]
+    assert store.hgetall(err_key) == {"Batch": "2"}
+    assert store.ttl(key) > 0
+    assert topk.top("location", 1, 2) == [
+        {"value": "API", "count": 5, "error": 0},
+        {"value": "Batch", "count": 3, "error": 2},
+    ]
+
+
+def test_top_adds_bucket_minimum_where_item_is_absent(store):
+    """測試合併時段時，項目不在已滿的時間桶中要加上該桶的最小分數作為上限與誤差"""
+    now = datetime.datetime.now()
+    # 這一小時的桶已滿且沒有 DB（DB 在此桶最多 4 次）；上一小時的桶未滿（沒有 Batch 即為 0 次）
+    current, _ = topk._keys("location", topk._bucket(now))
+    previous, _ = topk._keys("location", topk._bucket(now - datetime.timedelta(hours=1)))
+    store.zadd(current, {"Batch": 4, "API": 9})
+    store.zadd(previous, {"DB": 7})
+    assert topk.top("location", 2, 3) == [
+        {"value": "DB", "count": 11, "error": 4},
+        {"value": "API", "count": 9, "error": 0},
+        {"value": "Batch", "count": 4, "error": 0},
+    ]
+
+
+def test_script_reloaded_after_redis_restart(store):
+    """測試 Redis 清除腳本快取後，下一筆日誌重新載入腳本"""
+    ingest.record_stats(_log("API"), 1)
+    store.script_flush()
+    ingest.record_stats(_log("API"), 1)
+    ingest.record_stats(_log("API"), 1)
+    key, _ = topk._keys("location", topk._bucket(datetime.datetime.now()))
+    assert store.zscore(key, "API") == 2
@@ -0,0 +1,95 @@
+from types import SimpleNamespace
+import time
+from fastapi.testclient import TestClient
+import app.archive as archive
+import app.database as db
+import app.main as main
+import app.versions as versions
+from app.settings import settings
+
+client = TestClient(main.app)
+
+
+def test_matches_uses_weak_comparison():
+    """測試 If-None-Match 比對（清單、弱 ETag 與 *）"""
+    assert versions.matches('"a", W/"b"', '"b"')
+    assert versions.matches("*", '"b"')
+    assert not versions.matches('"a"', '"b"')
+    assert not versions.matches(None, '"b"')
+    assert not versions.matches('"a"', None)
+
+
+def test_etag_changes_with_version_and_query(monkeypatch):
+    """測試 ETag 隨資料版本與查詢參數改變，版本不可用時不回傳"""
+    state = {"versions": [("e1", 1, 0.0)]}
+    monkeypatch.setattr(versions, "current", lambda scopes: state["versions"])
+    monkeypatch.setattr(db, "replica", None)
+    tag = versions.etag("/logs/list", [("limit", "10")], [versions.LOGS])
+    assert tag == versions.etag("/logs/list", [("limit", "10")], [versions.LOGS])
+    assert tag != versions.etag("/logs/list", [("limit", "20")], [versions.LOGS])
+    state["versions"] = [("e1", 2, 0.0)]
+    assert tag != versions.etag("/logs/list", [("limit", "10")], [versions.LOGS])
+    state["versions"] = [("e2", 1, 0.0)]
+    assert tag != versions.etag("/logs/list", [("limit", "10")], [versions.LOGS])
+    state["versions"] = None
+    assert versions.etag("/logs/list", [("limit", "10")], [versions.LOGS]) is None
+
+
+def test_etag_skipped_while_replica_may_be_stale(monkeypatch):
+    """測試使用唯讀複本時，最近才變更的範圍不回傳 ETag"""
+    monkeypatch.setattr(db, "replica", object())
+    monkeypatch.setattr(settings, "REPLICA_MAX_STALENESS_SECONDS", 10)
+    monkeypatch.setattr(versions, "current", lambda scopes: [("e1", 1, time.time())])
+    assert versions.etag("/logs/list", [], [versions.LOGS]) is None
+    monkeypatch.setattr(versions, "current", lambda scopes: [("e1", 1, time.time() - 60)])
+    assert versions.etag("/logs/list", [], [versions.LOGS]) is not None
+
+
+def test_unchanged_poll_returns_304_without_query(monkeypatch):
+    """測試 If-None-Match 相符時回傳 304 且不查詢資料庫"""
+    state = {"versions": [("e1", 1, 0.0)], "queries": 0}
+    monkeypatch.setattr(versions, "current", lambda scopes: state["versions"])
+    monkeypatch.setattr(db, "replica", None)
+    monkeypatch.setattr(archive, "covers", lambda table, date_from: False)
+
+    def call_by_filters(table_name, filters, read_only=False):
+        state["queries"] += 1
+        return SimpleNamespace(data=[{"id": 1, "channel": "Email", "status": 1}])
+
+    monkeypatch.setattr(db, "call_by_filters", call_by_filters)
+    url = "/notifications/statistics?date_from=2025-01-01&date_to=2025-01-31"
+    first = client.get(url)
+    assert first.status_code == 200 and "ETag" in first.headers
+    second = client.get(url, headers={"If-None-Match": first.headers["ETag"]})
+    assert second.status_code == 304
+    assert second.headers["ETag"] == first.headers["ETag"]
+    assert state["queries"] == 1
+    # 有新的通知歷史寫入後重新查詢
+    state["versions"] = [("e1", 2, 0.0)]
+    third = client.get(url, headers={"If-None-Match": first.headers["ETag"]})
+    assert third.status_code == 200 and third.headers["ETag"] != first.headers["ETag"]
+    assert state["queries"] == 2
+
+
+def test_logs_statistics_returns_304_when_unchanged(monkeypatch):
+    """測試 /logs/statistics 帶 If-None-Match 且日誌版本未變更時回傳 304，不重新彙總"""
+    state = {"versions": [("e1", 1, 0.0)], "scans": 0}
+    monkeypatch.setattr(versions, "current", lambda scopes: state["versions"])
+    monkeypatch.setattr(db, "replica", None)
+
+    def log_chunks(date_from, date_to, filters, columns):
+        state["scans"] += 1
+        return iter([[{"riskLevel": 1, "location": "API", "function": "Login", "count": 1}]])
+
+    monkeypatch.setattr(main.aggregate, "log_chunks", log_chunks)
+    url = "/logs/statistics?date_from=2025-01-01&date_to=2025-01-07"
+    first = client.get(url)
+    assert first.status_code == 200 and "ETag" in first.headers
+    second = client.get(url, headers={"If-None-Match": first.headers["ETag"]})
+    assert second.status_code == 304
+    assert state["scans"] == 1
+    # 有新的日誌寫入後重新彙總
+    state["versions"] = [("e1", 2, 0.0)]
+    third = client.get(url, headers={"If-None-Match": first.headers["ETag"]})
+    assert third.status_code == 200 and third.headers["ETag"] != first.headers["ETag"]
+    assert state["scans"] == 2
@@ -0,0 +1,89 @@
+import threading
+import time
+import app.constants as constants
+import app.message as msg
+import app.webhooks as webhooks
+
+
+def test_route_webhooks_uses_own_url_and_merges_teams(monkeypatch):
+    """測試員工自訂 URL 優先、相同 URL 合併，未設定時使用全域 URL"""
+    monkeypatch.setattr(msg.settings, "SLACK_URL", "https://hooks.slack.com/global")
+    monkeypatch.setattr(msg.settings, "DISCORD_URL", "")
+    contacts = [
+        {"no": "emp001", "contactWay": constants.PUBLISHER_SLACK, "slack": "https://hooks.slack.com/team-a"},
+        {"no": "emp002", "contactWay": constants.PUBLISHER_SLACK | constants.PUBLISHER_DISCORD, "slack": "https://hooks.slack.com/team-a"},
+        {"no": "emp003", "contactWay": constants.PUBLISHER_SLACK},
+        {"no": "emp004", "contactWay": constants.PUBLISHER_EMAIL, "slack": "https://hooks.slack.com/unused"}
+    ]
+    routes = msg.route_webhooks(contacts)
+    assert routes[constants.Channel.SLACK] == {
+        "https://hooks.slack.com/team-a": ["emp001", "emp002"],
+        "https://hooks.slack.com/global": []
+    }
+    assert routes[constants.Channel.DISCORD] == {"": []}
+    assert constants.Channel.TEAMS not in routes
+    assert list(msg.route_webhooks(contacts, channels=["Discord"])) == [constants.Channel.DISCORD]
+
+
+def test_deliver_dedups_and_runs_concurrently(monkeypatch):
+    """測試相同 URL 與內容只發送一次，不同 URL 並行發送"""
+    calls = []
+    active = []
+    peak = []
+    lock = threading.Lock()
+
+    def post(url, payload):
+        with lock:
+            calls.append(url)
+            active.append(url)
+            peak.append(len(active))
+        time.sleep(0.05)
+        with lock:
+            active.remove(url)
+        return url != "https://b.example.com/2", "狀態碼: 500"
+
+    monkeypatch.setattr(webhooks, "post", post)
+    targets = [
+        ("https://a.example.com/1", {"text": "x"}),
+        ("https://b.example.com/2", {"text": "x"}),
+        ("https://a.example.com/1", {"text": "x"}),
+        ("https://a.example.com/1", {"text": "y"}),
+    ]
+    results = webhooks.deliver(targets, max_retries=1)
+    assert sorted(calls) == ["https://a.example.com/1", "https://a.example.com/1", "https://b.example.com/2"]
+    assert [ok for ok, _, _ in results] == [True, False, True, True]
+    assert max(peak) > 1
+
+
+def test_session_per_host():
+    """測試相同主機共用同一個 Session"""
+    first = webhooks.session_for("https://hooks.slack.com/services/a")
+    assert webhooks.session_for("https://hooks.slack.com/services/b") is first
+    assert webhooks.session_for("https://discord.com/api/webhooks/c") is not first
+
+
+def test_retry_backoff_does_not_hold_pool_slots(monkeypatch):
+    """測試重試前的退避不佔用執行緒池，只重送失敗的目的地，且各推播通道使用各自的執行緒池"""
+    calls = []
+    threads = {}
+    sleeping = []
+
+    def post(url, payload):
+        calls.append(url)
+        threads.setdefault(url, threading.current_thread().name)
+        return url != "https://b.example.com/2" or calls.count(url) == 3, None
+
+    def sleep(seconds):
+        # 退避期間執行緒池沒有進行中的請求
+        sleeping.append((seconds, threading.current_thread().name))
+
+    monkeypatch.setattr(webhooks, "post", post)
+    monkeypatch.setattr(webhooks.time, "sleep", sleep)
+    targets = [("https://a.example.com/1", {"text": "x"}), ("https://b.example.com/2", {"text": "x"}), ("https://c.example.com/3", {"text": "x"})]
+    results = webhooks.deliver(targets, lane=constants.Lane.EMERGENCY)
+    assert results == [(True, None, 0), (True, None, 2), (True, None, 0)]
+    assert sorted(calls) == ["https://a.example.com/1", "https://b.example.com/2", "https://b.example.com/2", "https://b.example.com/2", "https://c.example.com/3"]
+    assert [seconds for seconds, _ in sleeping] == [1, 2]
+    assert all(not name.startswith("webhook") for _, name in sleeping)
+    assert threads["https://a.example.com/1"].startswith("webhook-emergency")
+    assert webhooks._get_executor(constants.Lane.LOW) is not webhooks._get_executor(constants.Lane.EMERGENCY)